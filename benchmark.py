@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+
+from tsunami.benchmark.suite import baseline_path, compare, load_report, run_suite, suite
+from tsunami.config import OUTPUT_DIR
+
+# synthetic benchmark of the model, offline: the times of init_state, compute_routes, step and run_iteration
+# and the peak memory of each case, compared to the stored baseline of the size (if any). Each case runs in
+# a spawned process, which imports this script again
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="small", help="small, medium or large")
+    parser.add_argument("--output", default=os.path.join(OUTPUT_DIR, "benchmark.json"))
+    parser.add_argument("--baseline", default=None, help="baseline JSON, the stored one of the size by default")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each case, the fastest is kept")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="relative slowdown reported as a regression")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline of the size")
+    args = parser.parse_args()
+
+    report = run_suite(suite(args.size), path=args.output, repeat=args.repeat)
+
+    baseline = args.baseline or baseline_path(args.size)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline), exist_ok=True)
+        os.replace(args.output, baseline)
+        print(f"baseline saved to {baseline}")
+    elif os.path.exists(baseline):
+        comparison = compare(report, load_report(baseline), args.tolerance)
+        print(comparison.to_string(index=False))
+
+        regressions = comparison[comparison["regression"]]
+        if len(regressions) > 0:
+            print(f"{len(regressions)} regressions over {args.tolerance:.0%}")
+            sys.exit(1)
@@ -1,73 +1,49 @@
 import os
 
-import geopandas as gpd
-import osmnx as ox
-
-from tsunami.config import DATA_DIR
+from tsunami.config import DATA_DIR, OUTPUT_DIR
+from tsunami.preprocess.scenario import load_scenario
+from tsunami.simulation.hazard import load_inundation
 from tsunami.simulation.model import EvacuationModel
-from tsunami.simulation.plot import ModelViewer
-
-
-def compute_route_stats(agent):
-    path = agent.route
-
-    total_travel_time = 0
-    total_length = 0
-    avg_velocity = 0
-    for u, v in zip(path[0:], path[1:]):
-        edge_data = G.get_edge_data(u, v)
-        costs = [edge_data[edge]['cost'] for edge in edge_data]
-
-        min_cost = min(costs)
-        min_idx = costs.index(min_cost)
-        min_length = edge_data[min_idx]['length']
+from tsunami.simulation.recorder import TrajectoryRecorder, Trajectories
+from tsunami.simulation.render import FrameRenderer
 
-        velocity = edge_data[min_idx]['link'].v
 
-        avg_velocity += velocity
-        total_travel_time += min_cost
-        total_length += min_length
-    total_travel_time /= 3600
-    total_length /= 1000
-    avg_velocity /= len(path) - 1
-    print((
-        f"travel_time: {total_travel_time:.2f}h\t "
-        f"length: {total_length:.2f}Km\t "
-        f"average velocity: {avg_velocity:.2f}m/s"
-    ))
+# graph, districts and shelters compiled once in data/scenario-<hash>
+scenario = load_scenario(
+    os.path.join(DATA_DIR, "graph.xml"),
+    os.path.join(DATA_DIR, "districts.gpkg"),
+    os.path.join(DATA_DIR, "shelters.csv")
+)
 
-
-G = ox.load_graphml(os.path.join(DATA_DIR, "graph.xml"))
-for n in G.nodes:
-    G.nodes[n]["id"] = n
-
-population = gpd.read_file(os.path.join(DATA_DIR, "districts.gpkg"))
+G = scenario.graph()
+population = scenario.population()
+shelters = scenario.shelters()
+tsunami = load_inundation(os.path.join(DATA_DIR, "arrival.tif"), os.path.join(DATA_DIR, "depth.tif"))
 
 # TEST
 # population = population.head(1)
 # population["population"][0] = 1
 
-model = EvacuationModel(G, 1, 10)
-model.init_state(population=population, shelters=None, tsunami=None)
-
-a0 = model.agents[0]
-a0.orig = list(G)[13]
-a0.dest = list(G)[1]
-
-# model.compute_route(a0)
-# compute_route_stats(a0)
+recorder = TrajectoryRecorder(os.path.join(OUTPUT_DIR, "trajectories"))
+model = EvacuationModel(G, 1, 10, verbose=1, recorder=recorder)
+model.init_state(population=population, shelters=shelters, tsunami=tsunami,
+                 district_nodes=scenario.district_nodes(), shelter_nodes=scenario.shelter_nodes())
 
-viewer = ModelViewer(model)
-for i in range(10):
-    viewer.plot_agents()
-    model.step()
-viewer.plot_agents()
+# one frame per time step, rendered off screen (a GIF needs only Pillow, a video needs ffmpeg)
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+FrameRenderer(model).animate(os.path.join(OUTPUT_DIR, "agents.gif"), 10)
+model.finish()
 
-# model.compute_route(a0)
-# compute_route_stats(a0)
+# travel time, length and average velocity of every agent from the recorded trajectories
+stats = Trajectories(os.path.join(OUTPUT_DIR, "trajectories")).agent_stats()
+print((
+    f"moving time: {stats['moving_time'].mean() / 3600:.2f}h\t "
+    f"length: {stats['distance'].mean() / 1000:.2f}Km\t "
+    f"average velocity: {stats['speed'].mean():.2f}m/s"
+))
 
 # viewer = ModelViewer(model)
 # viewer.interactive_graph()
 # viewer.plot_street()
 # viewer.plot_population(save=True)
-# viewer.plot_route(a0.route, save=True, show=False)
+# viewer.plot_route(model.agents[0].route, save=True, show=False)
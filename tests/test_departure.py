@@ -0,0 +1,63 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+from affine import Affine
+from shapely.geometry import box
+
+from tsunami.benchmark.synthetic import CRS, grid_graph
+from tsunami.simulation.departure import Delay, DepartureModel, PendingAgents
+from tsunami.simulation.hazard import Inundation
+from tsunami.simulation.model import EvacuationModel
+
+ENGINES = [{}, {"agent_array": True}, {"agent_array": True, "node_transfer": True}]
+
+
+def flooded_exit():
+    # 5 agents on the corner node 0 of a grid, their route to the shelter starts with the edge 0 - 1, whose
+    # middle floods at 5s while the nodes stay dry. They leave at 20s
+    G = grid_graph(6, 6, jitter=0.0)
+
+    transform = Affine(5.0, 0.0, -100.0, 0.0, -5.0, 300.0)
+    arrival = np.full((80, 80), np.inf)
+    col, row = ~transform * (25.0, 0.0)
+    arrival[int(row), int(col)] = 5.0
+
+    population = gpd.GeoDataFrame({"name": ["corner"], "population": [5]}, geometry=[box(-5, -5, 5, 5)], crs=CRS)
+    shelters = gpd.GeoDataFrame({"name": ["shelter"], "capacity": [np.inf]},
+                                geometry=gpd.points_from_xy([250.0], [0.0]), crs=CRS)
+
+    return G, population, shelters, Inundation(arrival, transform, crs=CRS)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("mode", ["step", "event"])
+def test_stuck_agents_end_open_run(engine, mode):
+    G, population, shelters, tsunami = flooded_exit()
+    model = EvacuationModel(G, 1, None, seed=0, stall_time=100, **engine,
+                            departures=DepartureModel(warning=Delay("constant", scale=20.0)))
+    model.init_state(population=population, shelters=shelters, tsunami=tsunami)
+
+    if mode == "step":
+        while not model.finished() and model.k < 1000:
+            model.advance()
+    else:
+        model.run_iteration(mode)
+
+    assert model.finished()
+    assert model.k < 1000
+    assert model.evacuated_agents == 0 and model.dead_agents == 0
+    assert len(model.pending) == 5
+
+
+def test_pending_next_time_skips_stuck():
+    pending = PendingAgents(np.arange(3), np.array([0.0, 0.0, 50.0]))
+    pending.pop(10.0)
+
+    pending.hold([0, 1], [True, False])
+    assert pending.next_time(10.0) == 10.0
+
+    pending.hold([0, 1], [True, True])
+    assert pending.next_time(10.0) == 50.0
+
+    assert len(pending.release()) == 2
+    assert len(pending.held) == 0 and len(pending.stuck) == 0
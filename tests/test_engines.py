@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from tsunami.benchmark.synthetic import districts, inundation, shelters, street_graph
+from tsunami.simulation.departure import Delay, DepartureModel
+from tsunami.simulation.model import EvacuationModel
+
+# the engines moving the agents one at a time give the same results, the node transfer (which shares the free
+# space of the links among the entering ones) can differ from them and is only compared between the run modes
+ENGINES = {
+    "link": {},
+    "link_store": {"link_store": True},
+    "agent_array": {"agent_array": True},
+}
+MODES = ["step", "event"]
+
+
+def run(engine, mode, departures=False, **args):
+    G = street_graph("grid", 1000)
+    for _, _, d in G.edges(data=True):
+        d["walk_width"] = 0.5  # narrow streets, so that the links fill up
+
+    model = EvacuationModel(G, 1, 600, seed=1, **engine, **args,
+                            departures=DepartureModel(Delay("rayleigh", scale=60)) if departures else None)
+    model.init_state(population=districts(G, 3000), shelters=shelters(G, 4, 300), tsunami=inundation(G, arrival=60))
+    model.run_iteration(mode)
+
+    return model
+
+
+def result(model):
+    return model.evacuation_curve, model.dead_agents, model.shelters.occupancy.tolist()
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["at once", "departures"])
+def reference(request):
+    return request.param, result(run(ENGINES["link"], "step", request.param))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("mode", MODES)
+def test_engines_equal(reference, engine, mode):
+    departures, expected = reference
+    evacuated, dead, _ = expected
+    assert evacuated[-1] > 0 and dead > 0
+
+    assert result(run(ENGINES[engine], mode, departures)) == expected
+
+
+@pytest.mark.parametrize("departures", [False, True])
+@pytest.mark.parametrize("reroute_every", [None, 5])
+def test_node_transfer_modes_equal(departures, reroute_every):
+    args = {"agent_array": True, "node_transfer": True, "reroute_every": reroute_every, "reroute_tolerance": 0.0}
+    step, event = (run(args, mode, departures) for mode in MODES)
+
+    assert result(event) == result(step)
+    assert np.array_equal(event.agents.status, step.agents.status)
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_rerouting_engines_equal(mode):
+    args = {"reroute_every": 5, "reroute_tolerance": 0.0}
+    link, array = (run(ENGINES[engine], mode, **args) for engine in ("link", "agent_array"))
+
+    assert result(array) == result(link)
@@ -0,0 +1,23 @@
+import pandas as pd
+import pytest
+
+from tsunami.benchmark.synthetic import districts, shelters, street_graph
+from tsunami.simulation.metrics import MetricsCollector
+from tsunami.simulation.model import EvacuationModel
+
+
+def test_parquet_complete_after_run(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "metrics.parquet")
+
+    G = street_graph("grid", 400)
+    model = EvacuationModel(G, 1, 100, seed=0, agent_array=True, metrics=MetricsCollector(path, batch_size=16))
+    model.init_state(population=districts(G, 200), shelters=shelters(G), tsunami=None)
+
+    model.run_iteration()
+    assert len(pd.read_parquet(path)) == 100
+
+    # a continued run rewrites the closed file with the new rows
+    model.ST = 150
+    model.run_iteration()
+    assert len(pd.read_parquet(path)) == 150
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from tsunami.benchmark.synthetic import districts, inundation, shelters, street_graph
+from tsunami.simulation.departure import Delay, DepartureModel
+from tsunami.simulation.model import EvacuationModel
+from tsunami.simulation.partition import PartitionedModel
+
+
+def make_model(departures, reroute_every):
+    G = street_graph("grid", 1600)
+    for _, _, d in G.edges(data=True):
+        d["walk_width"] = 1.0  # narrow streets, so that the links fill up
+
+    model = EvacuationModel(G, 1, 600, seed=1, agent_array=True, node_transfer=True, reroute_every=reroute_every,
+                            departures=DepartureModel(Delay("rayleigh", scale=60)) if departures else None)
+    model.init_state(population=districts(G, 2000), shelters=shelters(G, 4, 300), tsunami=inundation(G, arrival=60))
+
+    return model
+
+
+@pytest.mark.parametrize("departures", [False, True])
+@pytest.mark.parametrize("reroute_every", [None, 5])
+def test_partitioned_equals_serial(departures, reroute_every):
+    serial = make_model(departures, reroute_every)
+    serial.run_iteration()
+
+    model = make_model(departures, reroute_every)
+    with PartitionedModel(model, parts=2) as partitioned:
+        partitioned.run()
+
+    assert serial.dead_agents > 0 and serial.evacuated_agents > 0
+    assert model.evacuation_curve == serial.evacuation_curve
+    assert model.dead_agents == serial.dead_agents
+    assert np.array_equal(model.shelters.occupancy, serial.shelters.occupancy)
+    assert np.array_equal(model.agents.status, serial.agents.status)
+    assert np.array_equal(model.agents.shelter, serial.agents.shelter)
+    assert model.metrics.to_frame().equals(serial.metrics.to_frame())
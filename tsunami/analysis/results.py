@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+
+from tsunami.simulation.agents import DEAD, EVACUATED
+from tsunami.simulation.recorder import Trajectories
+
+
+# Results of a recorded run (see TrajectoryRecorder), reduced in a single pass over the chunks to compact
+# arrays: the time (row) each agent evacuated or died with its district and shelter, where the dead agents
+# were, and the occupancy statistics of each link. The queries are group-bys over these arrays
+
+class RunResults:
+    def __init__(self, directory, congestion=0.9):
+        self.trajectories = Trajectories(directory)
+        self.meta = self.trajectories.meta
+        self.congestion = congestion  # used storage capacity over which a link is congested [0, 1]
+
+        static = self.trajectories.static
+        self.district = static["district"]
+        self.shelter = static["shelter"]
+        self.capacity = static["capacity"]
+        self.length = static["length"]
+
+        self.times = None  # simulation time of each recorded row
+        self.status = None  # last recorded status of each agent
+        self.evacuated_row = None  # row where each agent evacuated (-1 if it did not)
+        self.dead_row = None  # row where each agent died (-1 if it did not)
+        self.dead_x = None  # position and edge of the dead agents when they died
+        self.dead_y = None
+        self.dead_edge = None
+
+        self.used_mean = None  # mean used storage capacity of each link
+        self.used_max = None
+        self.congested_time = None  # time spent over the congestion threshold [s]
+        self.velocity_mean = None  # mean velocity of each link while occupied
+
+        self.__reduce()
+
+    def __reduce(self):
+        n, e = self.meta["agents"], self.meta["edges"]
+        columns = ["time"] + [c for c in ["x", "y", "edge", "status", "n", "v"] if c in self.meta["columns"]]
+
+        times = []
+        self.evacuated_row = np.full(n, -1, dtype=np.int64)
+        self.dead_row = np.full(n, -1, dtype=np.int64)
+        self.dead_x = np.full(n, np.nan)
+        self.dead_y = np.full(n, np.nan)
+        self.dead_edge = np.full(n, -1, dtype=np.int64)
+        self.status = np.zeros(n, dtype=np.int8)
+
+        used_sum, self.used_max = np.zeros(e), np.zeros(e)
+        congested_steps = np.zeros(e)
+        velocity_sum, occupied_steps = np.zeros(e), np.zeros(e)
+        capacity = np.maximum(self.capacity, 1)
+
+        for c in self.trajectories.chunks(columns):
+            offset = sum(len(t) for t in times)
+            times.append(c["time"])
+
+            if "status" in c:
+                self.__first_row(c["status"] == EVACUATED, offset, self.evacuated_row)
+                new = self.__first_row(c["status"] == DEAD, offset, self.dead_row)
+
+                # the dead agents stay where they died
+                rows = self.dead_row[new] - offset
+                self.dead_x[new] = c["x"][rows, new]
+                self.dead_y[new] = c["y"][rows, new]
+                self.dead_edge[new] = c["edge"][rows, new]
+
+                self.status = c["status"][-1]
+
+            if "n" in c:
+                used = c["n"] / capacity
+                used_sum += used.sum(axis=0)
+                self.used_max = np.maximum(self.used_max, used.max(axis=0))
+                congested_steps += (used >= self.congestion).sum(axis=0)
+
+                occupied = c["n"] > 0
+                velocity_sum += np.where(occupied, c["v"], 0.0).sum(axis=0)
+                occupied_steps += occupied.sum(axis=0)
+
+        self.times = np.concatenate(times) if len(times) > 0 else np.zeros(0)
+
+        rows = max(len(self.times), 1)
+        step = self.meta["T"] * self.meta["every"]
+        self.used_mean = used_sum / rows
+        self.congested_time = congested_steps * step
+        self.velocity_mean = np.divide(velocity_sum, occupied_steps, out=np.full(e, np.nan),
+                                       where=occupied_steps > 0)
+
+    @staticmethod
+    def __first_row(mask, offset, first):
+        # the agents whose mask is true for the first time in this chunk, their row is stored in first
+        new = np.flatnonzero((first < 0) & mask.any(axis=0))
+        first[new] = offset + np.argmax(mask[:, new], axis=0)
+
+        return new
+
+    def __groups(self, by):
+        if by == "district":
+            return self.district
+        if by == "shelter":
+            return self.shelter
+        if by is None:
+            return np.zeros(len(self.district), dtype=np.int32)
+
+        raise ValueError(f"Unknown grouping {by}!")
+
+    def evacuation_times(self):
+        # evacuation time [s] of every evacuated agent, with its district and shelter
+        agents = np.flatnonzero(self.evacuated_row >= 0)
+
+        return pd.DataFrame({
+            "agent": agents,
+            "district": self.district[agents],
+            "shelter": self.shelter[agents],
+            "time": self.times[self.evacuated_row[agents]] - self.times[0],
+        })
+
+    def time_distribution(self, by=None, percentiles=(5, 25, 50, 75, 95)):
+        # percentiles of the evacuation time of each group (district, shelter or None for everyone), with
+        # the number of agents and the evacuated fraction
+        groups = self.__groups(by)
+        times = self.evacuation_times()
+        times["group"] = groups[times["agent"].to_numpy()]
+
+        stats = times.groupby("group")["time"].quantile(np.array(percentiles) / 100).unstack()
+        stats.columns = [f"p{p}" for p in percentiles]
+        stats["mean"] = times.groupby("group")["time"].mean()
+
+        total = pd.Series(np.bincount(groups[groups >= 0]), name="agents")
+        stats = stats.reindex(total.index)
+        stats.insert(0, "agents", total)
+        stats.insert(1, "evacuated", times.groupby("group").size().reindex(total.index, fill_value=0))
+        stats.insert(2, "evacuated_fraction", stats["evacuated"] / stats["agents"].clip(lower=1))
+        stats.index.name = by
+
+        return stats
+
+    def clearance_curves(self, by="district", normalize=True):
+        # evacuated agents of each group (columns) at each recorded time (index), as a fraction of the
+        # group size when normalized
+        groups = self.__groups(by)
+        valid = groups >= 0
+        n_groups = int(groups[valid].max()) + 1 if np.any(valid) else 0
+        rows = len(self.times)
+
+        evacuated = valid & (self.evacuated_row >= 0)
+        counts = np.bincount(groups[evacuated].astype(np.int64) * rows + self.evacuated_row[evacuated],
+                             minlength=n_groups * rows).reshape(n_groups, rows)
+        curves = np.cumsum(counts, axis=1).T.astype(np.float64)
+
+        if normalize:
+            curves /= np.maximum(np.bincount(groups[valid], minlength=n_groups), 1)
+
+        frame = pd.DataFrame(curves, index=pd.Index(self.times, name="time"))
+        frame.columns.name = by
+        return frame
+
+    def casualty_map(self, cell=None):
+        # dead agents per edge or, with a cell size [m], per cell of a regular grid (cell indices and center)
+        dead = np.flatnonzero(self.dead_row >= 0)
+
+        if cell is None:
+            edges = self.dead_edge[dead]
+            edges = edges[edges >= 0]
+            counts = np.bincount(edges, minlength=self.meta["edges"])
+            found = np.flatnonzero(counts)
+
+            return pd.DataFrame({"edge": found, "dead": counts[found]}).sort_values("dead", ascending=False,
+                                                                                  ignore_index=True)
+
+        x, y = self.dead_x[dead], self.dead_y[dead]
+        known = np.isfinite(x) & np.isfinite(y)
+        cells = pd.DataFrame({"cx": np.floor(x[known] / cell).astype(np.int64),
+                              "cy": np.floor(y[known] / cell).astype(np.int64)})
+
+        frame = cells.groupby(["cx", "cy"]).size().rename("dead").reset_index()
+        frame["x"] = (frame["cx"] + 0.5) * cell
+        frame["y"] = (frame["cy"] + 0.5) * cell
+
+        return frame.sort_values("dead", ascending=False, ignore_index=True)
+
+    def bottlenecks(self, top=10):
+        # the links congested the longest, then the most used on average
+        frame = pd.DataFrame({
+            "edge": np.arange(self.meta["edges"]),
+            "congested_time": self.congested_time,
+            "used_mean": self.used_mean,
+            "used_max": self.used_max,
+            "velocity_mean": self.velocity_mean,
+            "capacity": self.capacity,
+            "length": self.length,
+        })
+        frame = frame[frame["used_max"] > 0]
+
+        return frame.sort_values(["congested_time", "used_mean"], ascending=False, ignore_index=True).head(top)
@@ -0,0 +1,204 @@
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+
+from tsunami.benchmark.synthetic import districts, inundation, shelters, street_graph
+from tsunami.simulation.model import EvacuationModel
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+PHASES = ["init_state", "compute_routes", "step", "run_iteration"]
+
+# agents and edges of the cases of each suite, from 1k agents on 1k edges to 1M agents on 100k edges
+SIZES = {
+    "small": [(1_000, 1_000), (10_000, 1_000), (10_000, 10_000)],
+    "medium": [(100_000, 10_000), (100_000, 30_000)],
+    "large": [(1_000_000, 100_000)],
+}
+
+DEFAULT_MODEL = {"agent_array": True, "node_transfer": True, "policy": "route"}
+
+# rerouting period [s] of the extra case of each suite, on its largest graph
+REROUTE_EVERY = 30
+
+
+def case(agents, edges, graph="grid", time_step=1, simulation_time=900, steps=20, seed=0, shelter_count=8,
+         capacity=np.inf, tsunami=True, **model_args):
+    # a benchmark case: synthetic scenario, time step [s], simulated time [s] and the first steps timed one
+    # by one. The model runs on the agent array with the node transfer and the route policy unless told
+    # otherwise, the other model arguments are in the name
+    model_args = {**DEFAULT_MODEL, **model_args}
+    name = f"{graph}-{agents}a-{edges}e" + "".join(f"-{k}={v}" for k, v in sorted(model_args.items())
+                                                   if DEFAULT_MODEL.get(k, None) != v)
+
+    return {
+        "name": name, "agents": agents, "edges": edges, "graph": graph, "time_step": time_step,
+        "simulation_time": simulation_time, "steps": steps, "seed": seed, "shelters": shelter_count,
+        "capacity": capacity, "tsunami": tsunami, "model": model_args,
+    }
+
+
+def suite(size="small", **args):
+    # the cases of a size (see SIZES) on the grid and radial graphs, and the largest one on the grid with
+    # the agents rerouting every REROUTE_EVERY seconds
+    if size not in SIZES:
+        raise ValueError(f"Unknown benchmark size {size}!")
+
+    cases = [case(agents, edges, graph=graph, **args) for agents, edges in SIZES[size] for graph in ("grid", "radial")]
+    agents, edges = SIZES[size][-1]
+    cases.append(case(agents, edges, graph="grid", **{"reroute_every": REROUTE_EVERY, **args}))
+
+    return cases
+
+
+def peak_rss():
+    # peak resident memory of the process [bytes], None where it is not available
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024  # kilobytes on Linux
+
+
+def run_case(spec):
+    # times of the phases of a case [s]: init_state, compute_routes (again, after the initialization), the
+    # mean and max of the first steps and run_iteration for the rest of the simulated time
+    start = time.perf_counter()
+
+    G = street_graph(spec["graph"], spec["edges"], seed=spec["seed"])
+    population = districts(G, spec["agents"])
+    refuges = shelters(G, spec["shelters"], spec["capacity"], seed=spec["seed"])
+    tsunami = inundation(G) if spec["tsunami"] else None
+    built = time.perf_counter()
+
+    model = EvacuationModel(G, spec["time_step"], spec["simulation_time"], seed=spec["seed"], **spec["model"])
+    times = {}
+
+    t = time.perf_counter()
+    model.init_state(population=population, shelters=refuges, tsunami=tsunami)
+    times["init_state"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    model.compute_routes()
+    times["compute_routes"] = time.perf_counter() - t
+
+    steps = []
+    while len(steps) < spec["steps"] and not model.finished():
+        t = time.perf_counter()
+        model.advance()
+        steps.append(time.perf_counter() - t)
+    times["step"] = float(np.mean(steps)) if steps else 0.0
+    times["step_max"] = float(np.max(steps)) if steps else 0.0
+
+    t = time.perf_counter()
+    model.run_iteration()
+    times["run_iteration"] = time.perf_counter() - t
+
+    return {
+        "name": spec["name"],
+        "spec": {k: (v if not isinstance(v, float) or np.isfinite(v) else str(v)) for k, v in spec.items()},
+        "nodes": len(model.nodes),
+        "edges": len(model.edges),
+        "agents": model.total_agents,
+        "time_steps": model.k,
+        "evacuated": model.evacuated_agents,
+        "dead": model.dead_agents,
+        "build": built - start,
+        "times": times,
+        "wall": time.perf_counter() - start,
+        "peak_rss": peak_rss(),
+    }
+
+
+def run_suite(cases, path=None, repeat=3, isolate=True, verbose=True):
+    # run the cases one at a time, each in a new process (spawned, so that the peak memory is its own), and
+    # write the results to the JSON path when given. Each case runs repeat times and keeps its fastest times,
+    # the least disturbed by the other processes of the machine
+    results = []
+
+    for spec in cases:
+        runs = []
+        for _ in range(repeat):
+            if isolate:
+                with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as executor:
+                    runs.append(executor.submit(run_case, spec).result())
+            else:
+                runs.append(run_case(spec))
+
+        result = runs[0]
+        result["repeat"] = repeat
+        result["times"] = {p: min(r["times"][p] for r in runs) for p in result["times"]}
+        result["wall"] = min(r["wall"] for r in runs)
+
+        results.append(result)
+        if verbose:
+            rss = f"{result['peak_rss'] / 2 ** 20:.0f}MB" if result["peak_rss"] is not None else "-"
+            print(f"{result['name']}: " + " ".join(f"{p} {result['times'][p]:.3f}s" for p in PHASES) +
+                  f" wall {result['wall']:.1f}s peak {rss}")
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+    if path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    return report
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def baseline_path(size):
+    return os.path.join(BASELINE_DIR, f"{size}.json")
+
+
+def compare(report, baseline, tolerance=0.5, min_time=0.01, min_rss=16 * 2 ** 20):
+    # ratio of the times and of the peak memory to the baseline for the cases of both, a regression when
+    # it is over 1 + tolerance and the difference is over the noise (min_time [s], min_rss [bytes]). The
+    # baselines are machine dependent: compare runs of the same machine
+    base = {r["name"]: r for r in baseline["results"]}
+
+    rows = []
+    for result in report["results"]:
+        if result["name"] not in base:
+            continue
+
+        b = result_metrics(base[result["name"]])
+        for metric, value in result_metrics(result).items():
+            if metric not in b or b[metric] is None or value is None:
+                continue
+
+            ratio = value / b[metric] if b[metric] > 0 else np.nan
+            noise = min_rss if metric == "peak_rss" else min_time
+            rows.append({"case": result["name"], "metric": metric, "baseline": b[metric], "value": value,
+                         "ratio": ratio, "regression": bool(ratio > 1 + tolerance and value - b[metric] > noise)})
+
+    return pd.DataFrame(rows, columns=["case", "metric", "baseline", "value", "ratio", "regression"])
+
+
+def result_metrics(result):
+    return {**{p: result["times"][p] for p in PHASES}, "wall": result["wall"], "peak_rss": result["peak_rss"]}
@@ -0,0 +1,134 @@
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+from affine import Affine
+from shapely.geometry import box
+
+from tsunami.simulation.hazard import Inundation
+
+CRS = "epsg:3857"  # metric coordinates
+
+# highway type of the streets every `main` rows (or rings and spokes), the others are residential
+MAIN_HIGHWAYS = ["primary", "secondary"]
+
+
+def _add_street(G, u, v, highway):
+    length = float(np.hypot(G.nodes[u]["x"] - G.nodes[v]["x"], G.nodes[u]["y"] - G.nodes[v]["y"]))
+
+    G.add_edge(u, v, length=length, highway=highway)
+    G.add_edge(v, u, length=length, highway=highway)
+
+
+def _highway(i, main):
+    if i % main != 0:
+        return "residential"
+
+    return MAIN_HIGHWAYS[(i // main) % len(MAIN_HIGHWAYS)]
+
+
+def grid_graph(rows, cols, spacing=50.0, main=10, jitter=0.1, seed=0):
+    # rows x cols intersections joined by two way streets, about 4 * rows * cols edges. The nodes are moved
+    # randomly by up to jitter * spacing, so that the lengths (and costs) are not all equal
+    rng = np.random.default_rng(seed)
+    G = nx.MultiDiGraph(crs=CRS)
+
+    offset = rng.uniform(-jitter, jitter, size=(rows, cols, 2)) * spacing
+    for i in range(rows):
+        for j in range(cols):
+            n = i * cols + j
+            G.add_node(n, id=n, x=j * spacing + offset[i, j, 0], y=i * spacing + offset[i, j, 1])
+
+    for i in range(rows):
+        for j in range(cols):
+            n = i * cols + j
+            if j + 1 < cols:
+                _add_street(G, n, n + 1, _highway(i, main))
+            if i + 1 < rows:
+                _add_street(G, n, n + cols, _highway(j, main))
+
+    return G
+
+
+def radial_graph(rings, spokes, spacing=50.0, main=10):
+    # a center, rings x spokes intersections on concentric rings joined by ring and spoke streets, about
+    # 4 * rings * spokes edges. The spokes every `main` are main roads
+    G = nx.MultiDiGraph(crs=CRS)
+    G.add_node(0, id=0, x=0.0, y=0.0)
+
+    angles = 2 * np.pi * np.arange(spokes) / spokes
+    for r in range(rings):
+        for s in range(spokes):
+            n = 1 + r * spokes + s
+            G.add_node(n, id=n, x=(r + 1) * spacing * np.cos(angles[s]), y=(r + 1) * spacing * np.sin(angles[s]))
+
+    for r in range(rings):
+        for s in range(spokes):
+            n = 1 + r * spokes + s
+            _add_street(G, n, 1 + r * spokes + (s + 1) % spokes, _highway(r + 1, main))
+            _add_street(G, n, 0 if r == 0 else n - spokes, _highway(s, main))
+
+    return G
+
+
+def street_graph(kind, edges, spacing=50.0, seed=0):
+    # grid or radial graph with about the given number of edges
+    side = max(int(round(np.sqrt(edges / 4))), 2)
+
+    if kind == "grid":
+        return grid_graph(side, side, spacing=spacing, seed=seed)
+    if kind == "radial":
+        return radial_graph(side, max(side, 3), spacing=spacing)
+
+    raise ValueError(f"Unknown synthetic graph {kind}!")
+
+
+def _bounds(G):
+    x = np.array([d["x"] for _, d in G.nodes(data=True)])
+    y = np.array([d["y"] for _, d in G.nodes(data=True)])
+
+    return x.min(), y.min(), x.max(), y.max()
+
+
+def districts(G, agents, rows=4, cols=4):
+    # rows x cols rectangular districts over the graph, sharing the agents equally
+    xmin, ymin, xmax, ymax = _bounds(G)
+    xs = np.linspace(xmin - 1, xmax + 1, cols + 1)
+    ys = np.linspace(ymin - 1, ymax + 1, rows + 1)
+
+    polygons = [box(xs[j], ys[i], xs[j + 1], ys[i + 1]) for i in range(rows) for j in range(cols)]
+    population = np.full(len(polygons), agents // len(polygons))
+    population[:agents % len(polygons)] += 1
+
+    return gpd.GeoDataFrame({"name": [f"district {i}" for i in range(len(polygons))], "population": population},
+                            geometry=polygons, crs=CRS)
+
+
+def shelters(G, count=4, capacity=np.inf, seed=0):
+    # shelters on random nodes of the inland half of the graph (the sea is on the west side)
+    rng = np.random.default_rng(seed)
+    xmin, _, xmax, _ = _bounds(G)
+
+    nodes = [n for n, d in G.nodes(data=True) if d["x"] >= (xmin + xmax) / 2]
+    nodes = [nodes[i] for i in rng.choice(len(nodes), size=min(count, len(nodes)), replace=False)]
+
+    x = [G.nodes[n]["x"] for n in nodes]
+    y = [G.nodes[n]["y"] for n in nodes]
+    capacity = np.broadcast_to(np.asarray(capacity, dtype=np.float64), len(nodes))
+
+    return gpd.GeoDataFrame({"name": [f"shelter {i}" for i in range(len(nodes))], "capacity": capacity},
+                            geometry=gpd.points_from_xy(x, y), crs=CRS)
+
+
+def inundation(G, arrival=300.0, speed=2.0, reach=0.3, cell=25.0):
+    # a wave coming from the west side: it reaches the coast at the arrival time [s] and goes inland at the
+    # given speed [m/s], up to the reach (fraction of the width of the graph)
+    xmin, ymin, xmax, ymax = _bounds(G)
+    cols = int(np.ceil((xmax - xmin) / cell)) + 2
+    rows = int(np.ceil((ymax - ymin) / cell)) + 2
+
+    x = xmin - cell + (np.arange(cols) + 0.5) * cell
+    times = arrival + (x - xmin) / speed
+    times[x > xmin + reach * (xmax - xmin)] = np.inf
+
+    transform = Affine(cell, 0.0, xmin - cell, 0.0, -cell, ymax + cell)
+    return Inundation(np.broadcast_to(times, (rows, cols)), transform, crs=CRS)
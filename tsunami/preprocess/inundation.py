@@ -0,0 +1,82 @@
+import os
+import sys
+
+import numpy as np
+import osmnx as ox
+import rasterio
+from rasterio.transform import from_origin
+from scipy.spatial import cKDTree
+from shapely.geometry import LineString, MultiLineString
+
+from tsunami.config import CRS, DATA_DIR
+from tsunami.utils import geometries
+
+# synthetic wave front moving inland from the coastline
+RESOLUTION = 10  # grid cell size [m]
+ARRIVAL_TIME = 30 * 60  # arrival time on the coastline [s]
+WAVE_SPEED = 5  # inland speed of the wave front [m / s]
+MAX_DEPTH = 10  # depth on the coastline [m]
+DEPTH_DECAY = 0.002  # depth lost per meter inland [m / m]
+
+
+def coastline_points(coastline, spacing):
+    # points every spacing meters along the boundaries of the coastline geometries
+    points = []
+
+    for geometry in coastline.geometry.boundary:
+        lines = geometry.geoms if isinstance(geometry, MultiLineString) else [geometry]
+
+        for line in lines:
+            if not isinstance(line, LineString):
+                continue
+
+            coords = np.asarray(line.coords)[:, :2]
+            segments = np.hypot(*np.diff(coords, axis=0).T)
+
+            for (a, b), length in zip(zip(coords[:-1], coords[1:]), segments):
+                t = np.linspace(0.0, 1.0, max(int(length // spacing), 1), endpoint=False)
+                points.append(a + t[:, None] * (b - a))
+
+    return np.concatenate(points)
+
+
+def synthetic_wave(coastline, bounds, resolution=RESOLUTION):
+    # arrival time [s] and maximum depth [m] grids over bounds (west, south, east, north)
+    west, south, east, north = bounds
+    width = int(np.ceil((east - west) / resolution))
+    height = int(np.ceil((north - south) / resolution))
+    transform = from_origin(west, north, resolution, resolution)
+
+    cols, rows = np.meshgrid(np.arange(width), np.arange(height))
+    x, y = transform * (cols + 0.5, rows + 0.5)
+
+    tree = cKDTree(coastline_points(coastline, resolution / 2))
+    distance, _ = tree.query(np.column_stack((x.ravel(), y.ravel())))
+    distance = distance.reshape(height, width)
+
+    arrival = (ARRIVAL_TIME + distance / WAVE_SPEED).astype(np.float32)
+    depth = np.maximum(MAX_DEPTH - DEPTH_DECAY * distance, 0.0).astype(np.float32)
+
+    return arrival, depth, transform
+
+
+def save_raster(path, array, transform, crs):
+    with rasterio.open(path, "w", driver="GTiff", height=array.shape[0], width=array.shape[1], count=1,
+                       dtype=array.dtype, crs=crs, transform=transform) as dst:
+        dst.write(array, 1)
+
+
+def main():
+    G = ox.load_graphml(os.path.join(DATA_DIR, "graph.xml"))
+    gdf_nodes = ox.graph_to_gdfs(G, edges=False, fill_edge_geometry=False)
+
+    coastline = geometries.load(os.path.join(DATA_DIR, "coastline.gpkg")).to_crs(CRS)
+
+    arrival, depth, transform = synthetic_wave(coastline, gdf_nodes.total_bounds)
+
+    save_raster(os.path.join(DATA_DIR, "arrival.tif"), arrival, transform, CRS)
+    save_raster(os.path.join(DATA_DIR, "depth.tif"), depth, transform, CRS)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
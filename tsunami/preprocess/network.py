@@ -5,8 +5,10 @@ import osmnx as ox
 
 from tsunami.config import POINT, DIST, CRS, DATA_DIR
 from tsunami.utils import geometries
+from tsunami.utils.roads import add_way_tags, set_widths
 
 ox.config(use_cache=True, log_console=True)
+add_way_tags(ox.settings)  # the sidewalks are not downloaded otherwise
 
 
 def main():
@@ -14,6 +16,7 @@ def main():
 
     G = ox.project_graph(graph, to_crs=CRS)
     G = ox.consolidate_intersections(G, tolerance=10, rebuild_graph=True, dead_ends=True)
+    set_widths(G)
     ox.save_graphml(G, os.path.join(DATA_DIR, "graph.xml"))
 
     buildings = ox.geometries_from_point(POINT, {"building": True}, dist=DIST)
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import pandas as pd
+from shapely.geometry import LineString
+
+from tsunami.config import DATA_DIR
+from tsunami.simulation.population import district_nodes
+from tsunami.simulation.shelter import load_shelters, snap_shelters
+from tsunami.utils.roads import WIDTH, road_widths
+
+VERSION = 2  # to increase when the content of the bundle changes
+
+
+def scenario_key(paths):
+    # hash of the bundle version and of the content of the input files
+    h = hashlib.sha1(f"scenario v{VERSION}".encode())
+
+    for path in paths:
+        if path is None:
+            continue
+
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+
+    return h.hexdigest()[:16]
+
+
+def osm_tag(data, key):
+    # the osm tags can be missing, lists are kept as their graphml representation
+    return str(data.get(key, ""))
+
+
+def compile_scenario(G, population, shelters=None):
+    # flat arrays of the graph, the districts and the shelters
+    nodes = list(G.nodes)
+    node_index = {n: i for i, n in enumerate(nodes)}
+    edges = list(G.edges(keys=True, data=True))
+
+    # edges without a geometry have no coordinates in the flat polylines
+    coords = [np.asarray(d["geometry"].coords, dtype=np.float64)[:, :2] if "geometry" in d else np.zeros((0, 2))
+              for _, _, _, d in edges]
+    counts = np.array([len(c) for c in coords], dtype=np.int64)
+
+    node_ids, bounds = district_nodes(G, population)
+
+    arrays = {
+        "node_id": np.array(nodes, dtype=np.int64),
+        "node_x": np.array([G.nodes[n]["x"] for n in nodes], dtype=np.float64),
+        "node_y": np.array([G.nodes[n]["y"] for n in nodes], dtype=np.float64),
+        "edge_u": np.array([node_index[u] for u, _, _, _ in edges], dtype=np.int32),
+        "edge_v": np.array([node_index[v] for _, v, _, _ in edges], dtype=np.int32),
+        "edge_key": np.array([k for _, _, k, _ in edges], dtype=np.int32),
+        "edge_length": np.array([d["length"] for _, _, _, d in edges], dtype=np.float64),
+        "edge_highway": np.array([osm_tag(d, "highway") for _, _, _, d in edges]),
+        "edge_lanes": np.array([osm_tag(d, "lanes") for _, _, _, d in edges]),
+        "edge_width": road_widths(G, [(u, v, k) for u, v, k, _ in edges]),
+        "geometry_x": np.concatenate([c[:, 0] for c in coords]) if len(coords) > 0 else np.zeros(0),
+        "geometry_y": np.concatenate([c[:, 1] for c in coords]) if len(coords) > 0 else np.zeros(0),
+        "geometry_count": counts,
+        "district_name": population["name"].to_numpy().astype(str),
+        "district_population": population["population"].to_numpy(dtype=np.int64),
+        "district_node": np.asarray(node_ids, dtype=np.int64),
+        "district_bounds": np.asarray(bounds, dtype=np.int64),
+    }
+
+    if shelters is not None:
+        if "crs" in G.graph:
+            shelters = shelters.to_crs(G.graph["crs"])
+
+        arrays["shelter_name"] = shelters["name"].to_numpy().astype(str)
+        arrays["shelter_capacity"] = shelters["capacity"].to_numpy(dtype=np.float64)
+        arrays["shelter_x"] = shelters.geometry.x.to_numpy(dtype=np.float64)
+        arrays["shelter_y"] = shelters.geometry.y.to_numpy(dtype=np.float64)
+        arrays["shelter_node"] = np.asarray(snap_shelters(G, shelters), dtype=np.int64)
+
+    return arrays
+
+
+def save_scenario(directory, arrays, meta):
+    # one .npy per array, so each can be memory-mapped, written in a temporary directory and renamed. The
+    # temporary directory is unique, so that processes compiling the same scenario at once do not mix their
+    # files: the first rename wins and the others find the scenario already there
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(directory) + ".", suffix=".tmp", dir=parent)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    try:
+        os.replace(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(directory):
+            raise
+
+
+def load_scenario(graph_path, districts_path, shelters_path=None, cache_dir=DATA_DIR):
+    # compiled scenario of the input files, compiled only the first time
+    key = scenario_key([graph_path, districts_path, shelters_path])
+    directory = os.path.join(cache_dir, f"scenario-{key}")
+
+    if not os.path.exists(directory):
+        G = ox.load_graphml(graph_path)
+        population = gpd.read_file(districts_path)
+        shelters = load_shelters(shelters_path) if shelters_path is not None else None
+
+        meta = {"version": VERSION, "key": key, "crs": G.graph.get("crs"), "graph": {
+            k: v for k, v in G.graph.items() if isinstance(v, (str, int, float))
+        }}
+        save_scenario(directory, compile_scenario(G, population, shelters), meta)
+
+    return Scenario(directory)
+
+
+# Scenario compiled by load_scenario: the arrays are memory-mapped read only, so the worker processes
+# share the same pages, and the graph is rebuilt from them without parsing the graphml
+
+class Scenario:
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        if self.meta["version"] != VERSION:
+            raise ValueError(f"Scenario version {self.meta['version']} instead of {VERSION}!")
+
+        self.arrays = {}
+        for name in os.listdir(directory):
+            if name.endswith(".npy"):
+                self.arrays[name[:-4]] = np.load(os.path.join(directory, name), mmap_mode="r")
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def graph(self):
+        # same nodes and edges, in the same order, of the compiled graph
+        a = self.arrays
+
+        G = nx.MultiDiGraph(**self.meta["graph"])
+        node_id = a["node_id"].tolist()
+        G.add_nodes_from(
+            (n, {"id": n, "x": x, "y": y}) for n, x, y in zip(node_id, a["node_x"].tolist(), a["node_y"].tolist())
+        )
+
+        start = np.concatenate(([0], np.cumsum(a["geometry_count"])))
+        geometry_x, geometry_y = np.asarray(a["geometry_x"]), np.asarray(a["geometry_y"])
+        length, highway, lanes = a["edge_length"].tolist(), a["edge_highway"].tolist(), a["edge_lanes"].tolist()
+        width = a["edge_width"].tolist()
+
+        for i, (u, v, k) in enumerate(zip(a["edge_u"].tolist(), a["edge_v"].tolist(), a["edge_key"].tolist())):
+            data = {"length": length[i], "highway": highway[i], WIDTH: width[i]}
+
+            if lanes[i] != "":
+                data["lanes"] = lanes[i]
+
+            if start[i + 1] > start[i]:
+                data["geometry"] = LineString(np.column_stack((
+                    geometry_x[start[i]:start[i + 1]], geometry_y[start[i]:start[i + 1]]
+                )))
+
+            G.add_edge(node_id[u], node_id[v], key=k, **data)
+
+        return G
+
+    def population(self):
+        return pd.DataFrame({"name": self.arrays["district_name"], "population": self.arrays["district_population"]})
+
+    def district_nodes(self):
+        return self.arrays["district_node"], self.arrays["district_bounds"]
+
+    def shelters(self):
+        if "shelter_node" not in self.arrays:
+            return None
+
+        return gpd.GeoDataFrame(
+            {"name": self.arrays["shelter_name"], "capacity": self.arrays["shelter_capacity"]},
+            geometry=gpd.points_from_xy(self.arrays["shelter_x"], self.arrays["shelter_y"]),
+            crs=self.meta["crs"]
+        )
+
+    def shelter_nodes(self):
+        return self.arrays.get("shelter_node")
+
+
+def main():
+    scenario = load_scenario(
+        os.path.join(DATA_DIR, "graph.xml"),
+        os.path.join(DATA_DIR, "districts.gpkg"),
+        os.path.join(DATA_DIR, "shelters.csv")
+    )
+
+    print(f"scenario {scenario.meta['key']}: {len(scenario['node_id'])} nodes, {len(scenario['edge_u'])} edges")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import numpy as np
+
+from tsunami.simulation.positions import progress
+
+RESIDENT = 0
+TOURIST = 1
+TYPES = {"resident": RESIDENT, "tourist": TOURIST}  # Pedestrian.type
+
+MOVING = 0
+EVACUATED = 1
+DEAD = 2
+WAITING = 3  # at the origin, not departed yet
+
+
+# Columnar alternative to a Pedestrian object per agent. The nodes are indices in the model's node
+# list, the routes of all the agents are stored in a single flat array (agents with the same route
+# share the same slice) and next is the position of the next node in the agent's route
+
+class AgentArray:
+    def __init__(self, origin, district, type=RESIDENT):
+        n = len(origin)
+
+        self.origin = np.asarray(origin, dtype=np.int32)  # origin node
+        self.district = np.asarray(district, dtype=np.int32)
+        self.type = np.full(n, type, dtype=np.int8)
+        self.status = np.full(n, WAITING, dtype=np.int8)
+
+        self.node = self.origin.copy()  # current node, as Pedestrian.curr_node
+        self.dest = np.full(n, -1, dtype=np.int32)  # destination node
+        self.shelter = np.full(n, -1, dtype=np.int32)  # destination shelter
+
+        self.edge = np.full(n, -1, dtype=np.int32)  # current edge id
+        self.enter_time = np.zeros(n, dtype=np.float64)  # simulation time of entering the current edge
+
+        self.x = np.zeros(n, dtype=np.float64)
+        self.y = np.zeros(n, dtype=np.float64)
+
+        self.routes = np.zeros(0, dtype=np.int32)
+        self.route_start = np.zeros(n, dtype=np.int64)
+        self.route_length = np.zeros(n, dtype=np.int32)
+        self.next = np.zeros(n, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.origin)
+
+    def nbytes(self):
+        return sum(a.nbytes for a in vars(self).values() if isinstance(a, np.ndarray))
+
+    def set_routes(self, routes, route_of, agents=None):
+        # routes: list of node index paths, route_of: route of each agent (-1 for none)
+        if agents is None:
+            agents = np.arange(len(self))
+
+        lengths = np.array([len(r) for r in routes], dtype=np.int64)
+        starts = len(self.routes) + np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+        if len(routes) > 0:
+            self.routes = np.concatenate([self.routes] + [np.asarray(r, dtype=np.int32) for r in routes])
+
+        route_of = np.asarray(route_of, dtype=np.int64)
+        valid = route_of >= 0
+        self.route_start[agents[valid]] = starts[route_of[valid]]
+        self.route_length[agents[valid]] = lengths[route_of[valid]]
+        self.route_length[agents[~valid]] = 0
+        self.set_next_node(agents)
+
+    def remaining_routes(self, agents):
+        # the rest of the routes of the agents from their current node (the one before the next), concatenated,
+        # with their lengths
+        first = self.route_start[agents] + self.next[agents] - 1
+        lengths = np.maximum(self.route_length[agents] - self.next[agents] + 1, 0).astype(np.int64)
+
+        offsets = np.cumsum(lengths) - lengths
+        index = np.repeat(first - offsets, lengths) + np.arange(lengths.sum())
+
+        return self.routes[index], lengths
+
+    def append_routes(self, routes, lengths, agents):
+        # the agents follow the concatenated routes (see remaining_routes) from their first node
+        self.route_start[agents] = len(self.routes) + np.cumsum(lengths) - lengths
+        self.route_length[agents] = lengths
+        self.routes = np.concatenate((self.routes, np.asarray(routes, dtype=np.int32)))
+        self.set_next_node(agents)
+
+    def compact_routes(self, agents):
+        # keep only the rest of the routes of the agents, the routes of the others are dropped
+        routes, lengths = self.remaining_routes(agents)
+        self.routes = np.zeros(0, dtype=np.int32)
+        self.append_routes(routes, lengths, agents)
+
+    def set_next_node(self, agents):
+        # the next node is the one after the current node, which is the first of the route
+        self.next[agents] = 1
+
+    def next_node(self, agents=None):
+        if agents is None:
+            agents = np.arange(len(self))
+
+        has_next = self.next[agents] < self.route_length[agents]
+        nodes = np.full(len(agents), -1, dtype=np.int32)
+        nodes[has_next] = self.routes[self.route_start[agents[has_next]] + self.next[agents[has_next]]]
+
+        return nodes
+
+    def update_next_node(self, agents):
+        # the agents reached their next node
+        self.node[agents] = self.next_node(agents)
+        self.next[agents] += 1
+
+    def route(self, agent):
+        start = self.route_start[agent]
+        return self.routes[start:start + self.route_length[agent]]
+
+    def update_pos(self, links, geometry, now):
+        # interpolate the position of all the agents on a link along the edge geometry
+        agents = np.flatnonzero((self.edge >= 0) & (self.status == MOVING))
+        e = self.edge[agents]
+
+        fraction = progress(now, self.enter_time[agents], links.v[e], links.l[e])
+        self.x[agents], self.y[agents] = geometry.interpolate(e, fraction)
+
+    def kill(self, agents):
+        self.status[agents] = DEAD
+
+    def set_link(self, agents, edges, enter_time):
+        self.edge[agents] = edges
+        self.enter_time[agents] = enter_time
@@ -0,0 +1,119 @@
+import copy
+
+import numpy as np
+
+DISTRIBUTIONS = ["rayleigh", "weibull", "constant"]
+
+
+# Delay [s] of each agent, drawn from a distribution whose parameters are either scalars or arrays with
+# one value per district (in the order of the population): rayleigh (scale = mode), weibull (scale and
+# shape) or constant (scale), shifted by loc
+
+class Delay:
+    def __init__(self, distribution="rayleigh", scale=0.0, shape=1.0, loc=0.0):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown delay distribution {distribution}!")
+
+        self.distribution = distribution
+        self.scale = scale
+        self.shape = shape
+        self.loc = loc
+
+    @staticmethod
+    def __by_district(value, district):
+        value = np.asarray(value, dtype=np.float64)
+        return value[district] if value.ndim > 0 else np.full(len(district), value)
+
+    def sample(self, rng, district):
+        scale = self.__by_district(self.scale, district)
+        loc = self.__by_district(self.loc, district)
+
+        if self.distribution == "rayleigh":
+            return loc + scale * rng.rayleigh(1.0, len(district))
+        if self.distribution == "weibull":
+            return loc + scale * rng.weibull(self.__by_district(self.shape, district))
+
+        return loc + scale
+
+
+# Departure time of the agents: the time to receive the warning plus the time to get ready
+
+class DepartureModel:
+    def __init__(self, warning=None, preparation=None):
+        self.warning = warning
+        self.preparation = preparation
+
+    def sample(self, rng, district):
+        times = np.zeros(len(district), dtype=np.float64)
+
+        for delay in (self.warning, self.preparation):
+            if delay is not None:
+                times += delay.sample(rng, district)
+
+        return np.maximum(times, 0.0)
+
+
+# Agents waiting at their origin, sorted by the time they leave it: they depart or, if their origin is
+# flooded first, die. Each time step only pops the ones due, so the waiting agents cost nothing. The
+# agents that could not enter their first link are held and tried again at the next computed time step:
+# the stuck ones (no way out, their first link is flooded) do not count as departing until one frees
+
+class PendingAgents:
+    def __init__(self, agents, departure_time, flood_time=None):
+        if flood_time is None:
+            flood_time = np.full(len(agents), np.inf)
+
+        time = np.minimum(departure_time, flood_time)
+        order = np.argsort(time, kind="stable")
+
+        self.agents = np.asarray(agents, dtype=np.int64)[order]
+        self.time = time[order]
+        self.dies = (flood_time <= departure_time)[order]
+        self.next = 0  # first agent not popped yet
+
+        self.held = np.zeros(0, dtype=np.int64)
+        self.stuck = np.zeros(0, dtype=bool)  # held agents without a way out
+
+    def __len__(self):
+        return len(self.agents) - self.next + len(self.held)
+
+    def pop(self, now):
+        # the agents due at the time now and whether they die
+        end = np.searchsorted(self.time[self.next:], now, side="right") + self.next
+        agents, dies = self.agents[self.next:end], self.dies[self.next:end]
+        self.next = end
+
+        return agents, dies
+
+    def hold(self, agents, stuck=None):
+        self.held = np.asarray(agents, dtype=np.int64)
+        self.stuck = np.zeros(len(self.held), dtype=bool) if stuck is None else np.asarray(stuck, dtype=bool)
+
+    def release(self):
+        # the held agents, to try again
+        held = self.held
+        self.hold(np.zeros(0, dtype=np.int64))
+
+        return held
+
+    def subset(self, keep):
+        # the pending agents whose keep (indexed by agent) is true, in the same order
+        subset = copy.copy(self)
+
+        rest = slice(self.next, None)
+        mask = keep[self.agents[rest]]
+        subset.agents, subset.time, subset.dies = self.agents[rest][mask], self.time[rest][mask], self.dies[rest][mask]
+        subset.next = 0
+        subset.held, subset.stuck = self.held[keep[self.held]], self.stuck[keep[self.held]]
+
+        return subset
+
+    def next_time(self, now):
+        # time of the next departure (now if some agents wait for room), None if there is none
+        if not np.all(self.stuck):
+            return now
+
+        if self.next < len(self.time):
+            return self.time[self.next]
+
+        return None
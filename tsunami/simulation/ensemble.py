@@ -0,0 +1,106 @@
+import itertools
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from tsunami.simulation.model import EvacuationModel
+from tsunami.simulation.population import district_nodes
+from tsunami.simulation.shelter import snap_shelters
+
+_ensemble = None  # scenario of the worker processes
+
+
+def _init_worker(ensemble):
+    # with fork the scenario is inherited by the workers without being pickled
+    global _ensemble
+    _ensemble = ensemble
+
+
+def _run_replica(replica):
+    return _ensemble.run_replica(*replica)
+
+
+# Monte Carlo replicas of the same scenario (graph, population, shelters and tsunami loaded once) over a set
+# of seeds and time steps, run on a process pool. Each replica returns only its evacuation curve, so the cost
+# of the inter-process communication does not grow with the size of the graph. The nodes of the districts
+# and shelters are found once for all the replicas. The seed draws the origins of the agents (in the districts
+# with more nodes than residents) and their departure times: without a DepartureModel in the model_args
+# (departures=...) all the agents leave at once and the replicas differ little, if at all
+
+class Ensemble:
+    def __init__(self, graph, population, shelters=None, tsunami=None, simulation_time=None, mode="step",
+                 **model_args):
+        self.G = graph
+        self.population = population
+        self.shelters = shelters
+        self.tsunami = tsunami
+        self.ST = simulation_time
+        self.mode = mode
+        self.model_args = model_args
+
+        self.district_nodes = district_nodes(graph, population)
+        self.shelter_nodes = snap_shelters(graph, shelters) if shelters is not None else None
+
+    def run_replica(self, seed, time_step):
+        start = time.perf_counter()
+
+        model = EvacuationModel(self.G.copy(), time_step, self.ST, seed=seed, **self.model_args)
+        model.init_state(population=self.population, shelters=self.shelters, tsunami=self.tsunami,
+                         district_nodes=self.district_nodes, shelter_nodes=self.shelter_nodes)
+        model.run_iteration(self.mode)
+
+        return {
+            "seed": seed,
+            "time_step": time_step,
+            "total": model.total_agents,
+            "evacuated": model.evacuated_agents,
+            "dead": model.dead_agents,
+            "curve": np.asarray(model.evacuation_curve, dtype=np.int64),
+            "elapsed": time.perf_counter() - start,
+        }
+
+    def run(self, seeds, time_steps=(1,), workers=None):
+        replicas = list(itertools.product(seeds, time_steps))
+        workers = min(workers or os.cpu_count(), len(replicas))
+
+        if workers <= 1:
+            return [self.run_replica(*replica) for replica in replicas]
+
+        method = "fork" if "fork" in mp.get_all_start_methods() else None
+        chunksize = max(1, len(replicas) // (4 * workers))
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(method),
+                                 initializer=_init_worker, initargs=(self,)) as executor:
+            return list(executor.map(_run_replica, replicas, chunksize=chunksize))
+
+
+def percentile_bands(results, percentiles=(5, 50, 95)):
+    # evacuated agents over time of all the replicas, sampled every smallest time step: a finished replica
+    # keeps its last value and the curves with a larger time step hold their value until their next step
+    if len(results) == 0:
+        raise ValueError("No results!")
+
+    step = min(r["time_step"] for r in results)
+    end = max(len(r["curve"]) * r["time_step"] for r in results)
+    times = np.arange(1, int(round(end / step)) + 1) * step
+
+    curves = np.zeros((len(results), len(times)))
+    for i, r in enumerate(results):
+        curve = r["curve"]
+        if len(curve) == 0:
+            continue
+
+        # the value at index k is the one at the end of the time step k, at (k + 1) * T
+        index = np.floor(times / r["time_step"] + 1e-9).astype(np.int64) - 1
+        index = np.minimum(index, len(curve) - 1)
+        curves[i] = np.where(index >= 0, curve[np.maximum(index, 0)], 0)
+
+    bands = pd.DataFrame({"time": times, "mean": curves.mean(axis=0)})
+    for q, band in zip(percentiles, np.percentile(curves, percentiles, axis=0)):
+        bands[f"p{q}"] = band
+
+    return bands
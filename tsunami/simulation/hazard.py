@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+import rasterio
+from pyproj import Transformer
+
+
+def load_raster(path):
+    # first band of the raster as a read only memory-mapped array, cached in a .npy next to it
+    cache = os.path.splitext(path)[0] + ".npy"
+
+    with rasterio.open(path) as src:
+        transform = src.transform
+        crs = src.crs.to_string() if src.crs is not None else None
+        nodata = src.nodata
+
+        if not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(path):
+            np.save(cache, src.read(1))
+
+    return np.load(cache, mmap_mode="r"), transform, crs, nodata
+
+
+def load_inundation(arrival_path, depth_path=None, min_depth=0.5):
+    arrival, transform, crs, nodata = load_raster(arrival_path)
+
+    depth = None
+    if depth_path is not None:
+        depth, _, _, _ = load_raster(depth_path)
+
+    return Inundation(arrival, transform, crs=crs, depth=depth, min_depth=min_depth, nodata=nodata)
+
+
+# Inundation grids of a tsunami scenario: arrival time of the wave [s] and (optionally) maximum depth [m].
+# A cell floods at its arrival time if its depth is at least min_depth, otherwise never (inf)
+
+class Inundation:
+    def __init__(self, arrival, transform, crs=None, depth=None, min_depth=0.5, nodata=None):
+        self.arrival = arrival
+        self.depth = depth
+        self.transform = transform
+        self.crs = crs
+        self.min_depth = min_depth
+        self.nodata = nodata
+
+    def flood_time(self, x, y, crs=None):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        if crs is not None and self.crs is not None and crs != self.crs:
+            x, y = Transformer.from_crs(crs, self.crs, always_xy=True).transform(x, y)
+
+        col, row = ~self.transform * (x, y)
+        row = np.floor(row).astype(np.int64)
+        col = np.floor(col).astype(np.int64)
+
+        inside = (row >= 0) & (row < self.arrival.shape[0]) & (col >= 0) & (col < self.arrival.shape[1])
+
+        times = np.full(len(x), np.inf)
+        times[inside] = self.arrival[row[inside], col[inside]]
+
+        flooded = inside & np.isfinite(times)
+        if self.nodata is not None:
+            flooded &= times != self.nodata
+        if self.depth is not None:
+            depth = np.zeros(len(x))
+            depth[inside] = self.depth[row[inside], col[inside]]
+            flooded &= depth >= self.min_depth
+
+        times[~flooded] = np.inf
+        return times
+
+    def edge_flood_time(self, geometry, crs=None, samples=5):
+        # an edge floods when the first of its sampled points does
+        edges = np.arange(len(geometry.start))
+        times = np.full(len(edges), np.inf)
+
+        for fraction in np.linspace(0.0, 1.0, samples):
+            x, y = geometry.interpolate(edges, np.full(len(edges), fraction))
+            times = np.minimum(times, self.flood_time(x, y, crs=crs))
+
+        return times
+
+
+# Flooding times sorted once, each time step returns only the edges flooded since the previous one
+
+class FloodSchedule:
+    def __init__(self, flood_time):
+        self.flood_time = np.asarray(flood_time, dtype=np.float64)
+        self.order = np.argsort(self.flood_time, kind="stable")
+        self.sorted = self.flood_time[self.order]
+        self.flooded = 0  # number of edges already flooded
+
+    def pop(self, now):
+        end = np.searchsorted(self.sorted, now, side="right")
+        edges = self.order[self.flooded:end]
+        self.flooded = max(self.flooded, end)
+
+        return edges
+
+    def next_time(self):
+        if self.flooded >= len(self.sorted) or not np.isfinite(self.sorted[self.flooded]):
+            return None
+
+        return self.sorted[self.flooded]
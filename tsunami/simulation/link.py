@@ -1,7 +1,5 @@
-from queue import Queue
-from time import time
-
-from tsunami.simulation.pedestrian import Pedestrian
+import itertools
+from collections import deque
 
 
 class Link:
@@ -20,7 +18,15 @@ class Link:
         self.q = self.w * self.__MAX_CAPACITY  # flow capacity [ped / s]
         self.t = self.l / self.__MAX_SPEED  # free speed travel time [s]
 
-        self.queue = Queue(maxsize=self.c)
+        # FIFO queue of (exit time, agent), the exit times never decrease along the arrival order
+        self.queue = deque()
+        self.last_exit_time = 0.0
+
+        # outflow accumulated while agents are waiting to leave, q * T per time step: the fraction not used
+        # is carried over to the next time step (up to one more agent)
+        self.outflow = 0.0
+
+        self.closed = False  # flooded
 
     def get_travel_time(self):
         return self.t
@@ -31,57 +37,79 @@ class Link:
 
     def update_velocity(self):
         K = self.q / self.c * self.l
-        p = self.queue.qsize() / self.c
+        p = len(self.queue) / self.c
         self.v = min(self.__MAX_SPEED, K / p)
 
         return self.v
 
+    def is_full(self):
+        return self.closed or len(self.queue) >= self.c
+
     def enqueue(self, agent):
-        if self.queue.qsize() < self.queue.maxsize:
-            self.queue.put(agent)
+        if not self.is_full():
+            exit_time = max(agent.link["enter_time"] + self.get_travel_time(), self.last_exit_time)
+            self.queue.append((exit_time, agent))
+
+            self.last_exit_time = exit_time
             return True
         else:
             return False
 
-    def dequeue(self, k, T):
-        if self.queue.empty():
+    def ready(self, k, T):
+        # agents that can leave at the time step k, in order, without removing them (see release)
+        now = k * T  # simulation time [s]
+
+        if len(self.queue) == 0 or self.queue[0][0] > now:
             return []
 
+        self.outflow = min(self.outflow + self.q * T, self.q * T + 1)
+
         agents = []
-        for _ in range(int(self.q)):
-            if not self.queue.empty():
-                agent = self.queue.queue[0]
-                can_leave = time() + k * T > agent.link["enter_time"] + self.get_travel_time()
+        for exit_time, agent in itertools.islice(self.queue, int(self.outflow)):
+            if exit_time > now:
+                break
+            agents.append(agent)
+
+        return agents
 
-                # print(
-                #    f"{time() + k * T} > {agent.link['enter_time'] + self.get_travel_time()} => {can_leave}"
-                # )
+    def release(self, n):
+        # the first n ready agents left the link
+        for _ in range(n):
+            self.queue.popleft()
 
-                if can_leave:
-                    a = self.queue.get()
-                    agents.append(a)
+        self.outflow -= n
+
+    def dequeue(self, k, T):
+        agents = self.ready(k, T)
+        self.release(len(agents))
 
         return agents
 
-    def print_queue(self):
-        print(self.queue.queue)
+    def size(self):
+        return len(self.queue)
 
-    def get_queue_used(self):
-        return round(self.queue.qsize() / self.c * 100, 2)
+    def clear(self):
+        # remove all the agents, in exit order
+        agents = [agent for _, agent in self.queue]
+        self.queue.clear()
+        self.outflow = 0.0
+        return agents
 
-    def __str__(self) -> str:
-        return f"capacity: {self.c}, q: {self.q}, queue: {self.queue}"
+    def close(self):
+        self.closed = True
+        self.t = float("inf")
 
+    def next_exit_time(self):
+        if len(self.queue) == 0:
+            return None
 
-def choice_link(graph, agent: Pedestrian):
-    min_c = float("inf")
-    min_e = None
+        return self.queue[0][0]
 
-    for e in graph.out_edges(agent.curr_node["id"], keys=True):
-        c = graph.edges[e]["cost"]
+    def print_queue(self):
+        print([agent for _, agent in self.queue])
 
-        if c < min_c:
-            min_c = c
-            min_e = e
+    def get_queue_used(self):
+        return round(len(self.queue) / self.c * 100, 2)
 
-    return min_e
+    def __str__(self) -> str:
+        return f"capacity: {self.c}, q: {self.q}, queue: {len(self.queue)}"
@@ -0,0 +1,245 @@
+import numpy as np
+
+from tsunami.utils.roads import road_widths
+
+
+# Struct-of-arrays alternative to a Link object per edge: each edge is identified by its position
+# in graph.edges and owns a ring buffer of agent ids inside a single flat array
+
+class LinkStore:
+    def __init__(self, graph, agents, widths=None):
+        self.__MAX_SPEED = 1.66  # max free flow speed # [m / s]
+        self.__MAX_DENSITY = 5.4  # max density [ped / m^2]
+        self.__MAX_CAPACITY = 1.33  # max capacity [ped / (m * s)]
+
+        self.agents = agents
+        self.edges = list(graph.edges)
+
+        data = [graph.edges[e] for e in self.edges]
+        self.l = np.array([d["length"] for d in data], dtype=np.float64)
+        self.w = road_widths(graph, self.edges) if widths is None else np.asarray(widths, dtype=np.float64)
+        self.a = self.l * self.w
+
+        self.v = np.full(len(self.edges), self.__MAX_SPEED)  # velocity [m / s]
+
+        self.c = (self.a * self.__MAX_DENSITY).astype(np.int64)  # storage capacity [ped]
+        self.q = self.w * self.__MAX_CAPACITY  # flow capacity [ped / s]
+        self.t = self.l / self.__MAX_SPEED  # free speed travel time [s]
+
+        # ring buffers: edge e owns slots[offset[e]:offset[e] + c[e]]
+        self.n = np.zeros(len(self.edges), dtype=np.int64)  # occupancy [ped]
+        self.head = np.zeros(len(self.edges), dtype=np.int64)
+        self.offset = np.zeros(len(self.edges), dtype=np.int64)
+        self.offset[1:] = np.cumsum(self.c)[:-1]
+        self.slots = np.empty(int(self.c.sum()), dtype=np.int32)
+        self.exit_time = np.empty(len(self.slots), dtype=np.float64)  # simulation exit time of each slot
+        self.last_exit_time = np.zeros(len(self.edges), dtype=np.float64)
+        self.outflow = np.zeros(len(self.edges), dtype=np.float64)  # accumulated outflow, as in Link
+
+        self.closed = np.zeros(len(self.edges), dtype=bool)  # flooded
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __getitem__(self, e):
+        return LinkView(self, e)
+
+    def is_full(self, e):
+        return self.closed[e] or self.n[e] >= self.c[e]
+
+    def enqueue(self, e, agent_id, enter_time):
+        if self.is_full(e):
+            return False
+
+        # exit times never decrease along the ring buffer, as in Link
+        exit_time = max(enter_time + self.t[e], self.last_exit_time[e])
+
+        slot = self.offset[e] + (self.head[e] + self.n[e]) % self.c[e]
+        self.slots[slot] = agent_id
+        self.exit_time[slot] = exit_time
+        self.last_exit_time[e] = exit_time
+        self.n[e] += 1
+
+        return True
+
+    def ready(self, e, k, T):
+        # ids of the agents that can leave the edge at the time step k, in order, without removing them
+        now = k * T  # simulation time [s]
+
+        head = self.offset[e] + self.head[e]
+        if self.n[e] == 0 or self.exit_time[head] > now:
+            return self.slots[:0]
+
+        self.outflow[e] = min(self.outflow[e] + self.q[e] * T, self.q[e] * T + 1)
+
+        # the exit times are sorted along the ring buffer
+        m = min(int(self.outflow[e]), self.n[e])
+        slots = self.offset[e] + (self.head[e] + np.arange(m)) % self.c[e]
+        m = np.searchsorted(self.exit_time[slots], now, side="right")
+
+        return self.slots[slots[:m]]
+
+    def release(self, e, n):
+        # the first n ready agents left the edge, removed as one slice of the ring buffer
+        self.head[e] = (self.head[e] + n) % self.c[e]
+        self.n[e] -= n
+        self.outflow[e] -= n
+
+    def dequeue(self, e, k, T):
+        ids = self.ready(e, k, T).tolist()
+        self.release(e, len(ids))
+
+        return ids
+
+    def ready_many(self, edges, k, T):
+        # ready of several edges at once: the edge and the id of each ready agent, grouped by edge in the
+        # given order and in queue order within each edge
+        now = k * T  # simulation time [s]
+
+        edges = np.asarray(edges, dtype=np.int64)
+        edges = edges[self.n[edges] > 0]
+        edges = edges[self.exit_time[self.offset[edges] + self.head[edges]] <= now]
+
+        self.outflow[edges] = np.minimum(self.outflow[edges] + self.q[edges] * T, self.q[edges] * T + 1)
+
+        counts = np.minimum(self.outflow[edges].astype(np.int64), self.n[edges])
+        group = np.repeat(np.arange(len(edges)), counts)
+        position = np.arange(len(group)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        e = edges[group]
+        slots = self.offset[e] + (self.head[e] + position) % self.c[e]
+        ready = self.exit_time[slots] <= now
+
+        return e[ready], self.slots[slots[ready]].astype(np.int64)
+
+    def release_many(self, edges, counts):
+        # release of several (distinct) edges at once
+        self.head[edges] = (self.head[edges] + counts) % self.c[edges]
+        self.n[edges] -= counts
+        self.outflow[edges] -= counts
+
+    def enqueue_many(self, edges, agent_ids, enter_time):
+        # enqueue of several agents at once, in the given order within each edge. The caller checked that
+        # the edges have enough free space
+        order = np.argsort(edges, kind="stable")
+        edges, agent_ids = edges[order], agent_ids[order]
+        rank = np.arange(len(edges)) - np.searchsorted(edges, edges)
+
+        exit_time = np.maximum(enter_time + self.t[edges], self.last_exit_time[edges])
+        slots = self.offset[edges] + (self.head[edges] + self.n[edges] + rank) % self.c[edges]
+        self.slots[slots] = agent_ids
+        self.exit_time[slots] = exit_time
+
+        edges, counts = np.unique(edges, return_counts=True)
+        self.last_exit_time[edges] = np.maximum(enter_time + self.t[edges], self.last_exit_time[edges])
+        self.n[edges] += counts
+
+    def free(self):
+        # free space of every edge, none on the closed ones
+        return np.where(self.closed, 0, np.maximum(self.c - self.n, 0))
+
+    def clear(self, e):
+        # remove all the agents of the edge, in exit order
+        slots = self.offset[e] + (self.head[e] + np.arange(self.n[e])) % max(self.c[e], 1)
+        ids = self.slots[slots].astype(np.int64)
+
+        self.n[e] = 0
+        self.head[e] = 0
+        self.outflow[e] = 0.0
+        return ids
+
+    def close(self, e):
+        self.closed[e] = True
+        self.t[e] = np.inf
+
+    def next_exit_time(self, e):
+        if self.n[e] == 0:
+            return None
+
+        return self.exit_time[self.offset[e] + self.head[e]]
+
+    def occupied(self):
+        return np.flatnonzero(self.n > 0)
+
+    def update(self, e=None):
+        # same as Link.update_velocity and Link.update_travel_time over all the occupied edges at once
+        if e is None:
+            e = self.occupied()
+        else:
+            e = e[self.n[e] > 0]
+
+        K = self.q[e] / self.c[e] * self.l[e]
+        p = self.n[e] / self.c[e]
+        self.v[e] = np.minimum(self.__MAX_SPEED, K / p)
+        self.t[e] = self.l[e] / self.v[e]
+
+        return e
+
+    def get_queue_used(self, e):
+        return round(self.n[e] / self.c[e] * 100, 2)
+
+
+# Exposes an edge of a LinkStore through the same interface as Link
+
+class LinkView:
+    def __init__(self, store, e):
+        self.store = store
+        self.e = e
+
+    @property
+    def l(self):
+        return self.store.l[self.e]
+
+    @property
+    def w(self):
+        return self.store.w[self.e]
+
+    @property
+    def a(self):
+        return self.store.a[self.e]
+
+    @property
+    def c(self):
+        return self.store.c[self.e]
+
+    @property
+    def q(self):
+        return self.store.q[self.e]
+
+    @property
+    def v(self):
+        return self.store.v[self.e]
+
+    @property
+    def t(self):
+        return self.store.t[self.e]
+
+    def size(self):
+        return int(self.store.n[self.e])
+
+    def get_travel_time(self):
+        return self.t
+
+    def next_exit_time(self):
+        return self.store.next_exit_time(self.e)
+
+    def is_full(self):
+        return self.store.is_full(self.e)
+
+    def enqueue(self, agent):
+        return self.store.enqueue(self.e, agent.id, agent.link["enter_time"])
+
+    def ready(self, k, T):
+        return [self.store.agents[i] for i in self.store.ready(self.e, k, T)]
+
+    def release(self, n):
+        self.store.release(self.e, n)
+
+    def dequeue(self, k, T):
+        return [self.store.agents[i] for i in self.store.dequeue(self.e, k, T)]
+
+    def get_queue_used(self):
+        return self.store.get_queue_used(self.e)
+
+    def __str__(self) -> str:
+        return f"capacity: {self.c}, q: {self.q}, queue: {self.size()}"
@@ -0,0 +1,153 @@
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Per time step aggregates of a run, buffered in preallocated arrays and written in batches (one row per
+# time step) to a CSV or Parquet file when a path is given, otherwise kept in memory
+
+class MetricsCollector:
+    def __init__(self, path=None, batch_size=1024, top_links=5):
+        # fail before the run, not at the first flush
+        if path is not None and path.endswith(".parquet") and importlib.util.find_spec("pyarrow") is None:
+            raise ValueError("pyarrow is required to write the metrics to Parquet!")
+
+        self.path = path
+        self.batch_size = batch_size
+        self.top_links = top_links
+
+        self.k = np.zeros(batch_size, dtype=np.int64)
+        self.time = np.zeros(batch_size, dtype=np.float64)
+        self.moving = np.zeros(batch_size, dtype=np.int64)
+        self.evacuated = np.zeros(batch_size, dtype=np.int64)
+        self.dead = np.zeros(batch_size, dtype=np.int64)
+        self.occupied_links = np.zeros(batch_size, dtype=np.int64)
+        self.mean_velocity = np.zeros(batch_size, dtype=np.float64)
+        self.congested = np.full((batch_size, top_links), -1, dtype=np.int64)  # edge ids
+        self.congestion = np.zeros((batch_size, top_links), dtype=np.float64)  # queue used [0, 1]
+
+        self.size = 0
+        self.frames = []  # flushed batches when there is no path
+        self.writer = None
+        self.written = False
+
+    def record(self, k, time, moving, evacuated, dead, links, velocity, used):
+        # links: occupied edge ids, velocity and used: their velocity and used storage capacity
+        i = self.size
+
+        self.k[i] = k
+        self.time[i] = time
+        self.moving[i] = moving
+        self.evacuated[i] = evacuated
+        self.dead[i] = dead
+        self.occupied_links[i] = len(links)
+        self.mean_velocity[i] = velocity.mean() if len(velocity) > 0 else np.nan
+
+        top = min(self.top_links, len(links))
+        self.congested[i] = -1
+        self.congestion[i] = 0.0
+        if top > 0:
+            most = np.argpartition(-used, top - 1)[:top]
+            most = most[np.argsort(-used[most], kind="stable")]
+            self.congested[i, :top] = links[most]
+            self.congestion[i, :top] = used[most]
+
+        self.__advance()
+
+    def repeat(self, k, time):
+        # nothing changed since the last recorded time step
+        if self.size == 0 and len(self.frames) == 0 and not self.written:
+            return
+
+        i = self.size
+        last = i - 1 if i > 0 else self.batch_size - 1
+
+        for column in self.__columns():
+            column[i] = column[last]
+        self.k[i] = k
+        self.time[i] = time
+
+        self.__advance()
+
+    def __columns(self):
+        return [self.k, self.time, self.moving, self.evacuated, self.dead, self.occupied_links,
+                self.mean_velocity, self.congested, self.congestion]
+
+    def __advance(self):
+        self.size += 1
+        if self.size == self.batch_size:
+            self.flush()
+
+    def __batch(self):
+        n = self.size
+        data = {
+            "k": self.k[:n].copy(),
+            "time": self.time[:n].copy(),
+            "moving": self.moving[:n].copy(),
+            "evacuated": self.evacuated[:n].copy(),
+            "dead": self.dead[:n].copy(),
+            "occupied_links": self.occupied_links[:n].copy(),
+            "mean_velocity": self.mean_velocity[:n].copy(),
+        }
+        for j in range(self.top_links):
+            data[f"congested_{j}"] = self.congested[:n, j].copy()
+            data[f"congestion_{j}"] = self.congestion[:n, j].copy()
+
+        return pd.DataFrame(data)
+
+    def flush(self):
+        if self.size == 0:
+            return
+
+        batch = self.__batch()
+
+        if self.path is None:
+            self.frames.append(batch)
+        elif self.path.endswith(".parquet"):
+            self.__write_parquet(batch)
+        else:
+            batch.to_csv(self.path, mode="a" if self.written else "w", header=not self.written, index=False)
+
+        self.written = self.path is not None
+        # the last row stays in place for repeat()
+        for column in self.__columns():
+            column[-1] = column[self.size - 1]
+        self.size = 0
+
+    def __write_parquet(self, batch):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(batch, preserve_index=False)
+        if self.writer is None:
+            # a closed file can not be appended to: it is written again, followed by the new rows
+            previous = pq.read_table(self.path) if self.written else None
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+            if previous is not None:
+                self.writer.write_table(previous)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.flush()
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def to_frame(self):
+        # all the recorded time steps
+        self.flush()
+
+        if self.path is None:
+            if len(self.frames) == 0:
+                return self.__batch()
+            return pd.concat(self.frames, ignore_index=True)
+
+        self.close()
+        if not os.path.exists(self.path):
+            return self.__batch()
+        if self.path.endswith(".parquet"):
+            return pd.read_parquet(self.path)
+        return pd.read_csv(self.path)
@@ -1,115 +1,495 @@
-import random
+import os
 
 import networkx as nx
 import numpy as np
 import osmnx as ox
 
-from tsunami.simulation.link import Link, choice_link
+from tsunami.simulation.agents import AgentArray, DEAD, EVACUATED, MOVING, RESIDENT, TOURIST, TYPES, WAITING
+from tsunami.simulation.departure import PendingAgents
+from tsunami.simulation.hazard import FloodSchedule
+from tsunami.simulation.link import Link
+from tsunami.simulation.link_store import LinkStore
+from tsunami.simulation.metrics import MetricsCollector
 from tsunami.simulation.pedestrian import Pedestrian
-from tsunami.utils.roads import get_width
+from tsunami.simulation.population import seed_population
+from tsunami.simulation.positions import EdgeGeometry, progress
+from tsunami.simulation.route_handler import get_route_handler
+from tsunami.simulation.routing import ShortestPathTrees
+from tsunami.simulation.scheduler import EventScheduler
+from tsunami.simulation.shelter import Shelters
+from tsunami.simulation.transfer import group_rank, queue_prefix, resolve_transfers
+from tsunami.utils.roads import road_widths
 
 
 class EvacuationModel:
-    def __init__(self, graph: nx.MultiDiGraph, time_step, simulation_time=None):
+    def __init__(self, graph: nx.MultiDiGraph, time_step, simulation_time=None, link_store=False,
+                 agent_array=False, seed=None, verbose=0, metrics=None, reroute_every=None,
+                 reroute_tolerance=0.1, policy=None, node_transfer=False, recorder=None,
+                 departures=None, profiler=None, stall_time=3600):
         self.G = graph
-        self.shelters = []
 
-        self.agents = []
+        # 0: silent, 1: initialization and one line per time step, 2: every link and agent movement
+        self.verbose = verbose
+        self.metrics = metrics if metrics is not None else MetricsCollector()
+        self.recorder = recorder  # TrajectoryRecorder of the agents and links history, when given
+        self.profiler = profiler  # PhaseProfiler of the time steps, when given (it can be set at any time)
+        self.shelters = None  # Shelters snapped to the graph nodes
+
+        # the ring buffers of the link store hold the ids of the agents in the AgentArray
+        self.use_agent_array = agent_array
+        self.use_link_store = link_store or agent_array
+        self.links = None  # LinkStore, when enabled
+        self.occupied = set()  # edges of the Link objects entered since they were last seen empty
+        self.routes = None  # shortest path trees rooted at the destinations
+        self.geometry = None  # EdgeGeometry used to place the agents along the edges
+        self.flood = None  # FloodSchedule of the edges, when a tsunami is given
+        self.node_flood_time = None
+
+        # with rerouting the agents follow their routes, re-planned every reroute_every time steps if
+        # they cross an edge whose cost changed more than reroute_tolerance (relative)
+        self.reroute_every = reroute_every
+        self.reroute_tolerance = reroute_tolerance
+
+        # route policy ("greedy", "route", "field" or a RouteHandler), or a dict with one per agent type. By
+        # default the agents follow their shortest routes to the shelters
+        self.policy = policy
+        self.route_handlers = None  # RouteHandler of each agent type
+
+        # with the node transfer all the ready agents move at once: the free space of a link is shared among
+        # the links entering it proportionally to their flow capacity, instead of going to the first ones
+        self.node_transfer = node_transfer
+        if node_transfer and not agent_array:
+            raise ValueError("The node transfer needs the agent array!")
+
+        # the agents wait at their origin until their departure time, sampled by the DepartureModel (all
+        # at the start without it), then enter the first link of their route when it has room
+        self.departures = departures
+        self.pending = None  # PendingAgents
+
+        self.region = None  # Region of this model in the partitioned mode (see PartitionedModel)
+
+        self.agents = []  # Pedestrian objects or AgentArray
         self.total_agents = 0
         self.evacuated_agents = 0
         self.dead_agents = 0
+        self.evacuation_curve = []  # evacuated agents at the end of each time step
 
         self.T = time_step
         self.ST = simulation_time
         self.k = 0
 
-    def __finished(self):
+        # without a simulation time the run ends when every agent is evacuated or dead, or after stall_time
+        # seconds without any of them once nothing is left to come (departures, flooding): agents wandering
+        # under the greedy policy or stuck behind full shelters would never end it
+        self.stall_time = stall_time
+        self.progress = (0, 0)  # evacuated and dead agents, time step they changed last
+
+        self.rng = np.random.default_rng(seed)
+
+        self.agent_district = None  # district index of each agent
+        self.agent_origin = None  # origin node of each agent
+        self.agent_origin_index = None
+
+        # graph indexing, the edge id is the position in self.edges
+        self.nodes = np.array(list(self.G.nodes))
+        self.node_index = {n: i for i, n in enumerate(self.nodes)}
+        self.node_x = np.array([self.G.nodes[n]["x"] for n in self.nodes], dtype=np.float64)
+        self.node_y = np.array([self.G.nodes[n]["y"] for n in self.nodes], dtype=np.float64)
+
+        self.edges = list(self.G.edges)
+        self.edge_index = {e: i for i, e in enumerate(self.edges)}
+        self.edge_u = np.array([self.node_index[u] for u, _, _ in self.edges], dtype=np.int32)
+        self.edge_v = np.array([self.node_index[v] for _, v, _ in self.edges], dtype=np.int32)
+
+        # out edges of node n are out_edges[out_start[n]:out_start[n + 1]], in the graph order
+        self.out_edges = np.argsort(self.edge_u, kind="stable").astype(np.int32)
+        self.out_start = np.searchsorted(self.edge_u[self.out_edges], np.arange(len(self.nodes) + 1))
+
+    def now(self):
+        # simulation clock [s], independent of how fast the steps are computed
+        return self.k * self.T
+
+    def __log(self, message, level=1):
+        if self.verbose >= level:
+            print(message)
+
+    def __tic(self):
+        # start of a profiled phase, None when the profiler is off
+        if self.profiler is None or not self.profiler.enabled:
+            return None
+
+        return self.profiler.start()
+
+    def __toc(self, phase, start):
+        if start is not None:
+            self.profiler.stop(phase, start)
+
+    def __count(self, counter, n=1):
+        if self.profiler is not None and self.profiler.enabled:
+            self.profiler.count(counter, n)
+
+    def __begin_step(self):
+        if self.profiler is None or not self.profiler.enabled:
+            return None
+
+        self.profiler.begin_step(self.now())
+        return self.profiler.start()
+
+    def __end_step(self, start):
+        if start is not None:
+            self.profiler.stop("step", start)
+            self.profiler.end_step(self.now() + self.T)
+
+    def finished(self):
         if self.ST is not None:
             return self.k >= int(self.ST // self.T)
 
-        return self.evacuated_agents + self.dead_agents != self.total_agents
+        done = self.evacuated_agents + self.dead_agents
+        if done == self.total_agents:
+            return True
+
+        if done != self.progress[0]:
+            self.progress = (done, self.k)
+        if self.stall_time is None or (self.k - self.progress[1]) * self.T < self.stall_time:
+            return False
 
-    def __add_population(self, population):
-        print("init population")
-        self.total_agents = population['population'].sum()
+        departing = self.pending is not None and self.pending.next_time(self.now()) is not None
+        flooding = self.flood is not None and self.flood.next_time() is not None
+        if departing or flooding:
+            return False
+
+        self.__log(f"no agent evacuated or dead for {self.stall_time} seconds, stopping")
+        return True
+
+    def __add_population(self, population, district_nodes=None):
+        self.__log("init population")
 
         nx.set_node_attributes(self.G, {n: [] for n in self.G.nodes}, "agents")
 
-        l = 0
         # Add Residents
-        for p in range(len(population)):
-            name = population["name"][p]
-            quantity = population["population"][p]
-            polygon = population["geometry"][p]
+        self.agent_district, self.agent_origin = seed_population(self.G, population, self.rng,
+                                                                 verbose=self.verbose >= 2,
+                                                                 nodes=district_nodes)
+        self.total_agents = len(self.agent_origin)
 
-            agents = [Pedestrian(f"{name}#{i}", "resident") for i in range(quantity)]
+        if self.use_agent_array:
+            self.__add_agent_array()
+            return
 
-            gdf_nodes = ox.graph_to_gdfs(self.G, edges=False, fill_edge_geometry=False)
-            nodes_indices = gdf_nodes[gdf_nodes.geometry.within(polygon)].index.values
-            K = min(quantity, len(nodes_indices))  # number of nodes to divide the population into
+        names = population["name"].to_numpy()
+        first = np.searchsorted(self.agent_district, self.agent_district)  # first agent of each district
 
-            print(f"K: {K:3d}\t population: {quantity:4d}\t n_indices: {len(nodes_indices)}")
+        for i in range(self.total_agents):
+            n = self.agent_origin[i]
 
-            if K == 0:
-                continue
-            else:
-                self.agents.extend(agents)
+            agent = Pedestrian(f"{names[self.agent_district[i]]}#{i - first[i]}", "resident")
+            agent.id = len(self.agents)
+            self.agents.append(agent)
 
-            partitions = np.array_split(agents, K)
+            # initialize agent's position, it enters its first link when it departs
+            agent.set_initial_node(self.G.nodes[n])
+            agent.pos = (agent.curr_node["x"], agent.curr_node["y"])
 
-            for k in range(K):
-                if len(nodes_indices) <= quantity:
-                    idx = k
-                else:
-                    idx = random.randint(0, len(nodes_indices) - 1)
-
-                n = nodes_indices[idx]
+        # Add Tourists
 
-                # initialize agent's position and first link
-                for agent in partitions[k]:
-                    agent.set_initial_node(self.G.nodes[n])
-                    agent.pos = (agent.curr_node["x"], agent.curr_node["y"])
+    def __add_agent_array(self):
+        origin = np.array([self.node_index[n] for n in self.agent_origin], dtype=np.int32)
 
-                    # set initial edge
-                    edges = self.G.out_edges(n, keys=True)
-                    link = self.G.edges[list(edges)[0]]["link"]
-                    agent.set_link(link)
-                    link.enqueue(agent)
+        self.agents = AgentArray(origin, self.agent_district)
+        self.links.agents = self.agents
 
-                    l = l + 1
+        # initialize agent's position, it enters its first link when it departs
+        self.agents.x[:] = self.node_x[origin]
+        self.agents.y[:] = self.node_y[origin]
 
-        print(f"{l}/{len(self.agents)}")
+    def __add_shelters(self, shelters, shelter_nodes=None):
+        if shelters is None:
+            return
 
-        # Add Tourists
+        self.__log("init shelters")
+        self.shelters = Shelters(self.G, shelters, nodes=shelter_nodes)
 
-    def __add_shelters(self, shelters):
-        pass
+        self.routes = ShortestPathTrees(self.G, weight="cost")
+        self.routes.set_targets(self.shelters.nodes)
 
     def __add_tsunami(self, tsunami):
-        pass
+        if tsunami is None:
+            return
+
+        self.__log("init tsunami")
+        crs = self.G.graph.get("crs")
+
+        # flooding time of every node and edge, computed once
+        self.node_flood_time = tsunami.flood_time(self.node_x, self.node_y, crs=crs)
+        self.flood = FloodSchedule(tsunami.edge_flood_time(self.geometry, crs=crs))
+
+        self.__log(f"{np.count_nonzero(np.isfinite(self.flood.flood_time))}/{len(self.edges)} edges flooded")
+
+    def __add_departures(self):
+        self.__log("init departures")
+
+        origin = np.array([self.node_index[n] for n in self.agent_origin], dtype=np.int64)
+        if self.departures is not None:
+            departure_time = self.departures.sample(self.rng, self.agent_district)
+        else:
+            departure_time = np.zeros(self.total_agents)
+
+        # the agents still at their origin when it is flooded die there
+        flood_time = self.node_flood_time[origin] if self.node_flood_time is not None else None
+        self.pending = PendingAgents(np.arange(self.total_agents), departure_time, flood_time)
+        self.agent_origin_index = origin
+
+        if self.total_agents > 0:
+            self.__log(f"departures from {departure_time.min():.0f} to {departure_time.max():.0f} seconds")
+
+    def __depart(self):
+        # the due agents leave their origin (or die there if it is flooded), the ones whose first link is
+        # full stay at their origin and try again at the next time step. Returns the entered edges
+        start = self.__tic()
+        entered = self.__depart_due()
+        self.__toc("depart", start)
+
+        return entered
+
+    def __depart_due(self):
+        now = self.now()
+        held = self.pending.release()
+        ids, dies = self.pending.pop(now)
+
+        if len(held) > 0:
+            flooded = np.zeros(len(held), dtype=bool)
+            if self.node_flood_time is not None:
+                flooded = self.node_flood_time[self.agent_origin_index[held]] <= now
+            ids, dies = np.concatenate((held, ids)), np.concatenate((flooded, dies))
+
+        # in the partitioned mode every region takes part in the exchanges, even without departures
+        if len(ids) == 0 and self.region is None:
+            return []
+
+        dead = ids[dies]
+        if self.use_agent_array:
+            self.agents.kill(dead)
+        else:
+            for a in dead:
+                self.agents[a].kill()
+        self.dead_agents += len(dead)
+
+        ids = ids[~dies]
+        self.__count("agents departed", len(ids))
+        if self.node_transfer:
+            return self.__depart_many(ids)
+
+        entered, blocked = [], []
+        for a in ids:
+            j = self.__move(a if self.use_agent_array else self.agents[a])
+            if j is None:
+                blocked.append(a)
+            elif j >= 0:
+                entered.append(j)
+                if self.use_agent_array:
+                    self.agents.status[a] = MOVING
+
+        self.pending.hold(blocked, self.__stuck(np.array(blocked, dtype=np.int64)))
+        self.__log(f"{len(ids) - len(blocked)} agents departed, {len(blocked)} waiting for room", level=2)
+
+        return entered
+
+    def __depart_many(self, ids):
+        # same as __depart with the vectorized moves of the node transfer: each link takes the departing
+        # agents that fit in its free space, in departure order
+        edges = self.__next_edges(ids, None if self.region is None else self.region.departure_order[ids])
+
+        arrived = ids[edges == -1]
+        self.agents.status[arrived] = EVACUATED
+        self.evacuated_agents += len(arrived)
+
+        moving = np.flatnonzero(edges >= 0)
+        fits = moving[group_rank(edges[moving]) < self.links.free()[edges[moving]]]
+        self.__enter(ids[fits], edges[fits])
+        self.agents.status[ids[fits]] = MOVING
+        self.__count("enqueue rejections", len(moving) - len(fits))
+
+        blocked = np.ones(len(ids), dtype=bool)
+        blocked[fits] = False
+        blocked[edges == -1] = False
+        self.pending.hold(ids[blocked], (edges[blocked] < 0) | self.links.closed[np.maximum(edges[blocked], 0)])
+
+        return np.unique(edges[fits]).tolist()
+
+    def __stuck(self, ids):
+        # the agents at their origin without a way out: no next edge or a flooded one, unlike the ones waiting
+        # for room they can only leave after a rerouting
+        if len(ids) == 0:
+            return np.zeros(0, dtype=bool)
+
+        if self.use_agent_array:
+            agents = self.agents
+            edges = np.full(len(ids), -1, dtype=np.int64)
+            for t, handler in self.route_handlers.items():
+                m = agents.type[ids] == t
+                edges[m] = handler.next_edges(agents.node[ids[m]], self.__targets(agents.dest[ids[m]]),
+                                              agents.next_node(ids[m]))
+        else:
+            edges = np.array([self.__next_edge(self.agents[a]) for a in ids], dtype=np.int64)
+
+        if self.links is not None:
+            closed = self.links.closed[np.maximum(edges, 0)]
+        else:
+            closed = np.array([self.G.edges[self.edges[e]]["link"].closed for e in np.maximum(edges, 0)], dtype=bool)
+
+        return (edges < 0) | closed
+
+    def __next_edge(self, agent):
+        # the edge a Pedestrian at its origin wants to enter, -1 if there is none (see __move_agent)
+        node = self.node_index[agent.curr_node["id"]]
+        next_node = self.node_index[agent.next_node["id"]] if agent.next_node is not None else -1
+        target = self.__target(self.node_index[agent.dest_node["id"]]) if agent.dest_node is not None else -1
+
+        return self.route_handlers[TYPES[agent.type]].get_next_intersection(node, target, next_node)
+
+    def __flood(self):
+        # close the links reached by the tsunami and kill the agents on them, returns the flooded edges
+        if self.flood is None:
+            return []
+
+        start = self.__tic()
+        edges = self.flood.pop(self.now())
+
+        for i in edges:
+            if self.use_link_store:
+                agents = self.links.clear(i)
+                self.links.close(i)
+                if self.region is not None:
+                    # the links toward the other regions hold copies of their queues
+                    agents = agents[self.region.agents[agents]]
+                if not self.use_agent_array:
+                    agents = [self.agents[a] for a in agents]
+            else:
+                link = self.G.edges[self.edges[i]]["link"]
+                agents = link.clear()
+                link.close()
+
+            self.G.edges[self.edges[i]]["cost"] = np.inf
+
+            if self.use_agent_array:
+                self.agents.kill(agents)
+            else:
+                for agent in agents:
+                    agent.kill()
+
+            self.dead_agents += len(agents)
+
+        self.__update_route_handlers(edges)
+        self.__toc("flood", start)
+        return edges
+
+    def __shelter_costs(self, nodes):
+        # network cost from each node (index) to each shelter (shelters x nodes)
+        self.routes.refresh(None if self.links is None else self.links.t)
+
+        rows = [self.routes.target_row(n) for n in self.shelters.nodes]
+
+        return self.routes.dist[rows][:, nodes]
 
     def __assign_destinations(self):
-        print("init destinations")
-        for agent in self.agents:
-            agent.dest_node = self.G.nodes[100]
-            # agent.dest_node = self.__choice_shelter(agent.orig_node)
+        self.__log("init destinations")
+        if self.shelters is None:
+            self.__log("no shelters")
+            return
+
+        if self.use_agent_array:
+            agents = np.arange(len(self.agents))
+            nodes = self.agents.origin
+        else:
+            agents = [a for a in self.agents if a.orig_node is not None]
+            nodes = [self.node_index[a.orig_node["id"]] for a in agents]
+
+        costs = self.__shelter_costs(nodes)
+        assigned = self.shelters.assign(costs)
+
+        # when every reachable shelter is full the agent goes to the nearest one anyway
+        full = assigned < 0
+        nearest = np.argmin(costs, axis=0)
+        reachable = np.isfinite(costs[nearest, np.arange(len(agents))])
+        assigned[full & reachable] = nearest[full & reachable]
+
+        self.__log(f"{np.count_nonzero(full)} agents over capacity, {np.count_nonzero(~reachable)} without shelter")
+
+        if self.use_agent_array:
+            found = assigned >= 0
+            self.agents.shelter[found] = assigned[found]
+            self.agents.dest[found] = [self.node_index[n] for n in self.shelters.nodes[assigned[found]]]
+            return
+
+        for agent, s in zip(agents, assigned):
+            if s >= 0:
+                agent.shelter = s
+                agent.dest_node = self.G.nodes[self.shelters.nodes[s]]
 
     def __choice_shelter(self, node):
-        gdf = ox.graph_to_gdfs(self.G, edges=False)
-        gdf.query()
-        return None
+        # nearest shelter with free places from the node (index), None if there is none reachable
+        costs = self.__shelter_costs([node])[:, 0]
+        costs[~self.shelters.available()] = np.inf
+
+        s = np.argmin(costs)
+        if not np.isfinite(costs[s]):
+            return None
+
+        return s
+
+    def __redirect(self, agent):
+        # the destination shelter is full, go to another one from the current node
+        s = self.__choice_shelter(self.node_index[agent.curr_node["id"]])
+        if s is None:
+            return False
+
+        agent.shelter = s
+        agent.dest_node = self.G.nodes[self.shelters.nodes[s]]
+
+        route = self.routes.path(agent.curr_node["id"], agent.dest_node["id"])
+        agent.route = [self.G.nodes[node_id] for node_id in route]
+        agent.set_next_node()
+
+        return True
+
+    def __redirect_array_agent(self, a):
+        s = self.__choice_shelter(self.agents.node[a])
+        if s is None:
+            return False
+
+        self.agents.shelter[a] = s
+        self.agents.dest[a] = self.node_index[self.shelters.nodes[s]]
+
+        route = self.routes.path_index(self.agents.node[a], self.agents.dest[a])
+        self.agents.set_routes([route], [0], np.array([a]))
+
+        return True
 
     def __add_routes(self):
-        print("init routes")
+        self.__log("init routes")
         self.compute_routes()
 
     def __init_queues(self):
-        print("init queues")
-        for e in self.G.edges:
+        self.__log("init queues")
+        self.geometry = EdgeGeometry(self.G, self.edges)
+
+        # walkable widths stored by the preprocessing (or estimated once from the tags)
+        widths = road_widths(self.G, self.edges)
+
+        if self.use_link_store:
+            self.links = LinkStore(self.G, self.agents, widths)
+
+            for i, e in enumerate(self.links.edges):
+                edge = self.G.edges[e]
+                edge["link"] = self.links[i]
+                edge["cost"] = self.links.t[i]
+            return
+
+        self.occupied = set()
+        for e, width in zip(self.edges, widths):
             edge = self.G.edges[e]
 
             length = edge["length"]
-            width = get_width(edge["highway"], edge["lanes"] if "lanes" in edge else 0)
             area = length * width
 
             link = Link(length, width, area)
@@ -117,56 +497,322 @@ class EvacuationModel:
             edge["link"] = link
             edge["cost"] = link.get_travel_time()
 
-    def init_state(self, population, shelters, tsunami):
+    def __init_route_handlers(self):
+        policy = "route" if self.policy is None else self.policy
+        if not isinstance(policy, dict):
+            policy = {RESIDENT: policy, TOURIST: policy}
+        policy = {TYPES.get(t, t): p for t, p in policy.items()}
+
+        # the types with the same policy share its tables
+        handlers = {}
+        self.route_handlers = {}
+        for t in (RESIDENT, TOURIST):
+            p = policy.get(t, "route")
+            key = p if isinstance(p, str) else id(p)
+
+            if key not in handlers:
+                handlers[key] = get_route_handler(p, self)
+            self.route_handlers[t] = handlers[key]
+
+    def __update_route_handlers(self, edges):
+        # the costs of the edges changed
+        for handler in {id(h): h for h in self.route_handlers.values()}.values():
+            handler.update(edges)
+
+    def init_state(self, population, shelters, tsunami, district_nodes=None, shelter_nodes=None):
+        # district_nodes and shelter_nodes skip the spatial queries when already computed (see Scenario)
         self.__init_queues()
-        self.__add_population(population)
-        self.__add_shelters(shelters)
+        self.__add_population(population, district_nodes)
+        self.__add_shelters(shelters, shelter_nodes)
         self.__assign_destinations()
         self.__add_routes()
+        self.__init_route_handlers()
         self.__add_tsunami(tsunami)
+        self.__add_departures()
 
     def reset_state(self):
+        self.k = 0
+        self.progress = (0, 0)
         self.total_agents = 0
         self.evacuated_agents = 0
         self.dead_agents = 0
+        self.evacuation_curve = []
 
-    def step(self):
-        print(
-            f"# time step {self.k} \t {round(self.k * self.T, 2):2d} / {self.ST} minutes -------------------"
-        )
+    def get_positions(self):
+        # positions of the moving agents at the current simulation time
+        self.__update_positions()
+
+        if self.use_agent_array:
+            moving = (self.agents.status == MOVING) & (self.agents.edge >= 0)
+            return self.agents.x[moving], self.agents.y[moving]
+
+        positions = [a.pos for a in self.agents
+                     if a.pos is not None and a.link.get("edge") is not None and not (a.evacuated or a.dead)]
+        return np.array([p[0] for p in positions]), np.array([p[1] for p in positions])
+
+    def agent_state(self):
+        # position, edge id (-1 if none) and status of every agent at the current simulation time
+        self.__update_positions()
+
+        if self.use_agent_array:
+            return self.agents.x, self.agents.y, self.agents.edge, self.agents.status
+
+        x = np.array([a.pos[0] if a.pos is not None else np.nan for a in self.agents], dtype=np.float64)
+        y = np.array([a.pos[1] if a.pos is not None else np.nan for a in self.agents], dtype=np.float64)
+        edge = np.array([a.link.get("edge", -1) for a in self.agents], dtype=np.int32)
+        status = np.array([DEAD if a.dead else EVACUATED if a.evacuated else MOVING if a.link else WAITING
+                           for a in self.agents], dtype=np.int8)
+
+        return x, y, edge, status
+
+    def agent_shelters(self):
+        # destination shelter of every agent (-1 if none)
+        if self.use_agent_array:
+            return self.agents.shelter
+
+        return np.array([a.shelter if a.shelter is not None else -1 for a in self.agents], dtype=np.int32)
+
+    def link_state(self):
+        # occupancy, storage capacity and velocity of every edge
+        if self.links is not None:
+            return self.links.n, self.links.c, self.links.v
+
+        links = [self.G.edges[e]["link"] for e in self.edges]
+        n = np.array([link.size() for link in links], dtype=np.int64)
+        c = np.array([link.c for link in links], dtype=np.int64)
+        v = np.array([link.v for link in links], dtype=np.float64)
+
+        return n, c, v
+
+    def __update_positions(self):
+        start = self.__tic()
+        self.__interpolate_positions()
+        self.__toc("positions", start)
+
+    def __interpolate_positions(self):
+        if self.use_agent_array:
+            self.agents.update_pos(self.links, self.geometry, self.now())
+            return
+
+        agents = [a for a in self.agents if a.link.get("edge") is not None and not (a.evacuated or a.dead)]
+        if len(agents) == 0:
+            return
+
+        e = np.array([a.link["edge"] for a in agents], dtype=np.int64)
+        enter_time = np.array([a.link["enter_time"] for a in agents], dtype=np.float64)
+        velocity = np.array([a.link["link"].v for a in agents], dtype=np.float64)
+        length = np.array([a.link["link"].l for a in agents], dtype=np.float64)
+
+        x, y = self.geometry.interpolate(e, progress(self.now(), enter_time, velocity, length))
+        for agent, px, py in zip(agents, x, y):
+            agent.pos = (px, py)
+
+    def __ready(self, i):
+        # agents (or agent ids) that can leave the edge i, still in its queue
+        start = self.__tic()
+        if self.use_agent_array:
+            agents = self.links.ready(i, self.k, self.T)
+        else:
+            agents = self.G.edges[self.edges[i]]["link"].ready(self.k, self.T)
+        self.__toc("dequeue", start)
+
+        return agents
+
+    def __release(self, i, n):
+        start = self.__tic()
+        if self.use_agent_array:
+            self.links.release(i, n)
+        else:
+            self.G.edges[self.edges[i]]["link"].release(n)
+        self.__toc("dequeue", start)
+
+    def __leave(self, i):
+        # move the ready agents of the edge i in order until one is blocked (its next link is full), then
+        # remove the moved ones from the queue at once. Returns the edges they entered (-1 if they left)
+        agents = self.__ready(i)
+        self.__count("links touched")
+
+        edges = []
+        for agent in agents:
+            j = self.__move(agent)
+            if j is None:
+                break
+            edges.append(j)
+
+        self.__release(i, len(edges))
+        self.__print_dequeue(agents[:len(edges)])
+
+        return edges
+
+    def __next_exit_time(self, i):
+        return self.G.edges[self.edges[i]]["link"].next_exit_time()
+
+    def __move(self, agent):
+        # move a ready agent on its next link, returns the new edge id, -1 if the agent left the network or
+        # None if it is blocked (no free link) and stays where it is
+        if self.use_agent_array:
+            return self.__move_array_agent(agent)
+
+        return self.__move_agent(agent)
+
+    def __print_dequeue(self, agents):
+        if self.verbose < 2 or len(agents) == 0:
+            return
+
+        if self.use_agent_array:
+            print(f"dequeue ({list(agents)})")
+        else:
+            print(f"dequeue ({[a.name for a in agents]})")
+
+    def __print_step(self):
+        self.__log(f"# time step {self.k} \t {round(self.now(), 2)} / {self.ST} seconds -------------------")
+
+    def __print_link(self, e, v, t, used, n):
+        if self.verbose >= 2:
+            print(f"velocity: {v:.2f} m/s\ttravel time: {t:.2f}s\tqueue: [{e}] {used}% {n}")
+
+    def __record(self):
+        start = self.__tic()
+        self.__record_step()
+        self.__toc("record", start)
+
+    def __record_step(self):
+        # per time step aggregates of the occupied links
+        if self.region is not None:
+            self.region.report(self)
+            return
+
+        if self.links is not None:
+            links = self.links.occupied()
+            velocity = self.links.v[links]
+            used = self.links.n[links] / self.links.c[links]
+        else:
+            # only the links entered since the last time step they were empty, not the whole graph
+            occupied = [(i, self.G.edges[self.edges[i]]["link"]) for i in sorted(self.occupied)]
+            occupied = [(i, link) for i, link in occupied if link.size() > 0]
+            self.occupied = {i for i, _ in occupied}
+
+            links = np.array([i for i, _ in occupied], dtype=np.int64)
+            velocity = np.array([link.v for _, link in occupied], dtype=np.float64)
+            used = np.array([link.size() / link.c for _, link in occupied], dtype=np.float64)
+
+        moving = self.total_agents - self.evacuated_agents - self.dead_agents
+        self.metrics.record(self.k, self.now(), moving, self.evacuated_agents, self.dead_agents,
+                            links, velocity, used)
+
+        if self.recorder is not None:
+            self.recorder.record(self)
+
+    def __reroute_due(self):
+        return self.reroute_every is not None and self.routes is not None and \
+            self.k > 0 and self.k % self.reroute_every == 0
+
+    def __reroute(self):
+        start = self.__tic()
+        self.__reroute_changed()
+        self.__toc("reroute", start)
+
+    def __reroute_changed(self):
+        # update the trees of the changed edges, then re-plan the agents whose remaining route crosses them
+        changed = self.routes.update(None if self.links is None else self.links.t, self.reroute_tolerance)
+        if len(changed) == 0:
+            return
 
-        # update position of each agent in the queue
+        n = len(self.nodes)
+        pairs = np.unique(self.edge_u[changed].astype(np.int64) * n + self.edge_v[changed])
+
+        if self.use_agent_array:
+            self.__reroute_array_agents(pairs)
+            return
+
+        replanned = 0
         for agent in self.agents:
-            if agent.next_node is None:
-                print("Boh...")
+            if agent.evacuated or agent.dead or agent.route is None or agent.next_node is None:
                 continue
-            agent.update_pos(self.T)
 
-        for e in self.G.edges:
-            edge = self.G.edges[e]
+            remaining = np.array([self.node_index[node["id"]] for node in agent.route[agent.next_index - 1:]])
+            if not np.any(np.isin(remaining[:-1] * n + remaining[1:], pairs)):
+                continue
 
-            # dequeue agents that can leave
-            agents = edge["link"].dequeue(self.k, self.T)
+            route = self.routes.path(agent.curr_node["id"], agent.dest_node["id"])
+            if route is not None:
+                agent.route = [self.G.nodes[node_id] for node_id in route]
+                agent.set_next_node()
+                replanned += 1
 
-            if agents is not None and len(agents) > 0:
-                print(f"dequeue ({[a.name for a in agents]})")
+        self.__log(f"rerouting: {len(changed)} edges changed, {replanned} agents re-planned")
 
-            # update agent's curr_edge
-            for agent in agents:
-                min_e = choice_link(self.G, agent)
+    def __reroute_array_agents(self, pairs):
+        agents = self.agents
+        n = len(self.nodes)
 
-                if min_e is None:
-                    continue
+        # changed[p] counts the changed edges between the route nodes before position p of the flat routes
+        routes = agents.routes.astype(np.int64)
+        changed = np.zeros(len(routes), dtype=np.int64)
+        if len(routes) > 1:
+            changed[1:] = np.cumsum(np.isin(routes[:-1] * n + routes[1:], pairs))
+
+        active = np.flatnonzero(((agents.status == MOVING) | (agents.status == WAITING)) & (agents.dest >= 0) &
+                                (agents.next < agents.route_length))
+        if self.region is not None:
+            active = active[self.region.agents[active]]
+        current = agents.route_start[active] + agents.next[active] - 1
+        last = agents.route_start[active] + agents.route_length[active] - 1
+        crossing = active[changed[last] - changed[current] > 0]
+
+        routes, route_of = self.__plan_array_routes(agents.node[crossing], agents.dest[crossing])
+        found = route_of >= 0
+        agents.set_routes(routes, route_of[found], crossing[found])
+
+        # the new routes are appended: drop the old ones when they are most of the flat routes
+        alive = (agents.status == MOVING) | (agents.status == WAITING)
+        if self.region is not None:
+            alive &= self.region.agents
+        alive = np.flatnonzero(alive)
+        if 2 * np.maximum(agents.route_length[alive] - agents.next[alive] + 1, 0).sum() < len(agents.routes):
+            agents.compact_routes(alive)
+
+        self.__log(f"rerouting: {len(pairs)} edges changed, {np.count_nonzero(found)} agents re-planned")
 
-                _, v, _ = min_e
-                agent.curr_node = self.G.nodes[v]
+    def step(self):
+        self.__print_step()
+
+        if self.region is not None:
+            self.__receive_costs()
+
+        self.__flood()
+        if self.__reroute_due():
+            self.__reroute()
+
+        self.__depart()
+
+        if self.region is not None:
+            edges = self.region.occupied(self.links)
+        elif self.links is not None:
+            # only the edges with agents can have someone leaving
+            edges = self.links.occupied()
+        else:
+            edges = range(len(self.edges))
 
-                print(f"enqueue ({agent.name})")
-                agent.set_link(self.G.edges[min_e]["link"])
-                self.G.edges[min_e]["link"].enqueue(agent)
+        if self.node_transfer:
+            self.__transfer(edges)
+        else:
+            for i in edges:
+                # move the agents that can leave
+                self.__leave(i)
+
+        if self.region is not None:
+            self.__migrate()
 
         # update Link objects
-        for e in self.G.edges:
+        if self.links is not None:
+            self.__update_link_store(None if self.region is None else self.region.occupied(self.links))
+            self.__record()
+            return
+
+        start = self.__tic()
+        updated = []
+        for i, e in enumerate(self.edges):
             edge = self.G.edges[e]
 
             if "link" not in edge:
@@ -175,43 +821,569 @@ class EvacuationModel:
             link = edge["link"]
 
             # update only if any agents is present in the edge
-            if link.queue.qsize() > 0:
-                # print(f"update link of {e} {link.queue.qsize()}")
-
+            if link.size() > 0:
                 link.update_velocity()
                 new_cost = link.update_travel_time()
                 edge["cost"] = new_cost
+                updated.append(i)
+
+                self.__print_link(e, link.v, link.t, link.get_queue_used(), link.size())
+
+        self.__update_route_handlers(updated)
+        self.__toc("link update", start)
+        self.__count("links updated", len(updated))
+        self.__record()
+
+    def set_region(self, region):
+        # partitioned mode: this model simulates only the links ending in the nodes of the region, the agents
+        # on them and the ones waiting in the region, the rest is exchanged through the region at each step
+        if not self.node_transfer:
+            raise ValueError("The partitioned mode needs the node transfer!")
+
+        self.region = region
+        self.pending = self.pending.subset(region.agents)
+
+    def __receive_costs(self):
+        # costs of the links toward the other regions updated there at the previous time step, and all the
+        # costs when rerouting
+        edges, t, costs = self.region.costs()
+
+        self.links.t[edges] = t
+        if costs is not None:
+            edges = np.union1d(edges, np.flatnonzero(self.links.t != costs))
+            self.links.t[:] = costs
+        self.__update_route_handlers(edges)
+
+    def __migrate(self):
+        # the agents that entered the links toward the other regions go there, the ones coming from them enter
+        # their links here, in the same order
+        ids, edges, dest, shelter, routes, lengths = self.region.migrate(self.agents)
+
+        agents = self.agents
+        agents.node[ids] = self.edge_v[edges]
+        agents.dest[ids] = dest
+        agents.shelter[ids] = shelter
+        agents.status[ids] = MOVING
+        agents.append_routes(routes, lengths, ids)
+
+        agents.set_link(ids, edges, self.now())
+        self.links.enqueue_many(edges, ids, self.now())
+
+    def __update_link_store(self, edges=None):
+        # one vectorized pass over the occupied edges, then only their costs are written back
+        start = self.__tic()
+        updated = self.links.update(edges)
+
+        for i in updated:
+            e = self.links.edges[i]
+            self.G.edges[e]["cost"] = self.links.t[i]
+
+            if self.verbose >= 2:
+                self.__print_link(e, self.links.v[i], self.links.t[i], self.links.get_queue_used(i), self.links.n[i])
+
+        self.__update_route_handlers(updated)
+        self.__toc("link update", start)
+        self.__count("links updated", len(updated))
+
+    def __move_agent(self, agent):
+        # move a ready agent on its next link, returns the new edge id, -1 if evacuated or None if blocked
+        if agent.dest_node is not None and agent.curr_node["id"] == agent.dest_node["id"]:
+            if self.shelters is not None and agent.shelter is not None:
+                if self.shelters.is_full(agent.shelter) and self.__redirect(agent):
+                    return self.__move_agent(agent)
+
+                self.shelters.occupancy[agent.shelter] += 1
+
+            agent.evacuated = True
+            self.evacuated_agents += 1
+            return -1
+
+        node = self.node_index[agent.curr_node["id"]]
+        next_node = self.node_index[agent.next_node["id"]] if agent.next_node is not None else -1
+        target = self.__target(self.node_index[agent.dest_node["id"]]) if agent.dest_node is not None else -1
+
+        start = self.__tic()
+        e = self.route_handlers[TYPES[agent.type]].get_next_intersection(node, target, next_node)
+        full = e >= 0 and self.G.edges[self.edges[e]]["link"].is_full()
+        self.__toc("choice", start)
+
+        if e < 0 or full:
+            self.__count("enqueue rejections", full)
+            return None
+
+        min_e = self.edges[e]
+        _, v, _ = min_e
+        if agent.next_node is not None and v == agent.next_node["id"]:
+            agent.update_next_node()
+        agent.curr_node = self.G.nodes[v]
+
+        if self.verbose >= 2:
+            print(f"enqueue ({agent.name})")
+        start = self.__tic()
+        agent.set_link(self.G.edges[min_e]["link"], self.now(), self.edge_index[min_e])
+        self.G.edges[min_e]["link"].enqueue(agent)
+        self.occupied.add(e)
+        self.__toc("enqueue", start)
+        self.__count("agents moved")
+
+        return e
+
+    def __target(self, node):
+        # row of the destination node (index) in the shortest path trees, -1 if it is not a target
+        if self.routes is None:
+            return -1
+
+        i = np.searchsorted(self.routes.targets, node)
+        if i < len(self.routes.targets) and self.routes.targets[i] == node:
+            return i
+
+        return -1
+
+    def __move_array_agent(self, a):
+        agents = self.agents
+
+        if agents.node[a] == agents.dest[a]:
+            s = agents.shelter[a]
+            if self.shelters is not None and s >= 0:
+                if self.shelters.is_full(s) and self.__redirect_array_agent(a):
+                    return self.__move_array_agent(a)
+
+                self.shelters.occupancy[s] += 1
+
+            agents.status[a] = EVACUATED
+            self.evacuated_agents += 1
+            return -1
+
+        next_node = -1
+        if agents.next[a] < agents.route_length[a]:
+            next_node = agents.routes[agents.route_start[a] + agents.next[a]]
+        target = self.__target(agents.dest[a]) if agents.dest[a] >= 0 else -1
+
+        start = self.__tic()
+        e = self.route_handlers[agents.type[a]].get_next_intersection(agents.node[a], target, next_node)
+        full = e >= 0 and self.links.is_full(e)
+        self.__toc("choice", start)
+
+        if e < 0 or full:
+            self.__count("enqueue rejections", full)
+            return None
+
+        if next_node == self.edge_v[e]:
+            agents.next[a] += 1
+        agents.node[a] = self.edge_v[e]
+
+        if self.verbose >= 2:
+            print(f"enqueue ({a})")
+        start = self.__tic()
+        agents.set_link(a, e, self.now())
+        self.links.enqueue(e, a, self.now())
+        self.__toc("enqueue", start)
+        self.__count("agents moved")
+
+        return e
+
+    def __targets(self, nodes):
+        # same as __target for an array of nodes
+        targets = np.full(len(nodes), -1, dtype=np.int64)
+        if self.routes is None or len(self.routes.targets) == 0:
+            return targets
+
+        i = np.minimum(np.searchsorted(self.routes.targets, nodes), len(self.routes.targets) - 1)
+        found = (nodes >= 0) & (self.routes.targets[i] == nodes)
+        targets[found] = i[found]
+
+        return targets
+
+    def __arrive(self, ids, order=None):
+        # the agents at their destination, with a place reserved in their shelter (in queue order): the ones
+        # over capacity are redirected if possible, as in __move_array_agent. In the partitioned mode order is
+        # the position of the agents in the whole model, as the redirections are made there
+        agents = self.agents
+        arrived = np.flatnonzero(agents.node[ids] == agents.dest[ids])
+
+        if self.shelters is not None:
+            arrived = arrived[agents.shelter[ids[arrived]] >= 0]
+            s = agents.shelter[ids[arrived]]
+
+            fits = group_rank(s) < self.shelters.capacity[s] - self.shelters.occupancy[s]
+            self.shelters.occupancy += np.bincount(s[fits], minlength=len(self.shelters))
+
+            if self.region is not None:
+                self.region.settle(self, ids[arrived[~fits]], order[arrived[~fits]])
+            else:
+                self.settle(ids[arrived[~fits]])
+
+        return agents.node[ids] == agents.dest[ids]
+
+    def settle(self, ids):
+        # the arrived agents over the capacity of their shelter, in order: each one is redirected to the nearest
+        # shelter with free places, or takes a place over the capacity if there is none
+        agents = self.agents
+
+        for a in ids:
+            while self.shelters.is_full(agents.shelter[a]) and self.__redirect_array_agent(a):
+                if agents.node[a] != agents.dest[a]:
+                    break
+            else:
+                self.shelters.occupancy[agents.shelter[a]] += 1
+
+    def __unreserve(self, ids):
+        # the arrived agents still in their queue give back their places
+        if self.shelters is None:
+            return
+
+        s = self.agents.shelter[ids]
+        self.shelters.occupancy -= np.bincount(s[s >= 0], minlength=len(self.shelters))
+
+    def __next_edges(self, ids, order=None):
+        # edge each agent wants to enter, -1 if it arrived and -2 if there is none
+        start = self.__tic()
+        agents = self.agents
+
+        arrived = self.__arrive(ids, order)
+        nodes = agents.node[ids]
+        next_nodes = agents.next_node(ids)
+        targets = self.__targets(agents.dest[ids])
+
+        edges = np.full(len(ids), -2, dtype=np.int64)
+        edges[arrived] = -1
+        for t, handler in self.route_handlers.items():
+            m = ~arrived & (agents.type[ids] == t)
+            e = handler.next_edges(nodes[m], targets[m], next_nodes[m])
+            edges[m] = np.where(e >= 0, e, -2)
 
-                print((
-                    f"velocity: {link.v:.2f} m/s\t"
-                    f"travel time: {link.t:.2f}s\t"
-                    f"queue: [{e}] {link.get_queue_used()}% {link.queue.qsize()}"
-                ))
+        self.__toc("choice", start)
+        return edges
 
-    def run_iteration(self):
-        print("# ---------------------------------------------------")
+    def __enter(self, ids, edges):
+        # the agents enter the edges, as in __move_array_agent
+        start = self.__tic()
+        agents = self.agents
 
-        while not self.__finished():
-            self.step()
+        agents.next[ids[agents.next_node(ids) == self.edge_v[edges]]] += 1
+        agents.node[ids] = self.edge_v[edges]
+
+        agents.set_link(ids, edges, self.now())
+        self.links.enqueue_many(edges, ids, self.now())
+
+        if self.region is not None:
+            self.region.emigrate(ids, edges)
+
+        self.__toc("enqueue", start)
+        self.__count("agents moved", len(ids))
+
+    def __transfer(self, edges):
+        # node transfer phase: the ready agents of the edges move at once, in rounds. At each round every link
+        # takes the candidates that fit in its free space (shared fairly, see resolve_transfers), whose moves
+        # free space for the next round, until nobody else can move. Returns the entered edges
+        start = self.__tic()
+        upstream, ids = self.links.ready_many(edges, self.k, self.T)
+        self.__toc("dequeue", start)
+        self.__count("links touched", len(edges))
+
+        downstream = self.__next_edges(ids, None if self.region is None else self.region.queue_order(upstream))
+
+        # the agents without a next edge block the ones behind them
+        keep = queue_prefix(upstream, downstream != -2)
+        upstream, ids, downstream = upstream[keep], ids[keep], downstream[keep]
+
+        free = self.links.free()
+        entered = []
+        while len(ids) > 0 or self.region is not None:
+            start = self.__tic()
+            accepted = np.zeros(0, dtype=bool)
+            if len(ids) > 0:
+                accepted = resolve_transfers(upstream, downstream, free, self.links.q)
+            self.__toc("resolve", start)
+            if not np.any(accepted) and self.region is None:
+                break
+            self.__count("transfer rounds")
+
+            start = self.__tic()
+            left, counts = np.unique(upstream[accepted], return_counts=True)
+            self.links.release_many(left, counts)
+            free[left] += counts
+            self.__toc("dequeue", start)
+            self.__print_dequeue(ids[accepted])
+
+            moving = accepted & (downstream >= 0)
+            self.__enter(ids[moving], downstream[moving])
+            free -= np.bincount(downstream[moving], minlength=len(free))
+            entered.append(downstream[moving])
+
+            arrived = ids[accepted & (downstream == -1)]
+            self.agents.status[arrived] = EVACUATED
+            self.evacuated_agents += len(arrived)
+
+            upstream, ids, downstream = upstream[~accepted], ids[~accepted], downstream[~accepted]
+
+            # the regions go on together while any of them moved someone, freeing space in the others
+            if self.region is not None and not self.region.exchange_releases(self.links, free, left, counts,
+                                                                              np.any(accepted)):
+                break
+
+        self.__unreserve(ids[downstream == -1])
+        self.__count("enqueue rejections", np.count_nonzero(downstream >= 0))
+
+        return np.unique(np.concatenate(entered)) if len(entered) > 0 else np.zeros(0, dtype=np.int64)
+
+    def __transfer_events(self, scheduler, touched):
+        # node transfer of the edges due at this time step, the entered ones are due from the next one
+        edges = np.fromiter(scheduler.pop(self.k), dtype=np.int64)
+        entered = self.__transfer(edges)
+
+        touched.update(edges.tolist())
+        touched.update(entered.tolist())
+
+        for j in entered:
+            exit_time = self.__next_exit_time(j)
+            scheduler.schedule(j, max(scheduler.tick_of(exit_time), self.k + 1))
+
+        for i in edges:
+            exit_time = self.__next_exit_time(i)
+            if exit_time is not None:
+                scheduler.schedule(i, max(scheduler.tick_of(exit_time), self.k + 1))
+
+    def __step_events(self, scheduler, touched):
+        self.__print_step()
+
+        touched.update(self.__flood())
+        if self.__reroute_due():
+            self.__reroute()
+
+        # the departed agents leave their first link from the next time step
+        for j in self.__depart():
+            touched.add(j)
+            scheduler.schedule(j, max(scheduler.tick_of(self.__next_exit_time(j)), self.k + 1))
+
+        if self.node_transfer:
+            self.__transfer_events(scheduler, touched)
+            edges = []
+        else:
+            edges = scheduler.pop(self.k)
+
+        for i in edges:
+            touched.add(i)
+
+            for j in self.__leave(i):
+                if j < 0:
+                    continue
+
+                touched.add(j)
+
+                exit_time = self.__next_exit_time(j)
+                if exit_time is None:
+                    continue
+
+                # an edge before the current one would be scanned by step() only at the next time step
+                tick = max(scheduler.tick_of(exit_time), self.k)
+                if tick == self.k and j <= i:
+                    tick += 1
+                scheduler.schedule(j, tick)
+
+            exit_time = self.__next_exit_time(i)
+            if exit_time is not None:
+                scheduler.schedule(i, max(scheduler.tick_of(exit_time), self.k + 1))
+
+        # the link state depends only on its occupancy, so only the touched links can change
+        if self.links is not None:
+            self.__update_link_store(np.array(sorted(touched), dtype=np.int64))
+            self.__record()
+            return
+
+        start = self.__tic()
+        updated = []
+        for i in sorted(touched):
+            edge = self.G.edges[self.edges[i]]
+            link = edge["link"]
+
+            if link.size() > 0:
+                link.update_velocity()
+                edge["cost"] = link.update_travel_time()
+                updated.append(i)
+
+                self.__print_link(self.edges[i], link.v, link.t, link.get_queue_used(), link.size())
+
+        self.__update_route_handlers(updated)
+        self.__toc("link update", start)
+        self.__count("links updated", len(updated))
+        self.__record()
+
+    def __run_events(self):
+        scheduler = EventScheduler(self.T)
+        touched = set()
+        for i in range(len(self.edges)):
+            exit_time = self.__next_exit_time(i)
+            if exit_time is not None:
+                scheduler.schedule(i, max(scheduler.tick_of(exit_time), self.k))
+                touched.add(i)
+
+        end = int(self.ST // self.T) if self.ST is not None else None
+
+        # the first time step is always computed to update every occupied link, as step() does
+        k = self.k
+        while not self.finished():
+            if end is not None:
+                k = min(k, end)
+
+            # nothing happens in the skipped time steps
+            while self.k < k:
+                self.evacuation_curve.append(self.evacuated_agents)
+                self.metrics.repeat(self.k, self.now())
+                if self.recorder is not None:
+                    self.recorder.record(self)
+                self.k += 1
+
+            if self.finished():
+                break
+
+            start = self.__begin_step()
+            self.__step_events(scheduler, touched)
+            self.__end_step(start)
+            self.evacuation_curve.append(self.evacuated_agents)
             self.k += 1
 
-        print("# ---------------------------------------------------")
+            touched = set()
+            k = self.__next_event_tick(scheduler)
+            if k is None:
+                if end is not None:
+                    k = end
+                elif self.stall_time is not None:
+                    # nothing will happen anymore: skip to the end of the stall, as the step mode does
+                    k = max(self.progress[1] + int(np.ceil(self.stall_time / self.T)), self.k)
+                else:
+                    break
+
+    def __next_event_tick(self, scheduler):
+        # next time step with a link exit, a departure or a flooded edge
+        k = scheduler.next_tick()
+
+        departure_time = self.pending.next_time(self.now())
+        if departure_time is not None:
+            departure_tick = max(scheduler.tick_of(departure_time), self.k)
+            k = departure_tick if k is None else min(k, departure_tick)
+
+        flood_time = self.flood.next_time() if self.flood is not None else None
+        if flood_time is not None:
+            flood_tick = max(scheduler.tick_of(flood_time), self.k)
+            k = flood_tick if k is None else min(k, flood_tick)
+
+        # the costs change only at the computed time steps, so the first rerouting after them is enough
+        if k is not None and self.reroute_every is not None and self.routes is not None:
+            reroute_tick = max(-(-self.k // self.reroute_every) * self.reroute_every, self.reroute_every)
+            k = min(k, reroute_tick)
+
+        return k
+
+    def advance(self):
+        # one time step of the step mode
+        start = self.__begin_step()
+        self.step()
+        self.__end_step(start)
+        self.evacuation_curve.append(self.evacuated_agents)
+        self.k += 1
+
+    def run_iteration(self, mode="step"):
+        self.__log("# ---------------------------------------------------")
+
+        if mode == "step":
+            while not self.finished():
+                self.advance()
+        elif mode == "event":
+            self.__run_events()
+        else:
+            raise ValueError(f"Unknown simulation mode {mode}!")
+
+        self.finish()
+        self.__log("# ---------------------------------------------------")
+
+    def finish(self):
+        # end of a run, however it was driven (run_iteration, the viewer thread, the regions): the buffered
+        # metrics and trajectories are written (the metrics file closed, so it is complete), the profiler
+        # capture window is closed and its report written
+        self.metrics.close()
+        if self.recorder is not None:
+            self.recorder.flush()
+        if self.profiler is not None:
+            self.profiler.end_step(self.now(), last=True)
+            self.profiler.write(self.__output_directory())
+
+    def __output_directory(self):
+        # directory of the run output: the recorded trajectories or the metrics file, None if kept in memory
+        if self.recorder is not None:
+            return self.recorder.directory
+        if self.metrics.path is not None:
+            return os.path.dirname(os.path.abspath(self.metrics.path))
+
+        return None
+
+    def profile_report(self):
+        # time and calls of the phases, counters and capture window of the profiler (see PhaseProfiler)
+        if self.profiler is None:
+            return None
+
+        return self.profiler.report()
 
     def compute_routes(self):
+        if self.routes is None:
+            self.routes = ShortestPathTrees(self.G, weight="cost")
+
+        if self.use_agent_array:
+            self.__compute_array_routes()
+            return
+
         agents = [a for a in self.agents
                   if a.orig_node is not None
                   and a.dest_node is not None
                   and "id" in a.orig_node
                   and "id" in a.dest_node]
 
-        orig = [a.orig_node["id"] for a in agents]
-        dest = [a.dest_node["id"] for a in agents]
+        if self.shelters is not None:
+            self.routes.set_targets(self.shelters.nodes)
+        else:
+            self.routes.set_targets({a.dest_node["id"] for a in agents})
+        self.routes.refresh(None if self.links is None else self.links.t)
+
+        # agents with the same origin and destination share the same route
+        routes = {}
+        for agent in agents:
+            key = (agent.orig_node["id"], agent.dest_node["id"])
+
+            if key not in routes:
+                route = self.routes.path(*key)
+                routes[key] = [self.G.nodes[node_id] for node_id in route] if route is not None else None
+
+            agent.route = routes[key]
+            if agent.route is not None:
+                agent.set_next_node()
+
+    def __compute_array_routes(self):
+        agents = np.flatnonzero(self.agents.dest >= 0)
+        orig = self.agents.node[agents].astype(np.int64)
+        dest = self.agents.dest[agents].astype(np.int64)
+
+        if self.shelters is not None:
+            self.routes.set_targets(self.shelters.nodes)
+        else:
+            self.routes.set_targets(self.nodes[np.unique(dest)])
+        self.routes.refresh(self.links.t)
+
+        routes, route_of = self.__plan_array_routes(orig, dest)
+        self.agents.set_routes(routes, route_of, agents)
+
+    def __plan_array_routes(self, orig, dest):
+        # agents with the same origin and destination share the same route, route_of is -1 if not found
+        orig = np.asarray(orig, dtype=np.int64)
+        dest = np.asarray(dest, dtype=np.int64)
+
+        pairs, route_of = np.unique(orig * len(self.nodes) + dest, return_inverse=True)
+        routes = [self.routes.path_index(p // len(self.nodes), p % len(self.nodes)) for p in pairs]
 
-        routes = ox.shortest_path(self.G, orig, dest, weight='cost')
+        found = np.array([r is not None for r in routes], dtype=bool)
+        found_index = np.cumsum(found) - 1
+        route_of = np.where(found[route_of], found_index[route_of], -1)
 
-        for i in range(len(routes)):
-            agents[i].route = [self.G.nodes[node_id] for node_id in routes[i]]
-            agents[i].set_next_node()
+        return [r for r in routes if r is not None], route_of
 
     def compute_route(self, agent):
         if agent.dest_node is None:
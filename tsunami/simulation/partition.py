@@ -0,0 +1,418 @@
+import multiprocessing as mp
+import traceback
+
+import numpy as np
+
+from tsunami.simulation.agents import MOVING, WAITING
+from tsunami.simulation.transfer import group_starts
+
+ROUTES_LIMIT = 1 << 20  # length of the flat routes of a region over which the routes of the others are dropped
+
+
+def kd_partition(x, y, parts, weights=None):
+    # region of each node: recursive cuts of the widest side at the weighted median, so that the regions are
+    # compact (few links between them) and hold about the same weight (nodes, agents, ...)
+    if weights is None:
+        weights = np.ones(len(x))
+
+    region = np.zeros(len(x), dtype=np.int32)
+    stack = [(np.arange(len(x)), 0, parts)]
+    while stack:
+        nodes, first, n = stack.pop()
+        if n <= 1 or len(nodes) == 0:
+            region[nodes] = first
+            continue
+
+        axis = x if np.ptp(x[nodes]) >= np.ptp(y[nodes]) else y
+        order = nodes[np.argsort(axis[nodes], kind="stable")]
+
+        left = n // 2
+        cumulative = np.cumsum(weights[order])
+        cut = np.searchsorted(cumulative, cumulative[-1] * left / n)
+
+        stack.append((order[:cut], first, left))
+        stack.append((order[cut:], first + left, n - left))
+
+    return region
+
+
+# One region of a partitioned model, held by the model of a worker process (see EvacuationModel.set_region):
+# it simulates the links ending in its nodes and the agents on them. The links starting in the region and
+# ending in another one are exact copies of the queues there, as they see the same entries (from this region
+# only) and the same releases (sent back at each round). The agents entering them go there at the end of the
+# time step, their costs come back at the next one. The redirections to the other shelters are made by the
+# coordinator (PartitionedModel), in the same order as the serial model
+
+class Region:
+    def __init__(self, part, node_region, model, conn):
+        self.part = part
+        self.conn = conn
+
+        self.edge_region = node_region[model.edge_u]
+        self.owned = node_region[model.edge_v] == part  # links whose queues are simulated here
+        self.agents = node_region[model.agent_origin_index] == part  # agents simulated here
+
+        # position of each agent in the departure order of the whole model
+        self.departure_order = np.empty(model.total_agents, dtype=np.int64)
+        self.departure_order[model.pending.agents] = np.arange(len(model.pending.agents))
+
+        # position of the ready agents in the queue order of the whole model: edge, then place in its queue
+        self.scale = int(model.links.c.max(initial=0)) + 1
+
+        self.shelters = np.zeros(0, dtype=np.int64)
+        if model.shelters is not None:
+            nodes = np.array([model.node_index[n] for n in model.shelters.nodes], dtype=np.int64)
+            self.shelters = np.flatnonzero(node_region[nodes] == part)
+
+        # state of the owned links at the last report
+        self.n, self.v, self.t = model.links.n.copy(), model.links.v.copy(), model.links.t.copy()
+
+        # the counters of the coordinator, the regions report what they add
+        self.evacuated, self.dead = model.evacuated_agents, model.dead_agents
+
+        self.command = None  # step command of the coordinator: mirrored edges, their costs, all the costs, record
+        self.emigrants = ([], [])
+        self.routes_limit = ROUTES_LIMIT
+
+    def __send(self, tag, *payload):
+        self.conn.send((tag,) + payload)
+
+    def __recv(self):
+        return self.conn.recv()
+
+    def costs(self):
+        _, edges, t, costs, _ = self.command
+        return edges, t, costs
+
+    def occupied(self, links):
+        return np.flatnonzero(self.owned & (links.n > 0))
+
+    def queue_order(self, upstream):
+        return upstream * self.scale + (np.arange(len(upstream)) - group_starts(upstream))
+
+    def settle(self, model, ids, order):
+        # the arrived agents over capacity are settled by the coordinator with the global occupancy of the
+        # shelters, the redirected ones get their new shelter and route
+        agents = model.agents
+        occupancy = model.shelters.occupancy
+
+        self.__send("settle", self.shelters, occupancy[self.shelters], ids, order, agents.node[ids],
+                    agents.shelter[ids], agents.dest[ids])
+        occupancy[:], ids, shelter, dest, routes, lengths, costs = self.__recv()
+
+        agents.shelter[ids] = shelter
+        agents.dest[ids] = dest
+        agents.append_routes(routes, lengths, ids)
+
+        # the trees were recomputed for the redirections
+        if costs is not None:
+            model.links.t[:] = costs
+            model.routes.refresh(model.links.t)
+
+    def exchange_releases(self, links, free, left, counts, progress):
+        # the releases of the links coming from other regions free space in their copies there, returns
+        # whether any region moved someone at this round
+        boundary = self.edge_region[left] != self.part
+        self.__send("round", progress, left[boundary], counts[boundary])
+        go, edges, counts = self.__recv()
+
+        links.release_many(edges, counts)
+        free[edges] += counts
+
+        return go
+
+    def emigrate(self, ids, edges):
+        # the agents entering the links toward other regions leave this one at the end of the time step
+        out = ~self.owned[edges]
+        self.emigrants[0].append(ids[out])
+        self.emigrants[1].append(edges[out])
+        self.agents[ids[out]] = False
+
+    def migrate(self, agents):
+        # the emigrants go with the rest of their routes, the immigrants come, in the order they entered
+        ids = np.concatenate(self.emigrants[0]).astype(np.int64) if self.emigrants[0] else np.zeros(0, np.int64)
+        edges = np.concatenate(self.emigrants[1]).astype(np.int64) if self.emigrants[1] else np.zeros(0, np.int64)
+        self.emigrants = ([], [])
+
+        routes, lengths = agents.remaining_routes(ids)
+        self.__send("migrate", ids, edges, agents.dest[ids], agents.shelter[ids], routes, lengths)
+
+        # the routes of the agents gone (or done) are dropped when the flat routes grow too long
+        if len(agents.routes) > self.routes_limit:
+            active = np.flatnonzero(self.agents & ((agents.status == MOVING) | (agents.status == WAITING)))
+            agents.compact_routes(active)
+            self.routes_limit = max(2 * len(agents.routes), ROUTES_LIMIT)
+
+        ids, edges, dest, shelter, routes, lengths = self.__recv()
+        self.agents[ids] = True
+
+        return ids, edges, dest, shelter, routes, lengths
+
+    def state(self, agents):
+        # the agents of the region, for the records of the coordinator
+        ids = np.flatnonzero(self.agents)
+        return ids, agents.node[ids], agents.edge[ids], agents.enter_time[ids], agents.status[ids], \
+            agents.shelter[ids]
+
+    def report(self, model):
+        # end of the time step: the counters, the owned links that changed and the places of the owned shelters
+        links = model.links
+        changed = np.flatnonzero(self.owned & ((links.n != self.n) | (links.v != self.v) | (links.t != self.t)))
+        self.n[changed], self.v[changed], self.t[changed] = links.n[changed], links.v[changed], links.t[changed]
+
+        occupancy = model.shelters.occupancy[self.shelters] if model.shelters is not None else None
+        state = self.state(model.agents) if self.command[4] else None
+        self.__send("report", model.evacuated_agents - self.evacuated, model.dead_agents - self.dead, changed,
+                    links.n[changed], links.v[changed], links.t[changed], occupancy, state)
+
+
+def _run_region(model, part, node_region, conn):
+    try:
+        model.verbose = 0
+        model.set_region(Region(part, node_region, model, conn))
+
+        while True:
+            command = conn.recv()
+            if command[0] == "close":
+                break
+
+            if command[0] == "gather":
+                conn.send(("state",) + model.region.state(model.agents))
+                continue
+
+            model.region.command = command
+            model.step()
+            model.k += 1
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+# The model split in regions (kd_partition of the nodes, weighted by the agents by default) simulated by
+# worker processes in lockstep. The model (initialized, agent array and node transfer) is the coordinator:
+# it closes the flooded links, reroutes, settles the agents over capacity in order, routes the releases and
+# the migrants between the regions and records the global state. The results are the same as the serial
+# step mode, in the model (evacuation curve, metrics, recorder)
+
+class PartitionedModel:
+    def __init__(self, model, parts=2, weights=None):
+        if not model.node_transfer or not model.use_agent_array or model.links is None:
+            raise ValueError("The partitioned mode needs the agent array and the node transfer!")
+        if model.pending is None or model.k > 0:
+            raise ValueError("The partitioned mode needs an initialized model not run yet!")
+
+        if weights is None:
+            weights = 1 + np.bincount(model.agent_origin_index, minlength=len(model.nodes))
+
+        self.model = model
+        self.parts = parts
+        self.node_region = kd_partition(model.node_x, model.node_y, parts, weights)
+        self.owner = self.node_region[model.edge_v]
+        self.upstream = self.node_region[model.edge_u]
+        self.mirrored = [np.zeros(0, dtype=np.int64)] * parts  # links whose new costs go to each region
+        self.evacuated, self.dead = model.evacuated_agents, model.dead_agents
+
+        self.shelters = [np.zeros(0, dtype=np.int64)] * parts  # shelters of each region
+        if model.shelters is not None:
+            nodes = np.array([model.node_index[n] for n in model.shelters.nodes], dtype=np.int64)
+            self.shelters = [np.flatnonzero(self.node_region[nodes] == part) for part in range(parts)]
+
+        # with fork the workers inherit the model without pickling it
+        method = "fork" if "fork" in mp.get_all_start_methods() else None
+        context = mp.get_context(method)
+
+        self.conns = []
+        self.workers = []
+        for part in range(parts):
+            conn, child = context.Pipe()
+            worker = context.Process(target=_run_region, args=(model, part, self.node_region, child), daemon=True)
+            worker.start()
+            child.close()
+
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __gather(self, tag):
+        messages = []
+        for conn in self.conns:
+            message = conn.recv()
+            if message[0] == "error":
+                raise ValueError(f"Region failed!\n{message[1]}")
+            if message[0] != tag:
+                raise ValueError(f"Unexpected message {message[0]} instead of {tag}!")
+            messages.append(message[1:])
+
+        return messages
+
+    def __reroute_due(self):
+        model = self.model
+        return model.reroute_every is not None and model.routes is not None and \
+            model.k > 0 and model.k % model.reroute_every == 0
+
+    def __settle(self):
+        # the agents over capacity of every region, in the order of the serial model
+        model = self.model
+        agents = model.agents
+        messages = self.__gather("settle")
+
+        for shelters, occupancy, *_ in messages:
+            model.shelters.occupancy[shelters] = occupancy
+
+        ids = np.concatenate([m[2] for m in messages]).astype(np.int64)
+        order = np.argsort(np.concatenate([m[3] for m in messages]), kind="stable")
+        agents.node[ids] = np.concatenate([m[4] for m in messages])
+        agents.shelter[ids] = np.concatenate([m[5] for m in messages])
+        agents.dest[ids] = np.concatenate([m[6] for m in messages])
+
+        previous = agents.shelter[ids]
+        version = model.routes.version
+        model.settle(ids[order])
+        costs = model.links.t.copy() if model.routes.version != version else None
+
+        redirected = ids[agents.shelter[ids] != previous]
+        region = self.node_region[agents.node[redirected]]
+        for part, conn in enumerate(self.conns):
+            redirected_here = redirected[region == part]
+            routes, lengths = agents.remaining_routes(redirected_here)
+            conn.send((model.shelters.occupancy, redirected_here, agents.shelter[redirected_here],
+                       agents.dest[redirected_here], routes, lengths, costs))
+
+    def __exchange_releases(self):
+        # a round of the node transfer: the releases go to the region upstream of the links
+        messages = self.__gather("round")
+
+        go = any(m[0] for m in messages)
+        edges = np.concatenate([m[1] for m in messages]).astype(np.int64)
+        counts = np.concatenate([m[2] for m in messages]).astype(np.int64)
+
+        region = self.upstream[edges]
+        for part, conn in enumerate(self.conns):
+            conn.send((go, edges[region == part], counts[region == part]))
+
+        return go
+
+    def __migrate(self):
+        # the migrants go to the region downstream of their links, in the order they entered
+        messages = self.__gather("migrate")
+
+        ids, edges, dest, shelter, routes, lengths = (np.concatenate([m[i] for m in messages]) for i in range(6))
+        lengths = lengths.astype(np.int64)
+        agent_of = np.repeat(np.arange(len(ids)), lengths)
+
+        region = self.owner[edges.astype(np.int64)]
+        for part, conn in enumerate(self.conns):
+            m = region == part
+            conn.send((ids[m], edges[m], dest[m], shelter[m], routes[m[agent_of]], lengths[m]))
+
+    def __set_state(self, state):
+        ids, node, edge, enter_time, status, shelter = state
+
+        agents = self.model.agents
+        agents.node[ids] = node
+        agents.edge[ids] = edge
+        agents.enter_time[ids] = enter_time
+        agents.status[ids] = status
+        agents.shelter[ids] = shelter
+
+    def __report(self):
+        model = self.model
+        links = model.links
+        messages = self.__gather("report")
+
+        model.evacuated_agents = self.evacuated + sum(m[0] for m in messages)
+        model.dead_agents = self.dead + sum(m[1] for m in messages)
+
+        changed = []
+        for part, (_, _, edges, n, v, t, occupancy, state) in enumerate(messages):
+            links.n[edges], links.v[edges], links.t[edges] = n, v, t
+            changed.append(edges)
+
+            # the places given back by the agents still in their queues
+            if occupancy is not None:
+                model.shelters.occupancy[self.shelters[part]] = occupancy
+
+            if state is not None:
+                self.__set_state(state)
+
+        # the copies of the changed links in the regions upstream get their costs at the next time step
+        changed = np.concatenate(changed).astype(np.int64)
+        changed = changed[self.upstream[changed] != self.owner[changed]]
+        self.mirrored = [changed[self.upstream[changed] == part] for part in range(self.parts)]
+
+    def __record(self):
+        model = self.model
+        links = model.links
+
+        occupied = links.occupied()
+        moving = model.total_agents - model.evacuated_agents - model.dead_agents
+        model.metrics.record(model.k, model.now(), moving, model.evacuated_agents, model.dead_agents,
+                             occupied, links.v[occupied], links.n[occupied] / links.c[occupied])
+
+        if model.recorder is not None:
+            model.recorder.record(model)
+
+    def advance(self):
+        # one time step of every region, as EvacuationModel.advance
+        model = self.model
+        links = model.links
+
+        if model.flood is not None:
+            for i in model.flood.pop(model.now()):
+                links.close(i)
+
+        costs = None
+        if self.__reroute_due():
+            model.routes.update(links.t, model.reroute_tolerance)
+            costs = links.t.copy()
+
+        record = model.recorder is not None and model.k % model.recorder.every == 0
+        for part, conn in enumerate(self.conns):
+            edges = self.mirrored[part]
+            conn.send(("step", edges, links.t[edges], costs, record))
+
+        if model.shelters is not None:
+            self.__settle()  # departures
+            self.__settle()  # node transfer
+
+        while self.__exchange_releases():
+            pass
+
+        self.__migrate()
+        self.__report()
+        self.__record()
+
+        model.evacuation_curve.append(model.evacuated_agents)
+        model.k += 1
+
+    def run(self):
+        model = self.model
+        while not model.finished():
+            self.advance()
+
+        # the final state of every agent
+        for conn in self.conns:
+            conn.send(("gather",))
+        for state in self.__gather("state"):
+            self.__set_state(state)
+
+        model.finish()
+
+        return model
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(("close",))
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+
+        for worker in self.workers:
+            worker.join()
@@ -2,6 +2,7 @@ import os
 
 import contextily as ctx
 import matplotlib.pyplot as plt
+import numpy as np
 import osmnx as ox
 from descartes import PolygonPatch
 from shapely.geometry import MultiPolygon
@@ -13,21 +14,29 @@ from tsunami.utils.geometries import load
 class ModelViewer:
     def __init__(self, model):
         self.model = model
+        self.agents_plot = None  # figure and scatter of plot_agents
 
     def plot_agents(self):
-        fig, ax = ox.plot_graph(self.model.G,
-                                node_size=0,
-                                edge_linewidth=1,
-                                bgcolor="#0b3496",
-                                figsize=(9, 9),
-                                show=False)
-
-        positions = [a.pos for a in self.model.agents if a.pos is not None]
-        x = [p[0] for p in positions]
-        y = [p[1] for p in positions]
-        ax.scatter(x, y, c="g", alpha=0.8, edgecolors='none')
-
-        fig.tight_layout(pad=0.0)
+        # the network is plotted only the first time, then only the agents are moved (see FrameRenderer to
+        # render many frames)
+        if self.agents_plot is None:
+            fig, ax = ox.plot_graph(self.model.G,
+                                    node_size=0,
+                                    edge_linewidth=1,
+                                    bgcolor="#0b3496",
+                                    figsize=(9, 9),
+                                    show=False)
+
+            scatter = ax.scatter([], [], c="g", alpha=0.8, edgecolors='none')
+            fig.tight_layout(pad=0.0)
+            self.agents_plot = fig, scatter
+
+        fig, scatter = self.agents_plot
+
+        x, y = self.model.get_positions()
+        scatter.set_offsets(np.column_stack((x, y)))
+
+        fig.canvas.draw_idle()
         fig.show()
 
     def plot_street(self, show=True):
@@ -0,0 +1,62 @@
+import geopandas as gpd
+import numpy as np
+import osmnx as ox
+
+
+def district_nodes(graph, population):
+    # graph nodes inside each district: the nodes of district p are node_ids[bounds[p]:bounds[p + 1]]
+    gdf_nodes = ox.graph_to_gdfs(graph, edges=False, fill_edge_geometry=False)
+
+    # a node without out edges has no first link to enqueue the agents on
+    gdf_nodes = gdf_nodes[[graph.out_degree(n) > 0 for n in gdf_nodes.index]]
+
+    districts = population[["geometry"]].reset_index(drop=True)
+    if districts.crs is not None and gdf_nodes.crs is not None and districts.crs != gdf_nodes.crs:
+        districts = districts.to_crs(gdf_nodes.crs)
+
+    # one spatial join (using the districts sindex) instead of a within test per district
+    joined = gpd.sjoin(gdf_nodes[["geometry"]], districts, how="inner")
+    joined = joined[~joined.index.duplicated(keep="first")]
+
+    node_district = joined["index_right"].to_numpy()
+    order = np.argsort(node_district, kind="stable")
+    node_ids = joined.index.to_numpy()[order]
+    bounds = np.searchsorted(node_district[order], np.arange(len(districts) + 1))
+
+    return node_ids, bounds
+
+
+def seed_population(graph, population, rng, verbose=False, nodes=None):
+    # place the residents of each district on the graph nodes inside it, returns two columns with the
+    # district index and the origin node of each agent (grouped by district). The nodes of the districts
+    # can be given already computed by district_nodes
+    node_ids, bounds = district_nodes(graph, population) if nodes is None else nodes
+
+    quantities = population["population"].to_numpy(dtype=np.int64)
+
+    agent_district, agent_node = [], []
+    for p, quantity in enumerate(quantities):
+        nodes = node_ids[bounds[p]:bounds[p + 1]]
+        K = min(quantity, len(nodes))  # number of nodes to divide the population into
+
+        if verbose:
+            print(f"K: {K:3d}\t population: {quantity:4d}\t n_indices: {len(nodes)}")
+
+        if K == 0:
+            continue
+
+        if len(nodes) <= quantity:
+            # round robin: the first quantity % K nodes get one more agent
+            sizes = np.full(K, quantity // K)
+            sizes[:quantity % K] += 1
+            origins = np.repeat(nodes, sizes)
+        else:
+            origins = nodes[rng.integers(0, len(nodes), size=quantity)]
+
+        agent_district.append(np.full(quantity, p, dtype=np.int32))
+        agent_node.append(origins)
+
+    if len(agent_node) == 0:
+        return np.zeros(0, dtype=np.int32), node_ids[:0]
+
+    return np.concatenate(agent_district), np.concatenate(agent_node)
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+def progress(now, enter_time, velocity, length):
+    # fraction of the edge walked since entering it, the agents waiting to leave stay at the end
+    walked = (now - enter_time) * velocity
+    return np.divide(walked, length, out=np.ones_like(walked), where=length > 0)
+
+
+# Polylines of all the edges (the edge geometry or the straight segment between its nodes) stored in
+# flat arrays with the cumulative length of each vertex, so the position of many agents along their
+# edges is interpolated at once
+
+class EdgeGeometry:
+    def __init__(self, graph, edges):
+        xs, ys, counts = [], [], []
+
+        for u, v, k in edges:
+            data = graph.edges[u, v, k]
+            start = (graph.nodes[u]["x"], graph.nodes[u]["y"])
+            end = (graph.nodes[v]["x"], graph.nodes[v]["y"])
+
+            if "geometry" in data:
+                coords = np.asarray(data["geometry"].coords, dtype=np.float64)[:, :2]
+
+                # the geometry must go from u to v
+                if np.hypot(*(coords[0] - start)) > np.hypot(*(coords[-1] - start)):
+                    coords = coords[::-1]
+            else:
+                coords = np.array([start, end], dtype=np.float64)
+
+            xs.append(coords[:, 0])
+            ys.append(coords[:, 1])
+            counts.append(len(coords))
+
+        self.x = np.concatenate(xs)
+        self.y = np.concatenate(ys)
+
+        counts = np.array(counts, dtype=np.int64)
+        self.start = np.zeros(len(counts), dtype=np.int64)
+        self.start[1:] = np.cumsum(counts)[:-1]
+        self.end = self.start + counts - 1  # last vertex
+
+        # distance of each vertex from the beginning of all the polylines, each edge starts where the
+        # previous one ends so a single sorted array can be searched for every edge
+        segments = np.hypot(np.diff(self.x), np.diff(self.y))
+        segments[self.end[:-1]] = 0.0  # between the last vertex of an edge and the first of the next
+        self.cum = np.zeros(len(self.x), dtype=np.float64)
+        self.cum[1:] = np.cumsum(segments)
+
+        self.length = self.cum[self.end] - self.cum[self.start]  # polyline length
+
+    def interpolate(self, edges, fraction):
+        # coordinates at the given fraction (0 = u, 1 = v) of the edges
+        fraction = np.clip(fraction, 0.0, 1.0)
+        target = self.cum[self.start[edges]] + fraction * self.length[edges]
+
+        i = np.searchsorted(self.cum, target, side="right")
+        i = np.clip(i, self.start[edges] + 1, self.end[edges])
+
+        span = self.cum[i] - self.cum[i - 1]
+        t = np.divide(target - self.cum[i - 1], span, out=np.zeros_like(target), where=span > 0)
+
+        x = self.x[i - 1] + t * (self.x[i] - self.x[i - 1])
+        y = self.y[i - 1] + t * (self.y[i] - self.y[i - 1])
+
+        return x, y
@@ -0,0 +1,139 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+
+import pandas as pd
+
+
+# Cumulative time of the phases of the time steps (flood, reroute, depart, dequeue, choice, enqueue, link
+# update, ...) and counters (agents moved, links touched, enqueue rejections, ...), switched on and off at
+# runtime with enabled: when off the model only checks the flag. The phases nest (depart contains choice and
+# enqueue, the step contains everything), so each one has its total time and its own time without the inner
+# ones: the own time of the step is the time out of the other phases. During the simulated time capture (start,
+# end) the whole model is also profiled by cProfile and its allocations traced by tracemalloc: the window is
+# in seconds, not time steps, since the event mode skips the time steps where nothing happens: it opens at the
+# first computed time step from its start (however late) and closes at the first one reaching its end
+
+class PhaseProfiler:
+    def __init__(self, enabled=True, capture=None, path=None, top=30):
+        self.enabled = enabled
+        self.capture = capture  # (start, end) simulated time [s] profiled by cProfile and tracemalloc, None for none
+        self.path = path  # directory of the report, next to the run output (recorder, metrics) by default
+        self.top = top  # functions and allocations in the report
+
+        self.total = defaultdict(float)  # [s]
+        self.own = defaultdict(float)  # [s]
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.inner = []  # time spent in the inner phases of each open phase [s]
+
+        self.profile = None  # cProfile.Profile of the capture window, while it is open
+        self.captured = None  # (start, end) simulated time actually captured [s]
+        self.functions = None  # pstats report of the capture window
+        self.allocations = None  # top allocations of the capture window
+        self.tracing = False  # tracemalloc started by the capture window
+        self.peak_memory = None  # peak traced memory of the capture window [bytes]
+
+    def start(self):
+        self.inner.append(0.0)
+        return time.perf_counter()
+
+    def stop(self, phase, start):
+        elapsed = time.perf_counter() - start
+        inner = self.inner.pop()
+
+        self.total[phase] += elapsed
+        self.own[phase] += elapsed - inner
+        self.calls[phase] += 1
+        if self.inner:
+            self.inner[-1] += elapsed
+
+    def count(self, counter, n=1):
+        self.counters[counter] += int(n)
+
+    def begin_step(self, now):
+        # now: simulated time at the start of the time step [s], the window opens at the first one after its start
+        if self.capture is None or self.profile is not None or self.captured is not None or now < self.capture[0]:
+            return
+
+        self.captured = (now, None)
+        self.tracing = not tracemalloc.is_tracing()  # stopped at the end if started here
+        if self.tracing:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def end_step(self, now, last=False):
+        # now: simulated time at the end of the time step [s], the window closes at the first one reaching its
+        # end, or at the last one of the run
+        if self.profile is None or (now < self.capture[1] and not last):
+            return
+
+        self.profile.disable()
+        self.captured = (self.captured[0], now)
+
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(self.top)
+        self.functions = stream.getvalue()
+        self.profile = None
+
+        snapshot = tracemalloc.take_snapshot()
+        _, self.peak_memory = tracemalloc.get_traced_memory()
+        if self.tracing:
+            tracemalloc.stop()
+
+        self.allocations = [{"line": str(stat.traceback), "size": stat.size, "count": stat.count}
+                            for stat in snapshot.statistics("lineno")[:self.top]]
+
+    def reset(self):
+        self.total.clear()
+        self.own.clear()
+        self.calls.clear()
+        self.counters.clear()
+
+    def summary(self):
+        # one row per phase, the longest first: total and own time [s], calls and share of the step time
+        frame = pd.DataFrame({
+            "total": pd.Series(self.total, dtype=float),
+            "own": pd.Series(self.own, dtype=float),
+            "calls": pd.Series(self.calls, dtype="int64"),
+        })
+        frame.index.name = "phase"
+
+        step = self.total.get("step", 0.0)
+        frame["share"] = frame["own"] / step if step > 0 else float("nan")
+
+        return frame.sort_values("own", ascending=False)
+
+    def report(self):
+        return {
+            "phases": self.summary().reset_index().to_dict(orient="records"),
+            "counters": dict(self.counters),
+            "capture": self.captured,
+            "peak_memory": self.peak_memory,
+            "allocations": self.allocations,
+        }
+
+    def write(self, directory=None):
+        # profile.json with the report and, after a capture window, profile.txt with the cProfile functions
+        directory = self.path or directory
+        if directory is None:
+            return None
+
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "profile.json"), "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+        if self.functions is not None:
+            with open(os.path.join(directory, "profile.txt"), "w") as f:
+                f.write(self.functions)
+
+        return directory
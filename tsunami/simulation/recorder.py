@@ -0,0 +1,201 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from tsunami.simulation.agents import EVACUATED, MOVING
+
+AGENT_COLUMNS = ["x", "y", "edge", "status"]
+LINK_COLUMNS = ["n", "v"]
+
+
+# History of a run: the position, edge and status of every agent and the occupancy and velocity of every
+# link, one row per recorded time step (every `every` time steps). The rows are buffered in preallocated
+# arrays of about chunk_bytes (or chunk_steps rows) and each full buffer is written as a compressed chunk, so
+# the memory is bounded whatever the number of agents and the simulation time. The directory holds
+# chunk-<i>.npz, the agents and links at the last flush (district, shelter, storage capacity and length)
+# in static.npz and meta.json, read by Trajectories. The chunks are npz rather than Parquet (as the metrics)
+# because a row is a whole array per column: npz stores the time steps x agents arrays as they are, a table
+# would need a column per agent or a long format with an agent id per value
+
+CHUNK_BYTES = 64 * 2 ** 20
+
+
+class TrajectoryRecorder:
+    def __init__(self, directory, every=1, chunk_bytes=CHUNK_BYTES, chunk_steps=None, agents=True, links=True):
+        self.directory = directory
+        self.every = every
+        self.chunk_bytes = chunk_bytes
+        self.chunk_steps = chunk_steps  # rows of the buffers, from chunk_bytes unless given
+        self.columns = (AGENT_COLUMNS if agents else []) + (LINK_COLUMNS if links else [])
+
+        self.buffers = None  # allocated at the first record, when the sizes are known
+        self.static = None
+        self.model = None
+        self.size = 0
+        self.chunks = 0
+        self.meta = None
+
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "chunk-*.npz")):
+            os.remove(path)
+
+    def __allocate(self, model):
+        n, e = len(model.agents), len(model.edges)
+
+        # bytes of a row: k and time, x, y, edge and status of the agents, n and v of the links
+        row = 16 + (13 * n if "x" in self.columns else 0) + (8 * e if "n" in self.columns else 0)
+        if self.chunk_steps is None:
+            self.chunk_steps = max(int(self.chunk_bytes // row), 1)
+        steps = self.chunk_steps
+
+        self.buffers = {"k": np.zeros(steps, dtype=np.int64), "time": np.zeros(steps, dtype=np.float64)}
+        if "x" in self.columns:
+            self.buffers["x"] = np.zeros((steps, n), dtype=np.float32)
+            self.buffers["y"] = np.zeros((steps, n), dtype=np.float32)
+            self.buffers["edge"] = np.zeros((steps, n), dtype=np.int32)
+            self.buffers["status"] = np.zeros((steps, n), dtype=np.int8)
+        if "n" in self.columns:
+            self.buffers["n"] = np.zeros((steps, e), dtype=np.int32)
+            self.buffers["v"] = np.zeros((steps, e), dtype=np.float32)
+
+        self.meta = {"T": model.T, "every": self.every, "agents": n, "edges": e, "columns": self.columns}
+
+        self.static = {
+            "district": np.asarray(model.agent_district, dtype=np.int32),
+            "capacity": np.asarray(model.link_state()[1], dtype=np.int64),
+            "length": np.array([model.G.edges[e]["length"] for e in model.edges], dtype=np.float64),
+        }
+        self.model = model
+
+    def record(self, model):
+        if model.k % self.every != 0:
+            return
+
+        if self.buffers is None:
+            self.__allocate(model)
+
+        i = self.size
+        b = self.buffers
+        b["k"][i] = model.k
+        b["time"][i] = model.now()
+
+        if "x" in b:
+            b["x"][i], b["y"][i], b["edge"][i], b["status"][i] = model.agent_state()
+        if "n" in b:
+            n, _, v = model.link_state()
+            b["n"][i], b["v"][i] = n, v
+
+        self.size += 1
+        if self.size == self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        if self.size == 0:
+            return
+
+        path = os.path.join(self.directory, f"chunk-{self.chunks:06d}.npz")
+        np.savez_compressed(path, **{name: b[:self.size] for name, b in self.buffers.items()})
+        self.chunks += 1
+        self.size = 0
+
+        # the shelters can change when they are full
+        self.static["shelter"] = np.asarray(self.model.agent_shelters(), dtype=np.int32)
+        np.savez(os.path.join(self.directory, "static.npz"), **self.static)
+
+        self.meta["chunks"] = self.chunks
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+
+# Queries over a recorded history, computed chunk by chunk
+
+class Trajectories:
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        self.paths = [os.path.join(directory, f"chunk-{i:06d}.npz") for i in range(self.meta["chunks"])]
+
+        with np.load(os.path.join(directory, "static.npz")) as data:
+            self.static = {name: data[name] for name in data.files}
+
+    def chunks(self, columns):
+        # the columns of each chunk, in time order
+        for path in self.paths:
+            with np.load(path) as data:
+                yield {c: data[c] for c in columns}
+
+    def times(self):
+        return np.concatenate([c["time"] for c in self.chunks(["time"])])
+
+    def positions(self, k):
+        # positions and status of the agents at the recorded time step k
+        for c in self.chunks(["k", "x", "y", "status"]):
+            i = np.flatnonzero(c["k"] == k)
+            if len(i) > 0:
+                return c["x"][i[0]], c["y"][i[0]], c["status"][i[0]]
+
+        raise ValueError(f"Time step {k} not recorded!")
+
+    def agent_stats(self):
+        # per agent: evacuation time (nan if not evacuated), walked distance, time spent moving on the edges
+        # and average speed, from the consecutive recorded positions
+        n = self.meta["agents"]
+
+        start = None
+        evacuation_time = np.full(n, np.nan)
+        distance = np.zeros(n)
+        moving_time = np.zeros(n)
+        status = np.zeros(n, dtype=np.int8)
+
+        last = None  # last row of the previous chunk
+        for c in self.chunks(["time", "x", "y", "edge", "status"]):
+            time, x, y = c["time"], c["x"].astype(np.float64), c["y"].astype(np.float64)
+            on_edge = (c["status"] == MOVING) & (c["edge"] >= 0)
+
+            if start is None:
+                start = time[0]
+            if last is not None:
+                time = np.concatenate(([last[0]], time))
+                x, y = np.vstack((last[1], x)), np.vstack((last[2], y))
+                on_edge = np.vstack((last[3], on_edge))
+
+            # the moves between two rows where the agent is on the network
+            both = on_edge[1:] & on_edge[:-1]
+            step = np.hypot(np.diff(x, axis=0), np.diff(y, axis=0))
+            distance += np.where(both, step, 0.0).sum(axis=0)
+            moving_time += (both * np.diff(time)[:, None]).sum(axis=0)
+
+            evacuated = c["status"] == EVACUATED
+            first = np.argmax(evacuated, axis=0)
+            new = np.isnan(evacuation_time) & evacuated.any(axis=0)
+            evacuation_time[new] = c["time"][first[new]] - start
+
+            status = c["status"][-1]
+            last = (time[-1], x[-1], y[-1], on_edge[-1])
+
+        speed = np.divide(distance, moving_time, out=np.full(n, np.nan), where=moving_time > 0)
+
+        return pd.DataFrame({
+            "status": status,
+            "evacuation_time": evacuation_time,
+            "distance": distance,
+            "moving_time": moving_time,
+            "speed": speed,
+        })
+
+    def link_series(self, column="n", edges=None):
+        # occupancy ("n") or velocity ("v") of the edges (all by default) at each recorded time step
+        if column not in LINK_COLUMNS:
+            raise ValueError(f"Unknown link column {column}!")
+
+        frames = []
+        for c in self.chunks(["time", column]):
+            values = c[column] if edges is None else c[column][:, edges]
+            frames.append(pd.DataFrame(values, index=c["time"],
+                                       columns=np.arange(self.meta["edges"]) if edges is None else edges))
+
+        return pd.concat(frames)
@@ -0,0 +1,179 @@
+import os
+import shutil
+import subprocess
+from abc import ABC, abstractmethod
+
+import matplotlib
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from PIL import GifImagePlugin, Image
+
+
+# Headless renderer of the agents on the street network. The edges are drawn once with a LineCollection
+# on an Agg canvas (no window, whatever the pyplot backend) and the rendered background is cached: each
+# frame restores it and draws only the markers of the agents, whose data is updated from the positions
+
+class FrameRenderer:
+    def __init__(self, model, figsize=(9, 9), dpi=100, bgcolor="#0b3496", edge_color="#999999",
+                 edge_linewidth=1, agent_color="g", agent_size=6):
+        self.model = model
+
+        self.fig = Figure(figsize=figsize, dpi=dpi, facecolor=bgcolor)
+        self.canvas = FigureCanvasAgg(self.fig)
+
+        self.ax = self.fig.add_axes([0, 0, 1, 1])
+        self.ax.set_facecolor(bgcolor)
+        self.ax.set_axis_off()
+        self.ax.set_aspect("equal")
+
+        # the polylines of the edges, as the agents are placed along them
+        geometry = model.geometry
+        xy = np.column_stack((geometry.x, geometry.y))
+        lines = [xy[s:e + 1] for s, e in zip(geometry.start, geometry.end)]
+        self.ax.add_collection(LineCollection(lines, colors=edge_color, linewidths=edge_linewidth))
+
+        margin = 0.02 * max(np.ptp(geometry.x), np.ptp(geometry.y))
+        self.ax.set_xlim(geometry.x.min() - margin, geometry.x.max() + margin)
+        self.ax.set_ylim(geometry.y.min() - margin, geometry.y.max() + margin)
+
+        # markers of a Line2D are drawn in a single call, faster than a scatter of the same points
+        self.agents, = self.ax.plot([], [], linestyle="none", marker="o", markersize=agent_size ** 0.5,
+                                    color=agent_color, alpha=0.8, markeredgewidth=0, animated=True)
+
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    def size(self):
+        # width and height of the frames [px]
+        return self.canvas.get_width_height()
+
+    def render(self):
+        # RGBA frame (height x width x 4) of the agents at the current simulation time, a view of the canvas
+        # overwritten by the next frame
+        x, y = self.model.get_positions()
+        self.agents.set_data(x, y)
+
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.agents)
+
+        return np.asarray(self.canvas.buffer_rgba())
+
+    def animate(self, path, steps, fps=10, every=1):
+        # render a frame every `every` time steps while running the model, streamed to the writer of the path
+        with get_writer(path, self.size(), fps) as writer:
+            writer.write(self.render())
+
+            for k in range(steps):
+                self.model.advance()
+
+                if (k + 1) % every == 0:
+                    writer.write(self.render())
+
+        return path
+
+
+# Frame writers: each one receives the RGBA frames one by one and writes them as they come, so the frames
+# are never kept in memory
+
+class FrameWriter(ABC):
+    @abstractmethod
+    def write(self, frame):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PNGWriter(FrameWriter):
+    def __init__(self, directory):
+        self.directory = directory
+        self.n = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, frame):
+        Image.fromarray(frame).save(os.path.join(self.directory, f"frame_{self.n:06d}.png"), compress_level=1)
+        self.n += 1
+
+
+class FFMpegWriter(FrameWriter):
+    def __init__(self, path, size, fps, codec="libx264"):
+        # the raw frames are piped to ffmpeg (animation.ffmpeg_path of matplotlib)
+        ffmpeg = shutil.which(matplotlib.rcParams["animation.ffmpeg_path"])
+        if ffmpeg is None:
+            raise ValueError("ffmpeg not found!")
+
+        width, height = size
+        args = [ffmpeg, "-y", "-loglevel", "error",
+                "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-"]
+        if path.endswith(".gif"):
+            args += [path]
+        else:
+            # yuv420p needs even sizes
+            args += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-vcodec", codec, "-pix_fmt", "yuv420p", path]
+
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self.process.stdin.write(frame.tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise ValueError(f"ffmpeg exited with {self.process.returncode}!")
+
+
+class GIFWriter(FrameWriter):
+    def __init__(self, path, fps):
+        # each frame is quantized to its own palette and appended to the file (Pillow without ffmpeg)
+        self.path = path
+        self.duration = 1000 / fps  # [ms]
+        self.file = open(path, "wb")
+        self.n = 0
+
+    def write(self, frame):
+        image = Image.fromarray(frame).convert("RGB").quantize(colors=64)
+
+        if self.n == 0:
+            header, _ = GifImagePlugin.getheader(image)
+            self.file.write(b"".join(header))
+            # NETSCAPE2.0 extension: loop forever
+            self.file.write(b"!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+
+        data = GifImagePlugin.getdata(image, duration=self.duration, include_color_table=True)
+        self.file.write(b"".join(data))
+        self.n += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self.file.write(b";")  # trailer
+        self.file.close()
+
+
+def get_writer(path, size, fps):
+    # by the extension: a video through ffmpeg, a GIF (through ffmpeg if available) or a PNG sequence
+    # in the directory
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == ".gif":
+        if shutil.which(matplotlib.rcParams["animation.ffmpeg_path"]) is not None:
+            return FFMpegWriter(path, size, fps)
+        return GIFWriter(path, fps)
+
+    if ext in (".mp4", ".mkv", ".avi", ".mov", ".webm"):
+        return FFMpegWriter(path, size, fps, codec="libvpx-vp9" if ext == ".webm" else "libx264")
+
+    if ext != "":
+        raise ValueError(f"Unknown frame format {ext}!")
+
+    return PNGWriter(path)
@@ -1,11 +1,219 @@
-# Find the route for a specific agent based on the queues
+from abc import ABC, abstractmethod
 
-class RouteHandler:
-    def __init__(self, graph, agent):
-        self.G = graph
-        self.agent = agent
+import numpy as np
 
-        pass
 
-    def get_next_intersection(self):
+def ranges(starts, counts):
+    # concatenated ranges [start, start + count) and the range of each element
+    group = np.repeat(np.arange(len(starts)), counts)
+    index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+
+    return group, index
+
+
+# Find the route for a specific agent based on the queues. A RouteHandler is the policy giving the next
+# edge (id in the model) of an agent at a node: the decisions are lookups in next-hop tables indexed by
+# node (and target), kept up to date with update() when the costs of some edges change. The target is
+# the row of the agent's destination in model.routes and next_node the next node of its route (-1 if none).
+# The policies implement get_next_intersection (and next_edges when they can do better than one at a time)
+
+class RouteHandler(ABC):
+    def __init__(self, model):
+        self.model = model
+
+        n = len(model.nodes)
+        self.costs = self.__get_costs(np.arange(len(model.edges)))
+
+        # cheapest of the parallel edges of each (u, v) pair: pair_edge[edge_pair[e]]
+        keys = model.edge_u.astype(np.int64) * n + model.edge_v
+        self.pairs, self.edge_pair = np.unique(keys, return_inverse=True)
+        self.pair_edge = np.full(len(self.pairs), -1, dtype=np.int64)
+
+        # the edges of pair p are pair_edges[pair_start[p]:pair_start[p + 1]]
+        self.pair_edges = np.argsort(self.edge_pair, kind="stable")
+        self.pair_start = np.searchsorted(self.edge_pair[self.pair_edges], np.arange(len(self.pairs) + 1))
+        self.__update_pairs(np.arange(len(self.pairs)))
+
+    def __get_costs(self, edges):
+        if self.model.links is not None:
+            return self.model.links.t[edges].astype(np.float64)
+
+        return np.array([self.model.G.edges[self.model.edges[i]]["cost"] for i in edges], dtype=np.float64)
+
+    def __update_pairs(self, pairs):
+        starts = self.pair_start[pairs]
+        group, index = ranges(starts, self.pair_start[pairs + 1] - starts)
+        edges = self.pair_edges[index]
+
+        # the first of the cheapest edges of each pair, in the graph order
+        order = np.lexsort((edges, self.costs[edges], group))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = group[order[1:]] != group[order[:-1]]
+        best = edges[order[first]]
+
+        self.pair_edge[pairs] = np.where(np.isinf(self.costs[best]), -1, best)
+
+    def pair_index(self, u, v):
+        # index of the (u, v) pair, -1 if there is no edge from u to v
+        key = np.int64(u) * len(self.model.nodes) + v
+        i = np.searchsorted(self.pairs, key)
+        if i >= len(self.pairs) or self.pairs[i] != key:
+            return -1
+
+        return i
+
+    def pair_indices(self, u, v):
+        # same as pair_index for arrays of nodes
+        keys = np.asarray(u, dtype=np.int64) * len(self.model.nodes) + v
+        i = np.minimum(np.searchsorted(self.pairs, keys), len(self.pairs) - 1)
+
+        return np.where(self.pairs[i] == keys, i, -1)
+
+    def update(self, edges):
+        # the costs of the edges changed
+        edges = np.asarray(edges, dtype=np.int64)
+        if len(edges) == 0:
+            return
+
+        self.costs[edges] = self.__get_costs(edges)
+        self.__update_pairs(np.unique(self.edge_pair[edges]))
+
+    @abstractmethod
+    def get_next_intersection(self, node, target=-1, next_node=-1):
+        # next edge id, -1 if there is none
         pass
+
+    def next_edges(self, nodes, targets, next_nodes):
+        # get_next_intersection of many agents at once
+        return np.array([self.get_next_intersection(n, t, x) for n, t, x in zip(nodes, targets, next_nodes)],
+                        dtype=np.int64)
+
+
+# The cheapest out edge of the node, ignoring the destination
+
+class GreedyCost(RouteHandler):
+    def __init__(self, model):
+        super().__init__(model)
+
+        self.best = np.full(len(model.nodes), -1, dtype=np.int64)
+        self.__update_nodes(np.arange(len(model.nodes)))
+
+    def __update_nodes(self, nodes):
+        # the first of the cheapest out edges, in the graph order
+        starts = self.model.out_start[nodes]
+        counts = self.model.out_start[nodes + 1] - starts
+        nodes, starts, counts = nodes[counts > 0], starts[counts > 0], counts[counts > 0]
+
+        group, index = ranges(starts, counts)
+        edges = self.model.out_edges[index]
+
+        order = np.lexsort((index, self.costs[edges], group))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = group[order[1:]] != group[order[:-1]]
+        best = edges[order[first]]
+
+        self.best[nodes] = np.where(np.isinf(self.costs[best]), -1, best)
+
+    def update(self, edges):
+        super().update(edges)
+
+        if len(edges) > 0:
+            self.__update_nodes(np.unique(self.model.edge_u[np.asarray(edges, dtype=np.int64)]))
+
+    def get_next_intersection(self, node, target=-1, next_node=-1):
+        return self.best[node]
+
+    def next_edges(self, nodes, targets, next_nodes):
+        return self.best[nodes]
+
+
+# The agent follows its route (computed by the model), the cheapest of the parallel edges toward the next
+# node. Without a route the agent falls back to the greedy choice
+
+class StaticRoute(GreedyCost):
+    def get_next_intersection(self, node, target=-1, next_node=-1):
+        if next_node < 0:
+            return super().get_next_intersection(node)
+
+        p = self.pair_index(node, next_node)
+        return self.pair_edge[p] if p >= 0 else -1
+
+    def next_edges(self, nodes, targets, next_nodes):
+        edges = self.best[nodes]
+
+        routed = next_nodes >= 0
+        p = self.pair_indices(nodes[routed], next_nodes[routed])
+        edges[routed] = np.where(p >= 0, self.pair_edge[p], -1)
+
+        return edges
+
+
+# The agent goes down the distance field of its destination: the next hop of the shortest path tree
+# rooted at the target, read from a targets x nodes table of (u, v) pairs rebuilt only when the trees
+# are recomputed. Without a target (or if it is unreachable) the agent falls back to the greedy choice
+
+class ShelterDistanceField(GreedyCost):
+    def __init__(self, model):
+        super().__init__(model)
+
+        self.field = None  # field[target, node] pair toward the target (-1 if unreachable)
+        self.version = None  # version of the trees used to build the field
+
+    def __update_field(self):
+        routes = self.model.routes
+        n = len(self.model.nodes)
+
+        nodes = np.broadcast_to(np.arange(n), routes.next.shape)
+        keys = nodes.astype(np.int64) * n + routes.next
+
+        i = np.minimum(np.searchsorted(self.pairs, keys), len(self.pairs) - 1)
+        self.field = np.where((routes.next >= 0) & (self.pairs[i] == keys), i, -1).astype(np.int32)
+        self.version = routes.version
+
+    def get_next_intersection(self, node, target=-1, next_node=-1):
+        routes = self.model.routes
+        if target < 0 or routes is None or routes.next is None:
+            return super().get_next_intersection(node)
+
+        if self.version != routes.version:
+            self.__update_field()
+
+        p = self.field[target, node]
+        if p < 0 or self.pair_edge[p] < 0:
+            return super().get_next_intersection(node)
+
+        return self.pair_edge[p]
+
+    def next_edges(self, nodes, targets, next_nodes):
+        edges = self.best[nodes]
+
+        routes = self.model.routes
+        if routes is None or routes.next is None:
+            return edges
+
+        if self.version != routes.version:
+            self.__update_field()
+
+        targeted = np.flatnonzero(targets >= 0)
+        p = self.field[targets[targeted], nodes[targeted]]
+        e = np.where(p >= 0, self.pair_edge[p], -1)
+        edges[targeted[e >= 0]] = e[e >= 0]
+
+        return edges
+
+
+POLICIES = {
+    "greedy": GreedyCost,
+    "route": StaticRoute,
+    "field": ShelterDistanceField,
+}
+
+
+def get_route_handler(policy, model):
+    if isinstance(policy, RouteHandler):
+        return policy
+
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown route policy {policy}!")
+
+    return POLICIES[policy](model)
@@ -0,0 +1,175 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+
+# Shortest path trees rooted at the destinations (shelters). A single reverse Dijkstra per destination
+# gives the distance and the next hop from every node, so the routes of all the agents are read from
+# the trees instead of running a search per agent. The trees are recomputed only when the destinations
+# change or when the edge costs change more than the threshold (relative), or updated incrementally
+# recomputing only the trees that contain (or could use) the changed edges
+
+class ShortestPathTrees:
+    def __init__(self, graph, weight="cost", threshold=0.1):
+        self.G = graph
+        self.weight = weight
+        self.threshold = threshold
+
+        self.nodes = np.array(list(graph.nodes))
+        self.index = {n: i for i, n in enumerate(self.nodes)}
+
+        self.edges = list(graph.edges)
+        self.u = np.array([self.index[u] for u, _, _ in self.edges], dtype=np.int64)
+        self.v = np.array([self.index[v] for _, v, _ in self.edges], dtype=np.int64)
+
+        self.targets = np.zeros(0, dtype=np.int64)  # node indices of the roots
+        self.costs = None  # edge costs used to compute the trees
+
+        self.dist = None  # dist[i, n] cost from node n to the target i
+        self.next = None  # next[i, n] next node from n toward the target i (-1 if unreachable)
+        self.version = 0  # increased every time the trees change
+
+    def get_costs(self):
+        return np.fromiter((self.G.edges[e][self.weight] for e in self.edges), dtype=np.float64,
+                           count=len(self.edges))
+
+    def set_targets(self, targets):
+        targets = np.unique([self.index[n] for n in targets]).astype(np.int64)
+
+        if not np.array_equal(targets, self.targets):
+            self.targets = targets
+            self.costs = None
+
+    def is_valid(self, costs):
+        if self.costs is None:
+            return False
+
+        # closed (infinite cost) edges are removed from the graph
+        closed = np.isinf(costs)
+        if np.any(closed != np.isinf(self.costs)):
+            return False
+
+        change = np.abs(costs[~closed] - self.costs[~closed]) / np.maximum(self.costs[~closed], 1e-9)
+        return change.max(initial=0.0) <= self.threshold
+
+    def refresh(self, costs=None, force=False):
+        # recompute the trees only if needed, returns True if they have been recomputed
+        if costs is None:
+            costs = self.get_costs()
+
+        if not force and self.is_valid(costs):
+            return False
+
+        self.costs = np.array(costs, dtype=np.float64)
+        self.dist, self.next = self.__compute(self.costs)
+        self.version += 1
+
+        return True
+
+    def update(self, costs=None, tolerance=None):
+        # incremental refresh: only the edges whose cost changed more than the tolerance (relative) are
+        # updated and only the trees they can modify are recomputed. Returns the changed edges
+        if costs is None:
+            costs = self.get_costs()
+        if tolerance is None:
+            tolerance = self.threshold
+
+        if self.costs is None:
+            self.refresh(costs, force=True)
+            return np.arange(len(self.edges))
+
+        costs = np.asarray(costs, dtype=np.float64)
+        old = self.costs
+
+        finite = np.isfinite(costs) & np.isfinite(old)
+        change = np.full(len(costs), np.inf)
+        change[finite] = np.abs(costs[finite] - old[finite]) / np.maximum(old[finite], 1e-9)
+        change[np.isinf(costs) & np.isinf(old)] = 0.0
+        changed = np.flatnonzero(change > tolerance)
+
+        if len(changed) == 0:
+            return changed
+
+        affected = self.__affected(changed, old[changed], costs[changed])
+
+        self.costs = old.copy()
+        self.costs[changed] = costs[changed]
+
+        if np.any(affected):
+            dist, pred = self.__compute(self.costs, self.targets[affected])
+            self.dist[affected] = dist
+            self.next[affected] = pred
+            self.version += 1
+
+        return changed
+
+    def __affected(self, edges, old, new):
+        # a tree changes if a more expensive edge was in it or if a cheaper edge gives a shorter path
+        du = self.dist[:, self.u[edges]]  # targets x edges
+        dv = self.dist[:, self.v[edges]]
+
+        with np.errstate(invalid="ignore"):
+            in_tree = (self.next[:, self.u[edges]] == self.v[edges]) & np.isclose(du, dv + old)
+            increased = in_tree & (new > old)
+            decreased = (new < old) & (dv + new < du - 1e-9)
+
+        return np.any(increased | decreased, axis=1)
+
+    def __compute(self, costs, targets=None):
+        if targets is None:
+            targets = self.targets
+
+        n = len(self.nodes)
+
+        # keep the cheapest of the parallel edges, reversed so the search starts from the targets
+        order = np.lexsort((costs, self.v, self.u))
+        pairs = self.u[order] * n + self.v[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = pairs[1:] != pairs[:-1]
+        order = order[first & np.isfinite(costs[order])]
+
+        # explicit zeros would be dropped from the sparse matrix
+        weights = np.maximum(costs[order], 1e-9)
+        reverse = csr_matrix((weights, (self.v[order], self.u[order])), shape=(n, n))
+
+        dist, pred = dijkstra(reverse, directed=True, indices=targets, return_predecessors=True)
+        pred[pred < 0] = -1
+
+        return dist, pred.astype(np.int32)
+
+    def target_row(self, target):
+        i = np.searchsorted(self.targets, self.index[target])
+        if i >= len(self.targets) or self.targets[i] != self.index[target]:
+            raise ValueError(f"Node {target} is not a target!")
+
+        return i
+
+    def path(self, orig, target):
+        # nodes of the shortest path from orig to target or None if not reachable
+        path = self.path_index(self.index[orig], self.index[target])
+        if path is None:
+            return None
+
+        return self.nodes[path].tolist()
+
+    def path_index(self, orig, target):
+        # same as path with node indices
+        row = self.next[self.target_row(self.nodes[target])]
+
+        n = orig
+        path = [n]
+        while n != target:
+            n = row[n]
+            if n < 0:
+                return None
+            path.append(n)
+
+        return path
+
+    def nearest(self, nodes):
+        # nearest target of each node and its cost (inf if no target is reachable)
+        idx = np.array([self.index[n] for n in nodes], dtype=np.int64)
+        dist = self.dist[:, idx]
+        best = np.argmin(dist, axis=0)
+
+        return self.nodes[self.targets[best]], dist[best, np.arange(len(idx))]
@@ -0,0 +1,55 @@
+import heapq
+import math
+
+
+# Global heap of link exit events (tick, edge index) used by the event driven loop of the model.
+# Each edge has at most one valid event, the older ones are left in the heap and skipped when popped
+
+class EventScheduler:
+    def __init__(self, time_step):
+        self.T = time_step
+
+        self.events = []
+        self.scheduled = {}  # edge index -> tick of its valid event
+
+    def tick_of(self, time):
+        # first time step k such that k * T >= time
+        k = math.ceil(time / self.T)
+        if k * self.T < time:
+            k += 1
+        elif (k - 1) * self.T >= time:
+            k -= 1
+
+        return k
+
+    def schedule(self, e, k):
+        if e in self.scheduled and self.scheduled[e] <= k:
+            return
+
+        self.scheduled[e] = k
+        heapq.heappush(self.events, (k, e))
+
+    def __discard_stale(self):
+        while len(self.events) > 0:
+            k, e = self.events[0]
+            if self.scheduled.get(e) == k:
+                return
+            heapq.heappop(self.events)
+
+    def next_tick(self):
+        self.__discard_stale()
+
+        if len(self.events) == 0:
+            return None
+
+        return self.events[0][0]
+
+    def pop(self, k):
+        # edges due at time step k in increasing index order, including the ones scheduled meanwhile
+        while self.next_tick() == k:
+            _, e = heapq.heappop(self.events)
+            del self.scheduled[e]
+            yield e
+
+    def __len__(self):
+        return len(self.scheduled)
@@ -0,0 +1,102 @@
+import re
+
+import geopandas as gpd
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def load_shelters(path):
+    # the csv contains the shelters (with their accomodation) and, after an empty line, the evacuation
+    # hills and stairs without a capacity; the separators and the lat/lon order are not consistent
+    names, lat, lon, capacity = [], [], [], []
+
+    with open(path, encoding="utf-8") as f:
+        blocks = re.split(r"\n\s*\n", f.read().strip())
+
+    for block in blocks:
+        lines = block.strip().splitlines()
+        header = [h.strip() for h in re.split(r"[;,]", lines[0])]
+
+        for line in lines[1:]:
+            values = [v.strip() for v in re.split(r"[;,]", line)]
+            row = dict(zip(header, values))
+            coords = [float(v) for v in values if re.fullmatch(r"-?\d+\.\d+", v)]
+
+            if len(coords) < 2:
+                continue
+
+            # the longitude is the one out of the latitude range
+            y, x = coords[:2] if abs(coords[1]) > 90 else coords[1::-1]
+
+            names.append(row["Name"])
+            lat.append(y)
+            lon.append(x)
+            capacity.append(float(row["Accomodation"]) if row.get("Accomodation") else np.inf)
+
+    return gpd.GeoDataFrame(
+        {"name": names, "capacity": capacity},
+        geometry=gpd.points_from_xy(lon, lat),
+        crs="epsg:4326"
+    )
+
+
+def snap_shelters(graph, shelters):
+    # nearest graph node of each shelter
+    if "crs" in graph.graph:
+        shelters = shelters.to_crs(graph.graph["crs"])
+
+    nodes = list(graph.nodes)
+    xy = np.array([(graph.nodes[n]["x"], graph.nodes[n]["y"]) for n in nodes], dtype=np.float64)
+    tree = cKDTree(xy)
+    _, idx = tree.query(np.column_stack((shelters.geometry.x, shelters.geometry.y)))
+
+    return np.array(nodes)[idx]
+
+
+# Shelters snapped to the nearest graph node (KD-tree built once over the node coordinates), unless the
+# nodes are given. The capacity of a shelter without an accomodation is unlimited
+
+class Shelters:
+    def __init__(self, graph, shelters, nodes=None):
+        self.names = shelters["name"].to_numpy()
+        self.nodes = snap_shelters(graph, shelters) if nodes is None else np.asarray(nodes)
+        self.capacity = shelters["capacity"].to_numpy(dtype=np.float64)
+        self.occupancy = np.zeros(len(self.nodes), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def is_full(self, s):
+        return self.occupancy[s] >= self.capacity[s]
+
+    def available(self):
+        return self.occupancy < self.capacity
+
+    def assign(self, dist):
+        # capacity aware assignment: dist[s, a] is the network cost from the origin of agent a to the
+        # shelter s. At each round the unassigned agents try their next nearest shelter, which accepts
+        # the nearest of them up to its remaining capacity
+        S, A = dist.shape
+        preferences = np.argsort(dist, axis=0)
+        remaining = self.capacity - self.occupancy
+
+        assigned = np.full(A, -1, dtype=np.int64)
+        for r in range(S):
+            agents = np.flatnonzero(assigned < 0)
+            if len(agents) == 0:
+                break
+
+            shelters = preferences[r, agents]
+            d = dist[shelters, agents]
+            reachable = np.isfinite(d)
+            agents, shelters, d = agents[reachable], shelters[reachable], d[reachable]
+
+            order = np.lexsort((d, shelters))
+            agents, shelters = agents[order], shelters[order]
+            rank = np.arange(len(shelters)) - np.searchsorted(shelters, shelters, side="left")
+
+            accepted = rank < remaining[shelters]
+            assigned[agents[accepted]] = shelters[accepted]
+            remaining -= np.bincount(shelters[accepted], minlength=S)
+
+        return assigned
@@ -0,0 +1,79 @@
+import numpy as np
+
+
+def group_starts(groups):
+    # index of the first element of the run of each element (the groups are contiguous)
+    starts = np.ones(len(groups), dtype=bool)
+    starts[1:] = groups[1:] != groups[:-1]
+
+    return np.maximum.accumulate(np.where(starts, np.arange(len(groups)), 0))
+
+
+def queue_prefix(groups, ok):
+    # the elements of each group before its first not ok one (the groups are queues in order)
+    bad = np.cumsum(~ok)
+    before = bad - ~ok
+
+    return bad == before[group_starts(groups)]
+
+
+def apportion(supply, demand, weights, pair_link):
+    # share of the supply of each link among its pairs (sorted by link) proportional to the weights with
+    # the largest remainder method, never more than the demand: what is not used is left to the next round
+    total = np.bincount(pair_link, weights=weights, minlength=len(supply))
+    exact = supply[pair_link] * weights / np.maximum(total[pair_link], 1e-12)
+    share = np.minimum(np.floor(exact).astype(np.int64), demand)
+
+    left = supply - np.bincount(pair_link, weights=share, minlength=len(supply)).astype(np.int64)
+
+    # one more to the pairs with the largest remainder still below their demand
+    below = share < demand
+    order = np.lexsort((np.arange(len(share)), share - exact, ~below, pair_link))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.searchsorted(pair_link[order], pair_link[order])
+    share += below & (rank < left[pair_link])
+
+    # the whole demand when the supply is enough
+    enough = np.bincount(pair_link, weights=demand, minlength=len(supply)) <= supply
+
+    return np.where(enough[pair_link], demand, share)
+
+
+def resolve_transfers(upstream, downstream, free, flow):
+    # Node transfer of the ready agents of several links. upstream is the link of each candidate (the
+    # candidates of a link are contiguous and in queue order), downstream the link it wants to enter (-1 if
+    # it leaves the network), free the free space and flow the flow capacity of every link. When a link
+    # cannot take all its candidates its free space is shared among the upstream links proportionally to
+    # their flow capacity, then each upstream link lets out the longest prefix of its queue that fits.
+    # Returns the accepted candidates
+    entering = np.flatnonzero(downstream >= 0)
+
+    # (downstream, upstream) pairs, with the rank of each candidate in its pair
+    order = np.lexsort((entering, upstream[entering], downstream[entering]))
+    keys = np.stack((downstream[entering][order], upstream[entering][order]))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = np.any(keys[:, 1:] != keys[:, :-1], axis=0)
+    pair = np.cumsum(first) - 1
+
+    rank = np.empty(len(entering), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.flatnonzero(first)[pair]
+
+    demand = np.bincount(pair).astype(np.int64)
+    pair_down, pair_up = keys[0][first], keys[1][first]
+
+    links, pair_link = np.unique(pair_down, return_inverse=True)
+    share = apportion(free[links].astype(np.int64), demand, flow[pair_up], pair_link)
+
+    ok = downstream == -1
+    ok[entering[order]] = rank[order] < share[pair]
+
+    return queue_prefix(upstream, ok)
+
+
+def group_rank(groups):
+    # position of each element among the elements of its group, in order
+    order = np.argsort(groups, kind="stable")
+    rank = np.empty(len(groups), dtype=np.int64)
+    rank[order] = np.arange(len(groups)) - np.searchsorted(groups[order], groups[order])
+
+    return rank
@@ -0,0 +1,267 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pygame
+
+MAX_SPEED = 1.66  # free flow speed of the links [m / s]
+
+LEVELS = 16  # color levels of the edges, an edge is redrawn only when its level changes
+
+
+def edge_state(model):
+    # velocity and used storage capacity [0, 1] of every edge
+    n, c, v = model.link_state()
+    return v, np.divide(n, c, out=np.zeros(len(n)), where=c > 0)
+
+
+# Snapshot of the model published by the simulation thread: the positions of the moving agents (the
+# first n of the preallocated arrays) and the state of the edges
+
+class Snapshot:
+    def __init__(self, agents, edges):
+        self.k = 0
+        self.time = 0.0
+        self.evacuated = 0
+        self.dead = 0
+
+        self.n = 0
+        self.x = np.zeros(agents, dtype=np.float64)
+        self.y = np.zeros(agents, dtype=np.float64)
+
+        self.v = np.zeros(edges, dtype=np.float64)
+        self.used = np.zeros(edges, dtype=np.float64)
+
+    def fill(self, model):
+        x, y = model.get_positions()
+        self.n = len(x)
+        self.x[:self.n] = x
+        self.y[:self.n] = y
+
+        self.v[:], self.used[:] = edge_state(model)
+
+        self.k = model.k
+        self.time = model.now()
+        self.evacuated = model.evacuated_agents
+        self.dead = model.dead_agents
+
+
+# Three snapshots: the simulation fills the back one while the viewer draws the front one, and the latest
+# published one waits in between. Each side only swaps its own snapshot with the latest under the lock, so
+# neither waits for the other to fill or draw a snapshot (only for a swap)
+
+class TripleBuffer:
+    def __init__(self, agents, edges):
+        self.front = Snapshot(agents, edges)  # drawn by the viewer
+        self.latest = Snapshot(agents, edges)  # last published
+        self.back = Snapshot(agents, edges)  # filled by the simulation
+
+        self.lock = threading.Lock()
+        self.version = 0  # number of published snapshots
+        self.taken = 0  # version of the front snapshot
+
+    def publish(self, model):
+        self.back.fill(model)
+
+        with self.lock:
+            self.latest, self.back = self.back, self.latest
+            self.version += 1
+
+    def take(self):
+        # the latest published snapshot (the front one if there is no newer one) and its version
+        with self.lock:
+            if self.taken != self.version:
+                self.front, self.latest = self.latest, self.front
+                self.taken = self.version
+
+            return self.front, self.taken
+
+
+# Runs the model in the step mode in a background thread, publishing a snapshot every `every` time steps.
+# With a speed the simulation is slowed down to that many simulated seconds per second, otherwise it runs
+# as fast as it can: the frame rate of the viewer does not depend on it
+
+class SimulationThread(threading.Thread):
+    def __init__(self, model, buffer, every=1, speed=None):
+        super().__init__(daemon=True)
+
+        self.model = model
+        self.buffer = buffer
+        self.every = every
+        self.speed = speed
+
+        self.stopped = threading.Event()
+        self.done = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        k = self.model.k
+
+        while not self.stopped.is_set() and not self.model.finished():
+            self.model.advance()
+
+            if (self.model.k - k) % self.every == 0:
+                self.buffer.publish(self.model)
+
+            if self.speed is not None:
+                wait = (self.model.k - k) * self.model.T / self.speed - (time.perf_counter() - start)
+                if wait > 0:
+                    self.stopped.wait(wait)
+
+        self.buffer.publish(self.model)
+        self.model.finish()
+        self.done.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+# Live pygame view of a running model. The edge polylines are projected once into screen space and drawn
+# on a network surface colored by the velocity (or the occupancy) of the links, redrawing only the edges
+# whose color changed; every frame blits it and writes the agent dots straight into the pixels. With
+# headless the SDL dummy video driver is used (a virtual framebuffer, for testing and screenshots)
+
+class LiveViewer:
+    def __init__(self, model, size=(900, 900), fps=30, color_by="speed", dot_size=2, headless=False,
+                 bgcolor=(11, 52, 150), agent_color=(0, 200, 0)):
+        if color_by not in ("speed", "occupancy"):
+            raise ValueError(f"Unknown edge color {color_by}!")
+
+        if headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+
+        self.model = model
+        self.size = size
+        self.fps = fps
+        self.color_by = color_by
+        self.dot_size = dot_size
+        self.bgcolor = bgcolor
+        self.agent_color = np.array(agent_color, dtype=np.uint8)
+
+        # slow (red) to free flow (grey) or empty (grey) to full (red)
+        red, grey = np.array([220, 40, 40]), np.array([150, 150, 150])
+        t = np.linspace(0, 1, LEVELS)[:, None]
+        lut = red + t * (grey - red) if color_by == "speed" else grey + t * (red - grey)
+        self.colors = [tuple(c) for c in lut.astype(int)]
+
+        self.__project()
+
+        self.buffer = TripleBuffer(len(model.agents), len(model.edges))
+        self.buffer.front.fill(model)
+        self.version = -1  # version of the drawn snapshot
+
+        pygame.init()
+        self.screen = pygame.display.set_mode(size)
+        self.frame = pygame.Surface(size)
+        self.network = pygame.Surface(size)
+        self.network.fill(bgcolor)
+        self.levels = np.full(len(model.edges), -1, dtype=np.int64)  # drawn color level of each edge
+
+        self.frames = 0
+
+    def __project(self):
+        # screen coordinates of the polylines, computed once (y grows downward on the screen)
+        geometry = self.model.geometry
+        width, height = self.size
+
+        x0, x1 = geometry.x.min(), geometry.x.max()
+        y0, y1 = geometry.y.min(), geometry.y.max()
+        self.scale = 0.95 * min(width / max(x1 - x0, 1e-9), height / max(y1 - y0, 1e-9))
+        self.origin = (x0 + x1) / 2, (y0 + y1) / 2
+
+        x, y = self.to_screen(geometry.x, geometry.y)
+        points = np.column_stack((x, y)).tolist()
+        self.lines = [points[s:e + 1] for s, e in zip(geometry.start, geometry.end)]
+
+    def to_screen(self, x, y):
+        width, height = self.size
+        sx = (np.asarray(x) - self.origin[0]) * self.scale + width / 2
+        sy = height / 2 - (np.asarray(y) - self.origin[1]) * self.scale
+
+        return sx.astype(np.int64), sy.astype(np.int64)
+
+    def __edge_levels(self, snapshot):
+        if self.color_by == "speed":
+            value = np.clip(snapshot.v / MAX_SPEED, 0, 1)
+        else:
+            value = np.clip(snapshot.used, 0, 1)
+
+        return np.minimum((value * LEVELS).astype(np.int64), LEVELS - 1)
+
+    def __draw_network(self, snapshot):
+        levels = self.__edge_levels(snapshot)
+        changed = np.flatnonzero(levels != self.levels)
+
+        # over many changes it is cheaper to start over
+        if len(changed) > len(levels) // 2:
+            self.network.fill(self.bgcolor)
+            changed = np.arange(len(levels))
+
+        draw = pygame.draw.lines
+        for e in changed:
+            draw(self.network, self.colors[levels[e]], False, self.lines[e])
+
+        self.levels = levels
+
+    def __draw_agents(self, snapshot):
+        x, y = self.to_screen(snapshot.x[:snapshot.n], snapshot.y[:snapshot.n])
+        width, height = self.size
+
+        pixels = pygame.surfarray.pixels3d(self.frame)  # [x, y, rgb] view of the frame
+        for dx in range(self.dot_size):
+            for dy in range(self.dot_size):
+                px, py = x + dx, y + dy
+                inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+                pixels[px[inside], py[inside]] = self.agent_color
+        del pixels
+
+    def draw(self):
+        # draw the latest snapshot, the network surface only if a new one was published
+        snapshot, version = self.buffer.take()
+
+        if version != self.version:
+            self.__draw_network(snapshot)
+            self.version = version
+
+        self.frame.blit(self.network, (0, 0))
+        self.__draw_agents(snapshot)
+
+        pygame.display.set_caption(
+            f"t = {snapshot.time:.0f} s   evacuated {snapshot.evacuated}   dead {snapshot.dead}"
+        )
+
+        self.screen.blit(self.frame, (0, 0))
+        pygame.display.flip()
+        self.frames += 1
+
+    def screenshot(self, path):
+        pygame.image.save(self.screen, path)
+
+    def run(self, every=1, speed=None, max_frames=None, close_on_finish=False):
+        # show the model while it runs in the background (escape or closing the window stops it), returns
+        # the number of drawn frames
+        simulation = SimulationThread(self.model, self.buffer, every, speed)
+        simulation.start()
+
+        clock = pygame.time.Clock()
+        running = True
+        while running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                    running = False
+
+            self.draw()
+            clock.tick(self.fps)
+
+            if max_frames is not None and self.frames >= max_frames:
+                running = False
+            if close_on_finish and simulation.done.is_set() and self.version == self.buffer.version:
+                running = False
+
+        simulation.stop()
+        return self.frames
+
+    def close(self):
+        pygame.quit()
@@ -1,2 +1,115 @@
+import numpy as np
+import pandas as pd
+
+WIDTH = "walk_width"  # edge attribute of the walkable width stored by the preprocessing [m]
+
+LANE_WIDTH = 3.0  # [m]
+SIDEWALK_WIDTH = 1.5  # [m]
+MIN_WIDTH = 1.0  # [m]
+
+# carriageway width of each highway type when the lanes and the width are not tagged [m]
+HIGHWAY_WIDTH = {
+    "motorway": 7.0,
+    "trunk": 7.0,
+    "primary": 7.0,
+    "secondary": 6.5,
+    "tertiary": 6.0,
+    "unclassified": 5.0,
+    "residential": 5.0,
+    "living_street": 4.0,
+    "pedestrian": 5.0,
+    "service": 3.5,
+    "track": 3.0,
+    "road": 3.0,
+    "cycleway": 2.0,
+    "footway": 2.0,
+    "corridor": 2.0,
+    "bridleway": 2.0,
+    "path": 1.5,
+    "steps": 1.5,
+}
+DEFAULT_WIDTH = 3.0  # unknown highway type [m]
+
+SIDEWALKS = {"both": 2, "left": 1, "right": 1, "yes": 1}  # sidewalks not mapped as separate ways
+SIDE_SIDEWALKS = {"yes": 1}  # sidewalk:left and sidewalk:right
+
+TAGS = ["highway", "lanes", "width", "sidewalk", "sidewalk:left", "sidewalk:right"]
+
+
+def tag_values(tag):
+    # one row per value of the tag (index = edge position): the lists left by consolidate_intersections
+    # are either python lists or their string representation after a graphml round trip. A comma between
+    # two digits is a decimal comma ("3,5"), the items of a list are separated by a comma and a space
+    values = tag.where(tag.notna(), "").astype(str)
+    values = values.str.replace(r"[\[\]'\"]", "", regex=True).str.replace(r"(?<=\d),(?=\d)", ".", regex=True)
+    values = values.str.split(r"[,;|]").explode().str.strip()
+
+    return values[values != ""]
+
+
+def tag_numbers(tag):
+    # largest number of each edge (nan if there is none), e.g. "2", "3.5 m", ['2', '3']
+    values = tag_values(tag)
+    numbers = pd.to_numeric(values.str.extract(r"(\d+(?:\.\d+)?)", expand=False), errors="coerce")
+
+    return numbers.groupby(level=0).max().reindex(tag.index)
+
+
+def tag_frame(data):
+    # DataFrame of the tags of the edge attribute dicts
+    return pd.DataFrame.from_records([{t: d.get(t) for t in TAGS} for d in data], columns=TAGS)
+
+
+def get_widths(edges):
+    # walkable width [m] of the edges of a DataFrame with (some of) the highway, lanes, width and sidewalk
+    # (or sidewalk:left and sidewalk:right) tags: the carriageway width (the width tag, else lanes * LANE_WIDTH, else by highway type, the largest
+    # of the consolidated values) plus the sidewalks
+    edges = edges.reindex(columns=TAGS).reset_index(drop=True)
+
+    highway = tag_values(edges["highway"]).map(HIGHWAY_WIDTH).fillna(DEFAULT_WIDTH)
+    highway = highway.groupby(level=0).max().reindex(edges.index).fillna(DEFAULT_WIDTH)
+
+    lanes = tag_numbers(edges["lanes"]) * LANE_WIDTH
+    width = tag_numbers(edges["width"])
+    carriageway = width.fillna(lanes).fillna(highway)
+
+    # the sidewalk tag, else one per side tagged with sidewalk:left and sidewalk:right
+    sidewalk = tag_values(edges["sidewalk"]).map(SIDEWALKS).fillna(0)
+    sidewalk = sidewalk.groupby(level=0).max().reindex(edges.index)
+    sides = sum(tag_values(edges[t]).map(SIDE_SIDEWALKS).fillna(0).groupby(level=0).max().reindex(edges.index)
+                .fillna(0) for t in ("sidewalk:left", "sidewalk:right"))
+    sidewalk = sidewalk.fillna(sides) * SIDEWALK_WIDTH
+
+    return np.maximum((carriageway + sidewalk).to_numpy(dtype=np.float64), MIN_WIDTH)
+
+
+def road_widths(graph, edges=None):
+    # walkable width of the edges (keys, in the graph order by default): the one stored by the
+    # preprocessing if every edge has it, otherwise estimated from the tags
+    if edges is None:
+        edges = list(graph.edges)
+
+    data = [graph.edges[e] for e in edges]
+    if all(WIDTH in d for d in data):
+        return np.array([d[WIDTH] for d in data], dtype=np.float64)
+
+    return get_widths(tag_frame(data))
+
+
+def add_way_tags(settings):
+    # the tags of the width model not kept by osmnx by default (sidewalk), to set before downloading
+    settings.useful_tags_way = list(dict.fromkeys(list(settings.useful_tags_way) + TAGS))
+
+
+def set_widths(graph):
+    # store the walkable width in the edges, read by the simulation instead of the tags
+    widths = get_widths(tag_frame([d for _, _, d in graph.edges(data=True)]))
+
+    for (_, _, d), width in zip(graph.edges(data=True), widths):
+        d[WIDTH] = width
+
+    return widths
+
+
 def get_width(highway_type, n_lanes=0):
-    return 2
+    return get_widths(pd.DataFrame({"highway": [highway_type], "lanes": [n_lanes if n_lanes else None]}))[0]